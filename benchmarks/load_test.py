@@ -0,0 +1,417 @@
+"""
+Load test for the bot: runs the real handlers of main.py against a local fake
+Telegram Bot API and a fake OpenAI-compatible server, then reports throughput,
+latency percentiles and memory growth.
+
+Each simulated user is one private chat in a fixed mode. It sends a message,
+waits for the bot's final reply, thinks for a while and sends the next one.
+
+    python benchmarks/load_test.py --users 200 --messages 20
+    python benchmarks/load_test.py --mix analysis=1 --llm-latency 1.5 --llm-error-rate 0.05
+    python benchmarks/load_test.py --set SENTIMENT_BATCHING=True --set LOCAL_SENTIMENT=True
+
+No real API is contacted and no config.py is needed.
+"""
+import os
+import sys
+import ast
+import json
+import time
+import types
+import random
+import asyncio
+import argparse
+from urllib.parse import parse_qsl
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+MODES = ("analysis", "advice", "rizz")
+SENTENCES = [
+    "I had such a great time with you tonight",
+    "why haven't you texted me back all day",
+    "hey what are you up to",
+    "I'm not sure how I feel about this anymore",
+    "how do I ask her out without making it weird",
+    "my date cancelled again and I'm kind of annoyed",
+    "you looked amazing today",
+    "is it too soon to say I love you after two months",
+]
+# Replies sent before the real answer, they don't end a request
+PLACEHOLDERS = ("processing...", "processing advice...")
+
+
+class FakeHTTPServer:
+    """
+    Minimal HTTP/1.1 server with keep-alive. handle(method, path, body) returns
+    (status, content_type, body bytes) and may sleep to simulate latency.
+    """
+
+    def __init__(self, handle):
+        self.handle = handle
+        self.port = None
+        self._server = None
+
+    async def start(self) -> None:
+        self._server = await asyncio.start_server(self._handle_connection, "127.0.0.1", 0)
+        self.port = self._server.sockets[0].getsockname()[1]
+
+    async def stop(self) -> None:
+        self._server.close()
+        await self._server.wait_closed()
+
+    async def _handle_connection(self, reader, writer) -> None:
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, path = request_line.decode("latin-1").split()[:2]
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                length = int(headers.get("content-length") or 0)
+                body = await reader.readexactly(length) if length else b""
+                status, content_type, data = await self.handle(method, path, headers, body)
+                writer.write(
+                    f"HTTP/1.1 {status} X\r\nContent-Type: {content_type}\r\n"
+                    f"Content-Length: {len(data)}\r\n\r\n".encode("latin-1") + data
+                )
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+
+def sample_latency(median: float, sigma: float) -> float:
+    """
+    Log-normal latency around median; sigma 0 gives a constant latency.
+    """
+    return median * random.lognormvariate(0, sigma) if sigma else median
+
+
+class FakeOpenRouter:
+    """
+    OpenAI-compatible chat completions endpoint with configurable latency and error rate.
+    """
+
+    def __init__(self, latency: float, jitter: float, error_rate: float):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.requests = 0
+        self.errors = 0
+        self.prompt_tokens = 0
+        self.server = FakeHTTPServer(self.handle)
+
+    async def handle(self, method, path, headers, body):
+        self.requests += 1
+        request = json.loads(body)
+        await asyncio.sleep(sample_latency(self.latency, self.jitter))
+        if random.random() < self.error_rate:
+            self.errors += 1
+            return 500, "application/json", b'{"error": {"message": "fake upstream error"}}'
+        prompt = sum(len(str(m.get("content", ""))) for m in request.get("messages", [])) // 4
+        self.prompt_tokens += prompt
+        text = self.reply(request)
+        usage = {"prompt_tokens": prompt, "completion_tokens": len(text) // 4, "total_tokens": prompt + len(text) // 4}
+        if request.get("stream"):
+            chunks = [
+                {"id": "fake", "object": "chat.completion.chunk", "created": 0, "model": request["model"],
+                 "choices": [{"index": 0, "delta": {"content": word}, "finish_reason": None}]}
+                for word in text.split(" ")
+            ]
+            if request.get("stream_options", {}).get("include_usage"):
+                chunks.append({"id": "fake", "object": "chat.completion.chunk", "created": 0,
+                               "model": request["model"], "choices": [], "usage": usage})
+            data = "".join(f"data: {json.dumps(chunk)}\n\n" for chunk in chunks) + "data: [DONE]\n\n"
+            return 200, "text/event-stream", data.encode()
+        response = {
+            "id": "fake", "object": "chat.completion", "created": 0, "model": request["model"],
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": "stop"}],
+            "usage": usage,
+        }
+        return 200, "application/json", json.dumps(response).encode()
+
+    @staticmethod
+    def reply(request: dict) -> str:
+        system = request["messages"][0]["content"]
+        analysis = "**Sentiment:** Positive\n**Score:** 6/10\nThe message sounds friendly and warm."
+        if "JSON array" in system:
+            # Batched sentiment request, one numbered sentence per line after the header
+            count = request["messages"][-1]["content"].count("\n")
+            return json.dumps([{"sentiment": "positive", "score": 6, "analysis": analysis}] * count)
+        if "sentiment" in system:
+            return analysis
+        return "That sounds like a good start! Keep it light and ask how their day went. How about you?"
+
+
+class FakeTelegram:
+    """
+    The part of the Bot API the bot calls. Every sent or edited message is
+    passed to on_message(chat_id, text).
+    """
+
+    def __init__(self, latency: float, on_message):
+        self.latency = latency
+        self.on_message = on_message
+        self.calls = 0
+        self.message_id = 0
+        self.server = FakeHTTPServer(self.handle)
+
+    async def handle(self, method, path, headers, body):
+        self.calls += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        api_method = path.rsplit("/", 1)[-1]
+        if headers.get("content-type", "").startswith("application/json"):
+            params = json.loads(body or b"{}")
+        else:
+            params = dict(parse_qsl(body.decode()))
+        if api_method == "getMe":
+            result = {"id": 1, "is_bot": True, "first_name": "LoadTest", "username": "load_test_bot"}
+        elif api_method in ("sendMessage", "editMessageText"):
+            chat_id = int(params["chat_id"])
+            self.message_id += 1
+            result = {
+                "message_id": int(params.get("message_id", self.message_id)),
+                "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private"},
+                "text": params.get("text", ""),
+            }
+            self.on_message(chat_id, params.get("text", ""))
+        else:
+            result = True
+        return 200, "application/json", json.dumps({"ok": True, "result": result}).encode()
+
+
+def rss_bytes() -> int:
+    """
+    Current resident memory of this process.
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        import resource
+        # ru_maxrss is the peak, in kilobytes on Linux and bytes on macOS
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
+
+
+def percentile(values: list, p: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(p / 100 * len(values)))]
+
+
+def parse_mix(text: str) -> dict:
+    mix = {}
+    for part in text.split(","):
+        mode, _, weight = part.partition("=")
+        if mode not in MODES:
+            raise argparse.ArgumentTypeError(f"Unknown mode {mode}, expected one of {', '.join(MODES)}")
+        mix[mode] = float(weight or 1)
+    return mix
+
+
+def parse_setting(text: str) -> tuple:
+    name, _, value = text.partition("=")
+    try:
+        return name, ast.literal_eval(value)
+    except (ValueError, SyntaxError):
+        return name, value
+
+
+def make_config(args, telegram_port: int, openrouter_port: int) -> types.ModuleType:
+    """
+    Builds the config module main.py imports, pointing it at the fake servers.
+    """
+    config = types.ModuleType("config")
+    config.TELEGRAM_TOKEN = "123456:load-test"
+    config.TELEGRAM_BASE_URL = f"http://127.0.0.1:{telegram_port}/bot"
+    config.OPENROUTER_API_KEYS = [f"load-test-key-{i}" for i in range(args.keys)]
+    config.OPENROUTER_BASE_URL = f"http://127.0.0.1:{openrouter_port}/v1"
+    config.MODEL = "fake/sentiment"
+    config.MODEL2 = "fake/chat"
+    config.LOG_LEVEL = "WARNING"
+    config.RETRY_BASE_DELAY = 0.05
+    # Each user waits for its reply, so limits and coalescing would only distort the numbers
+    config.RATE_LIMIT_USER = None
+    config.RATE_LIMIT_CHAT = None
+    config.COALESCE_QUIET_PERIOD = 0
+    config.STREAM_REPLIES = False
+    for name, value in args.settings:
+        setattr(config, name, value)
+    return config
+
+
+class LoadTest:
+    def __init__(self, args):
+        self.args = args
+        self.waiting = {}
+        self.latencies = {mode: [] for mode in MODES}
+        self.failed = 0
+        self.shed = 0
+        self.timeouts = 0
+        self.update_id = 0
+
+    def on_message(self, chat_id: int, text: str) -> None:
+        """
+        Ends the request waiting on chat_id at the first text that isn't a
+        placeholder. With STREAM_REPLIES that is the first streamed edit, so
+        the latency is the time to first output.
+        """
+        if text in PLACEHOLDERS:
+            return
+        future = self.waiting.pop(chat_id, None)
+        if future is None or future.done():
+            return
+        if text.startswith("Sorry"):
+            self.failed += 1
+        elif text.startswith("Whoa, slow down"):
+            self.shed += 1
+        future.set_result(None)
+
+    def make_update(self, chat_id: int, text: str) -> dict:
+        self.update_id += 1
+        return {
+            "update_id": self.update_id,
+            "message": {
+                "message_id": self.update_id,
+                "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private"},
+                "from": {"id": chat_id, "is_bot": False, "first_name": f"user{chat_id}"},
+                "text": text,
+            },
+        }
+
+    async def user(self, app, main, chat_id: int, mode: str, deadline: float) -> None:
+        from telegram import Update
+
+        await main.chat_modes.set(chat_id, mode)
+        await asyncio.sleep(random.uniform(0, self.args.ramp_up))
+        for i in range(self.args.messages):
+            if time.monotonic() > deadline:
+                break
+            text = random.choice(SENTENCES)
+            if random.random() >= self.args.repeat:
+                # Unique text so the sentiment cache and deduplication don't answer it
+                text = f"{text} ({chat_id}-{i})"
+            future = asyncio.get_running_loop().create_future()
+            self.waiting[chat_id] = future
+            start = time.monotonic()
+            await app.update_queue.put(Update.de_json(self.make_update(chat_id, text), app.bot))
+            try:
+                await asyncio.wait_for(future, self.args.timeout)
+            except asyncio.TimeoutError:
+                self.timeouts += 1
+                self.waiting.pop(chat_id, None)
+                continue
+            self.latencies[mode].append(time.monotonic() - start)
+            if self.args.think_time:
+                await asyncio.sleep(random.expovariate(1 / self.args.think_time))
+
+    async def run(self) -> dict:
+        args = self.args
+        openrouter = FakeOpenRouter(args.llm_latency, args.llm_jitter, args.llm_error_rate)
+        telegram = FakeTelegram(args.telegram_latency, self.on_message)
+        await openrouter.server.start()
+        await telegram.server.start()
+        sys.modules["config"] = make_config(args, telegram.server.port, openrouter.server.port)
+        import main
+
+        app = main.build_application()
+        await app.initialize()
+        await app.start()
+
+        modes = random.choices(list(args.mix), weights=list(args.mix.values()), k=args.users)
+        rss_start = rss_bytes()
+        start = time.monotonic()
+        deadline = start + args.duration if args.duration else float("inf")
+        await asyncio.gather(*(
+            self.user(app, main, 1000 + i, mode, deadline) for i, mode in enumerate(modes)
+        ))
+        elapsed = time.monotonic() - start
+        rss_end = rss_bytes()
+
+        await app.stop()
+        await app.shutdown()
+        await main.shutdown(app)
+        await telegram.server.stop()
+        await openrouter.server.stop()
+
+        all_latencies = [value for values in self.latencies.values() for value in values]
+        return {
+            "users": args.users,
+            "completed": len(all_latencies),
+            "failed": self.failed,
+            "shed": self.shed,
+            "timeouts": self.timeouts,
+            "seconds": elapsed,
+            "throughput": len(all_latencies) / elapsed if elapsed else 0.0,
+            "latency": {
+                name: {p: percentile(values, p) for p in (50, 95, 99)}
+                for name, values in [("all", all_latencies)] + list(self.latencies.items()) if values
+            },
+            "llm_requests": openrouter.requests,
+            "llm_errors": openrouter.errors,
+            "telegram_calls": telegram.calls,
+            "rss_start": rss_start,
+            "rss_end": rss_end,
+            "rss_growth": rss_end - rss_start,
+        }
+
+
+def print_report(result: dict) -> None:
+    print(f"users            {result['users']}")
+    print(f"completed        {result['completed']} in {result['seconds']:.1f}s")
+    print(f"throughput       {result['throughput']:.1f} messages/s")
+    print(f"failed/shed      {result['failed']} / {result['shed']} (timeouts {result['timeouts']})")
+    print(f"llm requests     {result['llm_requests']} ({result['llm_errors']} injected errors)")
+    print(f"telegram calls   {result['telegram_calls']}")
+    print(f"memory           {result['rss_start'] / 2**20:.1f} MiB -> {result['rss_end'] / 2**20:.1f} MiB "
+          f"({result['rss_growth'] / 2**20:+.1f} MiB)")
+    print(f"{'latency (s)':16} {'p50':>8} {'p95':>8} {'p99':>8}")
+    for name, values in result["latency"].items():
+        print(f"{name:16} {values[50]:8.3f} {values[95]:8.3f} {values[99]:8.3f}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Load test the bot against fake Telegram and OpenRouter servers.")
+    parser.add_argument("--users", type=int, default=100, help="simulated users, one chat each")
+    parser.add_argument("--messages", type=int, default=10, help="messages sent by each user")
+    parser.add_argument("--duration", type=float, default=0, help="stop sending after this many seconds (0: no limit)")
+    parser.add_argument("--mix", type=parse_mix, default=parse_mix("analysis=0.5,advice=0.3,rizz=0.2"),
+                        help="share of users per mode, e.g. analysis=0.5,advice=0.3,rizz=0.2")
+    parser.add_argument("--think-time", type=float, default=0.5, help="mean seconds between a reply and the next message")
+    parser.add_argument("--ramp-up", type=float, default=1.0, help="users start spread over this many seconds")
+    parser.add_argument("--repeat", type=float, default=0.0, help="share of messages reusing a common sentence")
+    parser.add_argument("--timeout", type=float, default=60.0, help="seconds to wait for a reply")
+    parser.add_argument("--keys", type=int, default=3, help="number of fake OpenRouter keys")
+    parser.add_argument("--llm-latency", type=float, default=0.8, help="median fake LLM latency in seconds")
+    parser.add_argument("--llm-jitter", type=float, default=0.5, help="log-normal sigma of the LLM latency")
+    parser.add_argument("--llm-error-rate", type=float, default=0.0, help="share of LLM requests answered with 500")
+    parser.add_argument("--telegram-latency", type=float, default=0.02, help="fake Bot API latency in seconds")
+    parser.add_argument("--set", dest="settings", type=parse_setting, action="append", default=[],
+                        metavar="NAME=VALUE", help="override a config.py setting, e.g. SENTIMENT_BATCHING=True")
+    parser.add_argument("--json", help="also write the results to this file")
+    parser.add_argument("--seed", type=int, help="random seed for repeatable runs")
+    args = parser.parse_args()
+
+    if args.seed is not None:
+        random.seed(args.seed)
+    result = asyncio.run(LoadTest(args).run())
+    print_report(result)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(result, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
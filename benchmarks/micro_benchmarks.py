@@ -0,0 +1,267 @@
+"""
+Micro-benchmarks for the code that runs on every message: reply formatting,
+the mode lookup and admission in text_handler, and conversation context
+appends and window builds. Messages and conversations are sized like real
+LLM replies and chats.
+
+    python benchmarks/micro_benchmarks.py                    # run and print
+    python benchmarks/micro_benchmarks.py --save             # also store as the baseline
+    python benchmarks/micro_benchmarks.py --compare          # fail if slower than the baseline
+    python benchmarks/micro_benchmarks.py -k format --compare --threshold 0.1
+
+The baseline (benchmarks/baseline.json by default) is specific to the machine
+it was saved on, so save one before making changes and compare after.
+"""
+import os
+import sys
+import json
+import gc
+import time
+import types
+import asyncio
+import argparse
+import platform
+import statistics
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+
+ANALYSIS_REPLY = (
+    "**Sentiment:** Positive\n**Score:** 7/10\n"
+    "The message is warm and appreciative, with a hint of nervousness about what comes next."
+)
+PARAGRAPH = (
+    "**Be genuine.** Ask about something they mentioned last time, it shows you were listening. "
+    "Keep it light, suggest a specific plan like coffee on Saturday, and give them an easy way to say "
+    "yes or no. If they seem busy, don't take it personally & try again later <3\n"
+)
+# Typical advice reply, one close to Telegram's 4096 character limit and one that needs splitting
+ADVICE_REPLY = PARAGRAPH * 4
+LONG_REPLY = PARAGRAPH * 12
+OVERSIZED_REPLY = PARAGRAPH * 36
+QUESTION = "She replied 'haha maybe' when I asked her out for Saturday, what should I text back?"
+
+
+def make_config() -> types.ModuleType:
+    """
+    Minimal config so main.py can be imported; nothing is sent anywhere.
+    """
+    config = types.ModuleType("config")
+    config.TELEGRAM_TOKEN = "123456:benchmark"
+    config.OPENROUTER_API_KEYS = ["benchmark-key"]
+    config.MODEL = "benchmark/sentiment"
+    config.MODEL2 = "benchmark/chat"
+    config.LOG_LEVEL = "WARNING"
+    return config
+
+
+def benchmarks(main) -> dict:
+    """
+    Returns name -> function for every benchmark. A function is called with
+    the number of iterations to run, coroutine functions are awaited.
+    """
+    from conversation_store import ConversationStore
+    from telegram_format import markdown_to_html, split_html
+
+    def format_reply(text):
+        def run(n):
+            for _ in range(n):
+                markdown_to_html(text)
+        return run
+
+    def split_reply(text):
+        html = markdown_to_html(text)
+
+        def run(n):
+            for _ in range(n):
+                split_html(html)
+        return run
+
+    modes = main.ChatModes()
+    for chat_id in range(10000):
+        modes._modes[chat_id] = ("analysis", "advice", "rizz")[chat_id % 3]
+
+    async def mode_lookup(n):
+        for i in range(n):
+            await modes.get(i % 10000)
+
+    limiter = main.RateLimiter(user_rate=1000.0, user_burst=1000, chat_rate=1000.0, chat_burst=1000)
+
+    def admit(n):
+        for i in range(n):
+            chat_id = i % 10000
+            limiter.admit(chat_id, chat_id)
+
+    def context_append(turns):
+        store = ConversationStore(max_turns=turns)
+        chats = 1000
+
+        async def run(n):
+            if not len(store):
+                for chat_id in range(chats):
+                    await store.start(chat_id, main.prompts["advice"])
+                    for _ in range(turns):
+                        await store.append(chat_id, "user", QUESTION)
+            for i in range(n):
+                await store.append(i % chats, "assistant" if i % 2 else "user", ADVICE_REPLY if i % 2 else QUESTION)
+        return run
+
+    def window_build(turns):
+        store = ConversationStore(max_turns=turns)
+
+        async def run(n):
+            conversation = await store.get(0)
+            if conversation is None:
+                conversation = await store.start(0, main.prompts["rizz"])
+                for i in range(turns):
+                    await store.append(0, "assistant" if i % 2 else "user", ADVICE_REPLY if i % 2 else QUESTION)
+            for _ in range(n):
+                main.context_window.build(conversation)
+        return run
+
+    def context_save(turns):
+        store = ConversationStore(max_turns=turns)
+
+        async def run(n):
+            conversation = await store.get(0)
+            if conversation is None:
+                conversation = await store.start(0, main.prompts["rizz"])
+                for i in range(turns):
+                    await store.append(0, "assistant" if i % 2 else "user", ADVICE_REPLY if i % 2 else QUESTION)
+            for _ in range(n):
+                # What a state backend write serializes after every turn
+                conversation.to_json()
+        return run
+
+    return {
+        "format_analysis_reply": format_reply(ANALYSIS_REPLY),
+        "format_advice_reply": format_reply(ADVICE_REPLY),
+        "format_long_reply": format_reply(LONG_REPLY),
+        "format_split_long_reply": split_reply(LONG_REPLY),
+        "format_split_oversized_reply": split_reply(OVERSIZED_REPLY),
+        "dispatch_mode_lookup": mode_lookup,
+        "dispatch_rate_limit_admit": admit,
+        "context_append_10_turns": context_append(10),
+        "context_append_40_turns": context_append(40),
+        "context_window_40_turns": window_build(40),
+        "context_save_40_turns": context_save(40),
+    }
+
+
+def measure(loop, function, number: int) -> float:
+    """
+    Seconds per call of running function(number) once.
+    """
+    # Collections triggered by earlier allocations would land on random rounds
+    gc.collect()
+    gc.disable()
+    try:
+        start = time.perf_counter()
+        if asyncio.iscoroutinefunction(function):
+            loop.run_until_complete(function(number))
+        else:
+            function(number)
+        return (time.perf_counter() - start) / number
+    finally:
+        gc.enable()
+
+
+def run_benchmark(loop, function, rounds: int, min_time: float) -> dict:
+    """
+    Calibrates the iterations so one round takes about min_time, then times
+    rounds rounds. Like pytest-benchmark, min is the least noisy figure.
+    """
+    measure(loop, function, 1)
+    number = 1
+    while measure(loop, function, number) * number < min_time:
+        number *= 2
+    times = [measure(loop, function, number) for _ in range(rounds)]
+    return {
+        "min": min(times),
+        "median": statistics.median(times),
+        "stddev": statistics.stdev(times) if rounds > 1 else 0.0,
+        "iterations": number,
+    }
+
+
+def format_time(seconds: float) -> str:
+    for unit, scale in (("s", 1), ("ms", 1e-3), ("us", 1e-6)):
+        if seconds >= scale:
+            return f"{seconds / scale:.2f} {unit}"
+    return f"{seconds / 1e-9:.0f} ns"
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> list:
+    """
+    Prints each benchmark against the baseline and returns the names slower
+    than it by more than threshold (0.2 is 20%).
+    """
+    regressions = []
+    for name, result in results.items():
+        old = baseline.get("benchmarks", {}).get(name)
+        if old is None:
+            print(f"{name:30} no baseline")
+            continue
+        change = result["min"] / old["min"] - 1
+        flag = ""
+        if change > threshold:
+            regressions.append(name)
+            flag = "  REGRESSION"
+        print(f"{name:30} {format_time(old['min']):>10} -> {format_time(result['min']):>10} {change:+7.1%}{flag}")
+    return regressions
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Micro-benchmarks for the per-message hot path.")
+    parser.add_argument("-k", dest="select", help="only run benchmarks whose name contains this")
+    parser.add_argument("--rounds", type=int, default=10, help="timed rounds per benchmark")
+    parser.add_argument("--min-time", type=float, default=0.1, help="seconds per round")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="baseline file to save or compare with")
+    parser.add_argument("--save", action="store_true", help="store the results as the baseline")
+    parser.add_argument("--compare", action="store_true", help="compare with the baseline, exit 1 on regressions")
+    parser.add_argument("--threshold", type=float, default=0.2, help="allowed slowdown before failing (0.2 = 20%%)")
+    args = parser.parse_args()
+
+    sys.modules.setdefault("config", make_config())
+    import main as bot
+
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    results = {}
+    print(f"{'benchmark':30} {'min':>10} {'median':>10} {'ops/s':>12}")
+    for name, function in benchmarks(bot).items():
+        if args.select and args.select not in name:
+            continue
+        result = results[name] = run_benchmark(loop, function, args.rounds, args.min_time)
+        print(f"{name:30} {format_time(result['min']):>10} {format_time(result['median']):>10} "
+              f"{1 / result['min']:12,.0f}")
+    loop.close()
+
+    failed = False
+    if args.compare:
+        if not os.path.exists(args.baseline):
+            parser.error(f"No baseline at {args.baseline}, run with --save first")
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        print(f"\nCompared with {args.baseline} (threshold {args.threshold:.0%})")
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f"{len(regressions)} benchmark(s) slower than the baseline: {', '.join(regressions)}")
+            failed = True
+    if args.save:
+        saved = {"benchmarks": {}}
+        if os.path.exists(args.baseline):
+            with open(args.baseline) as f:
+                saved = json.load(f)
+        # Benchmarks left out with -k keep their previous baseline
+        saved["benchmarks"].update(results)
+        saved["machine"] = {"python": platform.python_version(), "platform": platform.platform()}
+        with open(args.baseline, "w") as f:
+            json.dump(saved, f, indent=2)
+        print(f"\nBaseline saved to {args.baseline}")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,237 @@
+"""
+Scores a large file of messages for sentiment without loading it into memory.
+
+    python bulk_score.py messages.csv scores.jsonl --column text
+    python bulk_score.py messages.txt scores.csv --scorer llm --concurrency 8 --resume
+
+Input can be a text file (one message per line), a CSV file or a JSONL file.
+Results are written as JSONL or CSV (chosen by the output extension) chunk by
+chunk, and a checkpoint file next to the output records how many messages are
+done and how long the output was at that point, so an interrupted run can
+continue with --resume without duplicate or partial rows.
+"""
+import os
+import csv
+import json
+import asyncio
+import logging
+import argparse
+
+from local_sentiment import score_text
+from sentiment_batcher import build_batch_messages, parse_batch_items
+
+logger = logging.getLogger(__name__)
+
+OUTPUT_FIELDS = ["line", "text", "sentiment", "score", "confidence", "error"]
+
+
+def read_messages(path: str, column: str = "text", skipped: list = None):
+    """
+    Yields the messages of a .txt, .csv or .jsonl file one at a time.
+    For CSV and JSONL files, column names the field holding the message.
+    JSONL lines that are not a JSON object are skipped, their line numbers
+    are added to skipped if given.
+    """
+    extension = os.path.splitext(path)[1].lower()
+    with open(path, newline="", encoding="utf-8") as f:
+        if extension == ".csv":
+            for row in csv.DictReader(f):
+                yield row.get(column) or ""
+        elif extension in (".jsonl", ".ndjson"):
+            for number, line in enumerate(f, 1):
+                if not line.strip():
+                    continue
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    record = None
+                if not isinstance(record, dict):
+                    logger.warning("Skipping line %d of %s, it is not a JSON object", number, path)
+                    if skipped is not None:
+                        skipped.append(number)
+                    continue
+                yield str(record.get(column) or "")
+        else:
+            for line in f:
+                yield line.rstrip("\r\n")
+
+
+def chunks(messages, size: int):
+    chunk = []
+    for message in messages:
+        chunk.append(message)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def score_local(texts: list) -> list:
+    """
+    Scores a chunk of messages with the offline lexicon scorer.
+    """
+    results = []
+    for text in texts:
+        result = score_text(text)
+        results.append({
+            "sentiment": result.label.lower(),
+            "score": result.score,
+            "confidence": result.confidence,
+        })
+    return results
+
+
+class LLMScorer:
+    """
+    Scores messages with MODEL, batch_size messages per request and at most
+    concurrency requests in flight.
+    """
+
+    def __init__(self, llm_client, model: str, batch_size: int = 16, concurrency: int = 8, max_attempts: int = 3):
+        self.llm_client = llm_client
+        self.model = model
+        self.batch_size = batch_size
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.max_attempts = max_attempts
+
+    async def score(self, texts: list) -> list:
+        batches = [texts[i:i + self.batch_size] for i in range(0, len(texts), self.batch_size)]
+        results = await asyncio.gather(*(self._score_batch(batch) for batch in batches))
+        return [item for batch in results for item in batch]
+
+    async def _score_batch(self, texts: list) -> list:
+        async with self.semaphore:
+            for attempt in range(self.max_attempts):
+                try:
+                    response = await self.llm_client.create(model=self.model, messages=build_batch_messages(texts))
+                    items = parse_batch_items(response.choices[0].message.content, len(texts))
+                    if items is not None:
+                        return [
+                            {"sentiment": str(item.get("sentiment", "")).lower(), "score": item["score"]}
+                            if item is not None else {"error": "missing result"}
+                            for item in items
+                        ]
+                    logger.error("Attempt %d: Could not parse the batch reply", attempt+1)
+                except Exception as e:
+                    logger.error("Attempt %d: Error during bulk scoring: %s", attempt+1, e)
+        return [{"error": "request failed"} for _ in texts]
+
+
+def read_checkpoint(path: str) -> tuple:
+    """
+    Returns (messages done, output size in bytes when they were done). The size
+    is None for checkpoints written by older versions, which only hold the count.
+    """
+    try:
+        with open(path) as f:
+            data = f.read().strip()
+    except FileNotFoundError:
+        return 0, None
+    if not data.startswith("{"):
+        return int(data or 0), None
+    checkpoint = json.loads(data)
+    return checkpoint["done"], checkpoint["offset"]
+
+
+def write_checkpoint(path: str, done: int, offset: int) -> None:
+    tmp = path + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump({"done": done, "offset": offset}, f)
+    os.replace(tmp, path)
+
+
+async def score_file(input_path: str, output_path: str, scorer=None, column: str = "text",
+                     chunk_size: int = 256, resume: bool = False) -> int:
+    """
+    Scores every message of input_path and writes one record per message to
+    output_path. scorer is a coroutine scoring a list of texts (for example
+    LLMScorer.score); without one the local lexicon scorer is used.
+    Returns the number of messages written by this run.
+
+    With resume, the output is first cut back to its size at the last
+    checkpoint, so rows written after it (a crash in the middle of a chunk or
+    before the checkpoint was saved) are not duplicated.
+    """
+    checkpoint_path = output_path + ".ckpt"
+    done, offset = read_checkpoint(checkpoint_path) if resume else (0, None)
+    as_csv = output_path.lower().endswith(".csv")
+    mode = "a" if resume and done else "w"
+    if mode == "a" and offset is not None and os.path.exists(output_path):
+        with open(output_path, "r+b") as f:
+            f.truncate(offset)
+    written = 0
+    skipped = []
+
+    with open(output_path, mode, newline="", encoding="utf-8") as out:
+        writer = csv.DictWriter(out, fieldnames=OUTPUT_FIELDS) if as_csv else None
+        if writer is not None and mode == "w":
+            writer.writeheader()
+
+        messages = read_messages(input_path, column, skipped)
+        for _ in range(done):
+            if next(messages, None) is None:
+                break
+
+        line = done
+        for chunk in chunks(messages, chunk_size):
+            results = await scorer(chunk) if scorer is not None else score_local(chunk)
+            for text, result in zip(chunk, results):
+                line += 1
+                record = {"line": line, "text": text}
+                record.update(result)
+                if writer is not None:
+                    writer.writerow(record)
+                else:
+                    out.write(json.dumps(record, ensure_ascii=False) + "\n")
+            out.flush()
+            written += len(chunk)
+            write_checkpoint(checkpoint_path, line, out.tell())
+            logger.info("Scored %d messages", line)
+    if skipped:
+        logger.warning("Skipped %d lines of %s that are not JSON objects", len(skipped), input_path)
+    return written
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Score a file of messages for sentiment.")
+    parser.add_argument("input", help=".txt, .csv or .jsonl file with one message per line/row")
+    parser.add_argument("output", help=".jsonl or .csv file to write the scores to")
+    parser.add_argument("--scorer", choices=["local", "llm"], default="local")
+    parser.add_argument("--column", default="text", help="CSV column / JSON field holding the message")
+    parser.add_argument("--chunk-size", type=int, default=256, help="messages scored between checkpoints")
+    parser.add_argument("--batch-size", type=int, default=16, help="messages per LLM request")
+    parser.add_argument("--concurrency", type=int, default=8, help="LLM requests in flight")
+    parser.add_argument("--resume", action="store_true", help="continue from the last checkpoint")
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+        level=logging.INFO
+    )
+
+    async def run() -> None:
+        scorer = None
+        if args.scorer == "llm":
+            import config
+            from llm import close_http_client
+            from key_pool import KeyPool, configured_keys
+            llm_scorer = LLMScorer(
+                KeyPool(configured_keys(config), args.concurrency),
+                config.MODEL,
+                batch_size=args.batch_size,
+                concurrency=args.concurrency,
+            )
+            scorer = llm_scorer.score
+        try:
+            count = await score_file(args.input, args.output, scorer, args.column, args.chunk_size, args.resume)
+            logger.info("Done, wrote %d results to %s", count, args.output)
+        finally:
+            if scorer is not None:
+                await close_http_client()
+
+    asyncio.run(run())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,106 @@
+import time
+import asyncio
+import logging
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+logger = logging.getLogger(__name__)
+
+
+class ChatQueue:
+    """
+    The updates of one chat that are waiting or running.
+    """
+    __slots__ = ("lock", "depth")
+
+    def __init__(self):
+        self.lock = asyncio.Lock()
+        self.depth = 0
+
+
+class ChatScheduler(BaseUpdateProcessor):
+    """
+    Update processor that handles the updates of one chat strictly in the
+    order they arrived while different chats run in parallel.
+
+    At most max_concurrency updates run at once across all chats. Each chat
+    may have max_queue updates waiting or running; further updates for that
+    chat are dropped (and counted) until it catches up. max_pending bounds
+    the updates accepted in total. Updates without a chat run unordered.
+    on_wait, if given, is called with the seconds each update spent queued.
+
+    Use it with ApplicationBuilder().concurrent_updates(ChatScheduler(...)).
+    """
+
+    def __init__(self, max_concurrency: int = 256, max_queue: int = 16, max_pending: int = 10000, on_wait=None):
+        super().__init__(max_pending)
+        self.on_wait = on_wait
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self._running = asyncio.Semaphore(max_concurrency)
+        self._chats = {}
+        self.pending = 0
+        self.active = 0
+        self.processed = 0
+        self.dropped = 0
+        self.max_depth = 0
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+    async def do_process_update(self, update, coroutine) -> None:
+        queued_at = time.monotonic()
+        chat = update.effective_chat if isinstance(update, Update) else None
+        if chat is None:
+            self.pending += 1
+            try:
+                await self._run(coroutine, queued_at)
+            finally:
+                self.pending -= 1
+            return
+
+        queue = self._chats.get(chat.id)
+        if queue is None:
+            queue = self._chats[chat.id] = ChatQueue()
+        if queue.depth >= self.max_queue:
+            self.dropped += 1
+            logger.warning("Dropping update %s, chat %s already has %d queued", update.update_id, chat.id, queue.depth)
+            coroutine.close()
+            return
+        queue.depth += 1
+        self.pending += 1
+        self.max_depth = max(self.max_depth, queue.depth)
+        try:
+            # asyncio.Lock wakes waiters in FIFO order, which keeps the chat's updates in order
+            async with queue.lock:
+                await self._run(coroutine, queued_at)
+        finally:
+            queue.depth -= 1
+            self.pending -= 1
+            if queue.depth == 0:
+                del self._chats[chat.id]
+
+    async def _run(self, coroutine, queued_at: float) -> None:
+        async with self._running:
+            if self.on_wait is not None:
+                self.on_wait(time.monotonic() - queued_at)
+            self.active += 1
+            try:
+                await coroutine
+            finally:
+                self.active -= 1
+                self.processed += 1
+
+    def stats(self) -> dict:
+        return {
+            "active": self.active,
+            "queued": self.pending - self.active,
+            "chats": len(self._chats),
+            "max_chat_depth": self.max_depth,
+            "processed": self.processed,
+            "dropped": self.dropped,
+        }
@@ -0,0 +1,101 @@
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpenError(Exception):
+    """
+    Raised instead of sending a request when every circuit for it is open.
+    """
+
+
+class CircuitBreaker:
+    """
+    Tracks consecutive failures of one (key, model) pair.
+
+    After failure_threshold failures in a row the circuit opens and requests
+    are refused. Once reset_timeout seconds have passed it becomes half-open
+    and lets a single trial request through: success closes it again, failure
+    opens it for another reset_timeout.
+    """
+    __slots__ = ("failure_threshold", "reset_timeout", "state", "failures", "opened_at",
+                 "trial_in_flight", "times_opened", "rejected")
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.trial_in_flight = False
+        self.times_opened = 0
+        self.rejected = 0
+
+    def available(self) -> bool:
+        """
+        Whether a request could be sent now. Does not change the state.
+        """
+        if self.state == CLOSED:
+            return True
+        if self.state == OPEN:
+            return time.monotonic() - self.opened_at >= self.reset_timeout
+        return not self.trial_in_flight
+
+    def acquire(self) -> None:
+        """
+        Called right before a request is sent through this circuit.
+        """
+        if self.state == OPEN:
+            self.state = HALF_OPEN
+        if self.state == HALF_OPEN:
+            self.trial_in_flight = True
+
+    def record_success(self) -> None:
+        self.state = CLOSED
+        self.failures = 0
+        self.trial_in_flight = False
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        self.trial_in_flight = False
+        if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+            if self.state != OPEN:
+                self.times_opened += 1
+            self.state = OPEN
+            self.opened_at = time.monotonic()
+
+    def stats(self) -> dict:
+        return {
+            "state": self.state,
+            "failures": self.failures,
+            "times_opened": self.times_opened,
+            "rejected": self.rejected,
+        }
+
+
+class CircuitBreakers:
+    """
+    One CircuitBreaker per key (for example (api key, model)), created on first use.
+    """
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._breakers = {}
+
+    def get(self, key) -> CircuitBreaker:
+        breaker = self._breakers.get(key)
+        if breaker is None:
+            breaker = self._breakers[key] = CircuitBreaker(self.failure_threshold, self.reset_timeout)
+        return breaker
+
+    def stats(self) -> dict:
+        return {
+            "|".join(str(part) for part in key) if isinstance(key, tuple) else str(key): breaker.stats()
+            for key, breaker in self._breakers.items()
+        }
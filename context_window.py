@@ -0,0 +1,117 @@
+import re
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+_TOKEN_RE = re.compile(r"\w+|[^\w\s]")
+# Chat APIs add a few tokens of framing around every message
+MESSAGE_TOKENS = 4
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Local token estimate close to what BPE tokenizers produce for chat text:
+    one token per word or symbol, plus one for every extra 6 letters of long words.
+    """
+    count = 0
+    for piece in _TOKEN_RE.findall(text):
+        count += 1 + (len(piece) - 1) // 6
+    return count + MESSAGE_TOKENS
+
+
+class ContextWindow:
+    """
+    Builds the messages sent for one request: the system prompt plus the most
+    recent turns that fit in token_budget.
+
+    If a summarize coroutine is given, turns that fall out of the window are
+    folded into a rolling summary in the background. The summary is cached on
+    the conversation and sent right after the system prompt.
+
+    The window keeps its first turn for as long as the turns since then fit,
+    so consecutive requests of a chat share a prefix that providers can serve
+    from their prompt cache. Once over budget it is trimmed to trim_ratio of
+    the budget, leaving room for a few more turns before it has to move again.
+    build() doesn't change the conversation's window_start; callers save the
+    value from window_start() with the conversation (see ConversationStore.append).
+    """
+
+    def __init__(self, token_budget: int = 3000, summarize=None, summarize_every: int = 4,
+                 trim_ratio: float = 1.0):
+        self.token_budget = token_budget
+        self.summarize = summarize
+        self.summarize_every = summarize_every
+        self.trim_ratio = trim_ratio
+        # The loop only keeps weak references to tasks, these keep running summaries alive
+        self._tasks = set()
+
+    def window_start(self, conversation) -> int:
+        """
+        The absolute number of the first turn in the window for the next request.
+        Turn numbers are absolute so turns trimmed by the store don't shift them.
+        """
+        if conversation is None:
+            return 0
+        budget = self.token_budget - conversation.prompt.tokens
+        if conversation.summary:
+            budget -= estimate_tokens(conversation.summary)
+        turns = conversation.turns
+        start = max(conversation.window_start - conversation.dropped, 0)
+        if sum(turn.tokens for turn in turns[start:]) <= budget:
+            return conversation.dropped + start
+        budget *= self.trim_ratio
+        start = len(turns)
+        # Walk back from the newest turn, the latest message is always sent
+        while start > 0:
+            tokens = turns[start - 1].tokens
+            if start < len(turns) and tokens > budget:
+                break
+            budget -= tokens
+            start -= 1
+        return conversation.dropped + start
+
+    def build(self, conversation, window_start: int = None) -> list:
+        """
+        The messages for the next request. window_start defaults to window_start(conversation).
+        """
+        if conversation is None:
+            return []
+        if window_start is None:
+            window_start = self.window_start(conversation)
+        messages = [conversation.prompt.message]
+        turns = conversation.turns
+        start = min(max(window_start - conversation.dropped, 0), len(turns))
+
+        if conversation.summary:
+            messages.append({
+                "role": "system",
+                "content": "Summary of the earlier conversation: " + conversation.summary,
+            })
+        messages.extend(m.as_dict() for m in turns[start:])
+
+        if self.summarize is not None:
+            self._maybe_summarize(conversation, start)
+        return messages
+
+    def _maybe_summarize(self, conversation, start: int) -> None:
+        window_start = conversation.dropped + start
+        first_new = max(conversation.summarized, conversation.dropped)
+        if conversation.summarizing or window_start - first_new < self.summarize_every:
+            return
+        old_turns = conversation.turns[first_new - conversation.dropped:start]
+        conversation.summarizing = True
+        task = asyncio.create_task(self._summarize(conversation, old_turns, window_start))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _summarize(self, conversation, old_turns: list, upto: int) -> None:
+        try:
+            summary = await self.summarize(conversation.summary, [m.as_dict() for m in old_turns])
+            if summary:
+                conversation.summary = summary
+                conversation.summarized = upto
+        except Exception as e:
+            logger.error("Error while summarizing conversation: %s", e)
+        finally:
+            conversation.summarizing = False
@@ -0,0 +1,395 @@
+import sys
+import json
+import time
+import random
+import asyncio
+import logging
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+
+from context_window import estimate_tokens
+from prompts import Prompt
+
+logger = logging.getLogger(__name__)
+
+# Rough fixed cost of one stored message (object header, slots, list entry)
+MESSAGE_OVERHEAD = 120
+
+
+class Message:
+    """
+    One chat turn. Uses __slots__ so a stored message costs far less than a dict.
+    """
+    __slots__ = ("role", "content", "tokens", "json")
+
+    def __init__(self, role: str, content: str):
+        self.role = sys.intern(role)
+        self.content = content
+        self.tokens = estimate_tokens(content)
+        self.json = None
+
+    def size(self) -> int:
+        return MESSAGE_OVERHEAD + len(self.content)
+
+    def as_dict(self) -> dict:
+        return {"role": self.role, "content": self.content}
+
+    def to_json(self) -> str:
+        # Kept, the message is saved again with every later turn of its conversation
+        if self.json is None:
+            self.json = json.dumps([self.role, self.content], ensure_ascii=False)
+        return self.json
+
+
+class Conversation:
+    """
+    The system prompt (shared with other chats) plus the user/assistant turns for one chat.
+    dropped counts the turns trimmed from the front, summary/summarized hold
+    the rolling summary and window_start the first turn of the history
+    window kept by ContextWindow. version is the state backend version this
+    copy was loaded from or saved as.
+    """
+    __slots__ = ("prompt", "turns", "size", "tokens", "last_used",
+                 "dropped", "summary", "summarized", "summarizing", "window_start", "version")
+
+    def __init__(self, prompt: Prompt):
+        self.prompt = prompt
+        self.turns = []
+        # Only the reference to the shared prompt costs memory here
+        self.size = MESSAGE_OVERHEAD
+        self.tokens = prompt.tokens
+        self.last_used = time.monotonic()
+        self.dropped = 0
+        self.summary = None
+        self.summarized = 0
+        self.summarizing = False
+        self.window_start = 0
+        self.version = 0
+
+    def add(self, message: Message) -> None:
+        self.turns.append(message)
+        self.size += message.size()
+        self.tokens += message.tokens
+
+    def messages(self) -> list:
+        """
+        Returns the conversation in the format expected by chat.completions.create.
+        """
+        return [self.prompt.message] + [m.as_dict() for m in self.turns]
+
+    def to_json(self) -> str:
+        # The prompt is saved by name and turns reuse their saved JSON, so only new turns are serialized
+        fields = {
+            "dropped": self.dropped,
+            "summary": self.summary,
+            "summarized": self.summarized,
+            "window_start": self.window_start,
+        }
+        if self.prompt.name is not None:
+            fields["prompt"] = self.prompt.name
+        else:
+            fields["system"] = self.prompt.text
+        turns = ",".join(m.to_json() for m in self.turns)
+        return f'{json.dumps(fields, ensure_ascii=False)[:-1]}, "turns": [{turns}]}}'
+
+    @classmethod
+    def from_json(cls, data: str, prompts=None) -> "Conversation":
+        """
+        Loads a saved conversation. prompts (a PromptRegistry) resolves the
+        saved prompt name to the shared Prompt.
+        """
+        fields = json.loads(data)
+        prompt = prompts.get(fields["prompt"]) if prompts is not None and "prompt" in fields else None
+        if prompt is None and "system" in fields:
+            # Saved with the full text by an older version
+            prompt = (prompts.find(fields["system"]) if prompts is not None else None) or Prompt(None, fields["system"])
+        elif prompt is None:
+            logger.warning("Unknown prompt %r in saved conversation, continuing without it", fields.get("prompt"))
+            prompt = Prompt(None, "")
+        conversation = cls(prompt)
+        for role, content in fields["turns"]:
+            conversation.add(Message(role, content))
+        conversation.dropped = fields.get("dropped", 0)
+        conversation.summary = fields.get("summary")
+        conversation.summarized = fields.get("summarized", 0)
+        conversation.window_start = fields.get("window_start", 0)
+        return conversation
+
+
+class ConversationStore:
+    """
+    Holds conversations for every chat under one global memory budget.
+
+    Least recently used chats are evicted once the budget is exceeded or when
+    they have been idle for longer than max_idle seconds. Each chat is also
+    capped to max_turns messages and max_tokens estimated tokens; the oldest
+    turns are dropped first. Keys can be any hashable, see namespace().
+
+    With a state backend (see state_backend.py) conversations are saved there
+    after every change and the in-memory copies only act as a cache, so
+    several bot workers can share them. Writes are compare-and-set against
+    the version that was read; on a conflict the conversation is reloaded and
+    the change applied again. Writes to one chat from this process are done
+    one at a time, so conflicts only come from other workers. Prompts are
+    saved by name and resolved through prompts (a PromptRegistry) on load.
+    """
+
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024, max_turns: int = 40,
+                 max_tokens: int = 8000, max_idle: float = 6 * 60 * 60, backend=None,
+                 max_conflicts: int = 5, prompts=None):
+        self.max_bytes = max_bytes
+        self.max_turns = max_turns
+        self.max_tokens = max_tokens
+        self.max_idle = max_idle
+        self.backend = backend
+        self.max_conflicts = max_conflicts
+        self.prompts = prompts
+        self._chats = OrderedDict()
+        self._locks = {}
+        self.total_bytes = 0
+        self.memory_evictions = 0
+        self.idle_evictions = 0
+        self.trimmed_turns = 0
+        self.lost_turns = 0
+        self.conflicts = 0
+
+    def __contains__(self, key) -> bool:
+        return key in self._chats
+
+    def __len__(self) -> int:
+        return len(self._chats)
+
+    async def start(self, key, prompt: Prompt) -> Conversation:
+        """
+        Returns the conversation for key, creating it with the given system prompt if needed.
+        """
+        conversation = await self.get(key)
+        if conversation is not None:
+            return conversation
+        conversation = Conversation(prompt)
+        if self.backend is not None:
+            version = await self.backend.put(self._backend_key(key), conversation.to_json(), 0)
+            if version is None:
+                # Another worker created it first
+                self.conflicts += 1
+                return await self.get(key)
+            conversation.version = version
+        self._remember(key, conversation)
+        return conversation
+
+    async def get(self, key):
+        """
+        Returns the conversation for key, or None if there is none.
+        """
+        if self.backend is not None:
+            return await self._load(key)
+        conversation = self._chats.get(key)
+        if conversation is not None:
+            self._touch(key, conversation)
+        return conversation
+
+    async def append(self, key, role: str, content: str, window_start: int = None) -> None:
+        """
+        Adds a turn to an existing conversation, then applies the per-chat caps
+        and the global memory budget. If the conversation is gone (evicted or
+        discarded meanwhile) the turn is dropped and counted in lost_turns.
+        window_start, if given, is saved with the turn (see ContextWindow).
+        """
+        async with self._locked(key):
+            for attempt in range(self.max_conflicts):
+                conversation = await self.get(key)
+                if conversation is None:
+                    # Evicted or reset while the reply was being generated
+                    self.lost_turns += 1
+                    logger.warning("Conversation %s no longer exists, dropping its %s turn", key, role)
+                    return
+                if window_start is not None:
+                    # Only ever moves forward, another worker may have moved it further already
+                    conversation.window_start = max(conversation.window_start, window_start)
+                message = Message(role, content)
+                conversation.add(message)
+                self.total_bytes += message.size()
+                self._trim(conversation)
+                if self.backend is not None:
+                    version = await self.backend.put(
+                        self._backend_key(key), conversation.to_json(), conversation.version
+                    )
+                    if version is None:
+                        # Someone else changed it since we read it, start over from their copy
+                        self.conflicts += 1
+                        self._forget(key)
+                        # Jitter so two workers don't keep colliding in lockstep
+                        await asyncio.sleep(random.uniform(0, 0.01 * 2 ** attempt))
+                        continue
+                    conversation.version = version
+                self._evict()
+                return
+        logger.error("Could not save conversation %s after %d conflicts", key, self.max_conflicts)
+
+    async def messages(self, key) -> list:
+        conversation = await self.get(key)
+        return conversation.messages() if conversation is not None else []
+
+    async def discard(self, key) -> None:
+        self._forget(key)
+        if self.backend is not None:
+            await self.backend.delete(self._backend_key(key))
+
+    def namespace(self, name: str) -> "ConversationNamespace":
+        """
+        Returns a view of this store keyed by chat_id only, so several modes can
+        share one memory budget.
+        """
+        return ConversationNamespace(self, name)
+
+    def stats(self) -> dict:
+        return {
+            "chats": len(self._chats),
+            "bytes": self.total_bytes,
+            "max_bytes": self.max_bytes,
+            "memory_evictions": self.memory_evictions,
+            "idle_evictions": self.idle_evictions,
+            "trimmed_turns": self.trimmed_turns,
+            "lost_turns": self.lost_turns,
+            "conflicts": self.conflicts,
+        }
+
+    async def _load(self, key):
+        value, version = await self.backend.get(self._backend_key(key))
+        conversation = self._chats.get(key)
+        if version == 0:
+            self._forget(key)
+            return None
+        if conversation is None or conversation.version != version:
+            conversation = Conversation.from_json(value, self.prompts)
+            conversation.version = version
+            self._remember(key, conversation)
+        else:
+            self._touch(key, conversation)
+        return conversation
+
+    @asynccontextmanager
+    async def _locked(self, key):
+        """
+        Holds the lock of one chat, dropping it again once nobody waits for it.
+        """
+        entry = self._locks.get(key)
+        if entry is None:
+            entry = self._locks[key] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                yield
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._locks[key]
+
+    @staticmethod
+    def _backend_key(key) -> str:
+        parts = key if isinstance(key, tuple) else (key,)
+        return "conversation:" + ":".join(str(part) for part in parts)
+
+    def _remember(self, key, conversation: Conversation) -> None:
+        self._forget(key)
+        self._chats[key] = conversation
+        self.total_bytes += conversation.size
+        self._evict()
+
+    def _forget(self, key) -> None:
+        conversation = self._chats.pop(key, None)
+        if conversation is not None:
+            self.total_bytes -= conversation.size
+
+    def _touch(self, key, conversation: Conversation) -> None:
+        conversation.last_used = time.monotonic()
+        self._chats.move_to_end(key)
+
+    def _trim(self, conversation: Conversation) -> None:
+        turns = conversation.turns
+        # Never drop the turn that was just added
+        count = min(max(len(turns) - self.max_turns, 0), len(turns) - 1)
+        tokens = conversation.tokens - sum(turn.tokens for turn in turns[:count])
+        while tokens > self.max_tokens and count < len(turns) - 1:
+            tokens -= turns[count].tokens
+            count += 1
+        if not count:
+            return
+        size = sum(turn.size() for turn in turns[:count])
+        # One slice instead of popping from the front turn by turn
+        del turns[:count]
+        conversation.size -= size
+        conversation.tokens = tokens
+        self.total_bytes -= size
+        conversation.dropped += count
+        self.trimmed_turns += count
+
+    def _evict(self) -> None:
+        now = time.monotonic()
+        # The most recently used chat sits at the end and is never evicted here
+        while len(self._chats) > 1:
+            key, oldest = next(iter(self._chats.items()))
+            if now - oldest.last_used > self.max_idle:
+                self.idle_evictions += 1
+            elif self.total_bytes > self.max_bytes:
+                self.memory_evictions += 1
+            else:
+                break
+            del self._chats[key]
+            self.total_bytes -= oldest.size
+
+
+class ConversationNamespace:
+    """
+    The conversations for one mode ("advice", "rizz", ...) inside a shared store.
+    """
+
+    def __init__(self, store: ConversationStore, name: str):
+        self.store = store
+        self.name = name
+
+    def __contains__(self, chat_id) -> bool:
+        return (self.name, chat_id) in self.store
+
+    async def start(self, chat_id, prompt: Prompt) -> Conversation:
+        return await self.store.start((self.name, chat_id), prompt)
+
+    async def get(self, chat_id):
+        return await self.store.get((self.name, chat_id))
+
+    async def append(self, chat_id, role: str, content: str, window_start: int = None) -> None:
+        await self.store.append((self.name, chat_id), role, content, window_start)
+
+    async def messages(self, chat_id) -> list:
+        return await self.store.messages((self.name, chat_id))
+
+    async def discard(self, chat_id) -> None:
+        await self.store.discard((self.name, chat_id))
+
+
+class ChatModes:
+    """
+    The current mode ("analysis", "advice" or "rizz") of every chat.
+    Kept in a dict, or in the state backend when one is given so that all
+    workers see mode switches. Modes never expire, the backend's ttl only
+    applies to conversations.
+    """
+
+    def __init__(self, backend=None):
+        self.backend = backend
+        self._modes = {}
+
+    async def get(self, chat_id) -> str:
+        """
+        Returns the mode of the chat, or None if it never picked one.
+        """
+        if self.backend is None:
+            return self._modes.get(chat_id)
+        value, _ = await self.backend.get(f"mode:{chat_id}")
+        return value
+
+    async def set(self, chat_id, mode: str) -> None:
+        if self.backend is None:
+            self._modes[chat_id] = mode
+        else:
+            await self.backend.put(f"mode:{chat_id}", mode, expire=False)
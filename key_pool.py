@@ -0,0 +1,175 @@
+import time
+import random
+import asyncio
+import logging
+
+import openai
+
+from llm import LLMClient, OPENROUTER_BASE_URL
+from resilience import retry_after_seconds
+from circuit_breaker import CircuitBreakers, CircuitOpenError
+
+logger = logging.getLogger(__name__)
+
+# Weight of the newest sample in the moving average of a key's latency
+LATENCY_ALPHA = 0.2
+
+
+def configured_keys(config) -> list:
+    """
+    Returns the OpenRouter keys from config: OPENROUTER_API_KEYS if set,
+    otherwise the older OPENROUTER_API_KEY, KEY2 and KEY3 settings.
+    """
+    keys = getattr(config, "OPENROUTER_API_KEYS", None)
+    if not keys:
+        keys = [
+            getattr(config, name, None)
+            for name in ("OPENROUTER_API_KEY", "OPENROUTER_API_KEY2", "OPENROUTER_API_KEY3")
+        ]
+    # Keep the order but drop empty and duplicate keys
+    return list(dict.fromkeys(key for key in keys if key))
+
+
+class KeyState:
+    """
+    One API key in the pool along with its health and usage counters.
+    """
+    __slots__ = ("name", "client", "requests", "errors", "latency", "cooldown_until",
+                 "failures", "started")
+
+    def __init__(self, name: str, client: LLMClient):
+        self.name = name
+        self.client = client
+        self.requests = 0
+        self.errors = 0
+        self.latency = None
+        self.cooldown_until = 0.0
+        self.failures = 0
+        self.started = time.monotonic()
+
+    def load(self) -> float:
+        """
+        Expected wait on this key: requests in flight times recent latency.
+        """
+        latency = self.latency if self.latency is not None else 1.0
+        return (self.client.in_flight + 1) * latency
+
+    def stats(self) -> dict:
+        elapsed = max(time.monotonic() - self.started, 1e-9)
+        return {
+            "key": self.name,
+            "in_flight": self.client.in_flight,
+            "requests": self.requests,
+            "errors": self.errors,
+            "error_rate": self.errors / self.requests if self.requests else 0.0,
+            "requests_per_second": self.requests / elapsed,
+            "latency": self.latency,
+            "cooling_down": self.cooldown_until > time.monotonic(),
+        }
+
+
+class KeyPool:
+    """
+    Spreads chat completion requests across any number of OpenRouter keys.
+
+    Each request goes to the healthy key with the lowest in-flight count times
+    recent latency. A key that answers 429 or 5xx is put in a cooldown (the
+    Retry-After header if given, else doubling from cooldown up to
+    max_cooldown) and skipped until it ends. Offers the same create and
+    stream_text methods as LLMClient, so all modes can share one pool.
+
+    Every (key, model) pair also has a circuit breaker. Keys whose circuit is
+    open for the requested model are skipped, and if no key is left the
+    request fails at once with CircuitOpenError.
+    """
+
+    def __init__(self, api_keys: list, max_concurrency: int = 256, cooldown: float = 5.0,
+                 max_cooldown: float = 300.0, base_url: str = OPENROUTER_BASE_URL,
+                 breakers: CircuitBreakers = None):
+        if not api_keys:
+            raise ValueError("KeyPool needs at least one API key")
+        self.cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.breakers = breakers if breakers is not None else CircuitBreakers()
+        # Failover between keys replaces the OpenAI client's own retries
+        self.keys = [
+            KeyState(f"key{i + 1}...{key[-4:]}", LLMClient(key, max_concurrency, base_url, max_retries=0))
+            for i, key in enumerate(api_keys)
+        ]
+
+    def available(self, model: str = None) -> bool:
+        """
+        Whether at least one key's circuit for model would let a request through.
+        """
+        return any(self.breakers.get((key.name, model)).available() for key in self.keys)
+
+    def pick(self, model: str = None) -> KeyState:
+        candidates = [key for key in self.keys if self.breakers.get((key.name, model)).available()]
+        if not candidates:
+            for key in self.keys:
+                self.breakers.get((key.name, model)).rejected += 1
+            raise CircuitOpenError(f"Every circuit for model {model} is open")
+        now = time.monotonic()
+        healthy = [key for key in candidates if key.cooldown_until <= now]
+        if not healthy:
+            # Every key is cooling down, use the one that recovers first
+            return min(candidates, key=lambda key: key.cooldown_until)
+        best = min(key.load() for key in healthy)
+        # Break ties randomly so idle keys share the traffic
+        return random.choice([key for key in healthy if key.load() == best])
+
+    async def create(self, **kwargs):
+        key = self.pick(kwargs.get("model"))
+        return await self._call(key, key.client.create, **kwargs)
+
+    async def stream_text(self, on_text, **kwargs) -> str:
+        key = self.pick(kwargs.get("model"))
+        return await self._call(key, key.client.stream_text, on_text, **kwargs)
+
+    async def _call(self, key: KeyState, method, *args, **kwargs):
+        breaker = self.breakers.get((key.name, kwargs.get("model")))
+        breaker.acquire()
+        key.requests += 1
+        start = time.monotonic()
+        try:
+            result = await method(*args, **kwargs)
+        except openai.APIStatusError as e:
+            key.errors += 1
+            if e.status_code == 429 or e.status_code >= 500:
+                self._cool_down(key, retry_after_seconds(e))
+            # A malformed request says nothing about the health of the key or model
+            if e.status_code in (400, 422):
+                breaker.trial_in_flight = False
+            else:
+                breaker.record_failure()
+            raise
+        except (openai.APIConnectionError, openai.APITimeoutError):
+            key.errors += 1
+            self._cool_down(key, None)
+            breaker.record_failure()
+            raise
+        except asyncio.CancelledError:
+            # Cancelled hedges and shutdowns are not failures
+            breaker.trial_in_flight = False
+            raise
+        except Exception:
+            key.errors += 1
+            breaker.record_failure()
+            raise
+        breaker.record_success()
+        elapsed = time.monotonic() - start
+        key.latency = elapsed if key.latency is None else (
+            LATENCY_ALPHA * elapsed + (1 - LATENCY_ALPHA) * key.latency
+        )
+        key.failures = 0
+        return result
+
+    def _cool_down(self, key: KeyState, retry_after: float) -> None:
+        key.failures += 1
+        if retry_after is None:
+            retry_after = min(self.cooldown * 2 ** (key.failures - 1), self.max_cooldown)
+        key.cooldown_until = time.monotonic() + retry_after
+        logger.error("Key %s cooling down for %.1f seconds", key.name, retry_after)
+
+    def stats(self) -> list:
+        return [key.stats() for key in self.keys]
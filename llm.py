@@ -0,0 +1,97 @@
+import asyncio
+import logging
+
+import httpx
+from openai import AsyncOpenAI
+
+logger = logging.getLogger(__name__)
+
+OPENROUTER_BASE_URL = "https://openrouter.ai/api/v1"
+
+# One pooled transport is shared by every client so keep-alive connections to
+# OpenRouter are reused no matter which API key a request is sent with.
+_http_client = None
+
+
+def get_http_client(max_connections: int = 1000, max_keepalive: int = 200) -> httpx.AsyncClient:
+    """
+    Returns the shared httpx transport, creating it on first use.
+    The pool limits are only applied the first time this is called.
+    """
+    global _http_client
+    if _http_client is None:
+        _http_client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_keepalive,
+            ),
+            timeout=httpx.Timeout(60.0, connect=10.0),
+        )
+    return _http_client
+
+
+async def close_http_client() -> None:
+    """
+    Closes the shared transport. Called once when the bot shuts down.
+    """
+    global _http_client
+    if _http_client is not None:
+        await _http_client.aclose()
+        _http_client = None
+
+
+class LLMClient:
+    """
+    An AsyncOpenAI client for one OpenRouter key, with a semaphore that caps
+    how many requests may be in flight on that key at the same time.
+    """
+
+    def __init__(self, api_key: str, max_concurrency: int = 256, base_url: str = OPENROUTER_BASE_URL,
+                 max_retries: int = 2):
+        self.api_key = api_key
+        self.max_concurrency = max_concurrency
+        self.client = AsyncOpenAI(
+            base_url=base_url,
+            api_key=api_key,
+            http_client=get_http_client(),
+            max_retries=max_retries,
+        )
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        self.in_flight = 0
+
+    async def create(self, **kwargs):
+        """
+        Sends a chat completion request once a concurrency slot is free.
+        Accepts the same keyword arguments as chat.completions.create.
+        """
+        async with self.semaphore:
+            self.in_flight += 1
+            try:
+                return await self.client.chat.completions.create(**kwargs)
+            finally:
+                self.in_flight -= 1
+
+    async def stream_text(self, on_text, on_usage=None, **kwargs) -> str:
+        """
+        Sends a streaming chat completion request and awaits on_text(text_so_far)
+        for every chunk that adds content. Returns the complete reply.
+        on_usage, if given, is called with the usage reported by the stream
+        (sent when stream_options={"include_usage": True}).
+        """
+        async with self.semaphore:
+            self.in_flight += 1
+            try:
+                stream = await self.client.chat.completions.create(stream=True, **kwargs)
+                text = ""
+                async for chunk in stream:
+                    if on_usage is not None and getattr(chunk, "usage", None) is not None:
+                        on_usage(chunk.usage)
+                    if not chunk.choices:
+                        continue
+                    delta = chunk.choices[0].delta.content
+                    if delta:
+                        text += delta
+                        await on_text(text)
+                return text
+            finally:
+                self.in_flight -= 1
@@ -0,0 +1,141 @@
+import re
+import math
+
+# Valence of common words and emoticons, from -4 (very negative) to 4 (very positive)
+LEXICON = {
+    # positive
+    "love": 3.2, "loved": 2.9, "loving": 2.9, "lovely": 2.8, "adore": 3.0, "amazing": 3.1,
+    "awesome": 3.1, "great": 3.1, "good": 1.9, "nice": 1.8, "happy": 2.7, "glad": 2.0,
+    "excited": 2.4, "exciting": 2.2, "fantastic": 3.3, "wonderful": 3.1, "excellent": 3.2,
+    "perfect": 2.9, "beautiful": 2.9, "gorgeous": 3.0, "cute": 2.0, "sweet": 2.0, "fun": 2.3,
+    "best": 3.2, "better": 1.9, "like": 1.5, "likes": 1.5, "enjoy": 2.2, "enjoyed": 2.3,
+    "thanks": 1.9, "thank": 1.5, "grateful": 2.4, "proud": 2.1, "yay": 2.4, "haha": 1.6,
+    "lol": 1.4, "lmao": 1.6, "cool": 1.3, "fine": 0.8, "brilliant": 2.8, "delighted": 3.0,
+    "hope": 1.9, "hopeful": 2.0, "miss": 0.8, "smile": 1.9, "laugh": 1.8, "kind": 2.0,
+    "congrats": 2.5, "congratulations": 2.9, "incredible": 2.8, "blessed": 2.5, "win": 2.8,
+    "won": 2.7, "yes": 1.0, "pleased": 2.2, "cheerful": 2.5, "ily": 3.0, "ilysm": 3.3,
+    "xoxo": 2.2, "<3": 2.8, "<33": 3.0, ":)": 2.0, ":-)": 2.0, ":d": 2.6, "^^": 1.8,
+    ";)": 1.5, ":*": 2.2, ":p": 1.2, ":-p": 1.2,
+    # negative
+    "hate": -2.7, "hated": -3.2, "hates": -1.9, "awful": -2.0, "terrible": -2.1, "horrible": -2.5,
+    "bad": -2.5, "worse": -2.1, "worst": -3.1, "sad": -2.1, "unhappy": -1.8, "angry": -2.3,
+    "mad": -2.2, "upset": -1.6, "annoyed": -1.6, "annoying": -1.7, "hurt": -2.4, "hurts": -2.2,
+    "cry": -2.1, "crying": -2.1, "lonely": -1.9, "alone": -1.0, "boring": -1.3, "bored": -1.1,
+    "tired": -1.9, "sick": -1.7, "scared": -1.9, "afraid": -2.0, "worried": -1.2, "anxious": -1.0,
+    "stupid": -2.4, "ugly": -3.1, "disgusting": -2.4, "gross": -2.1, "pathetic": -2.6,
+    "disappointed": -1.9, "disappointing": -2.2, "sorry": -0.3, "fail": -2.5, "failed": -2.3,
+    "lost": -1.3, "lose": -1.7, "broke": -1.6, "broken": -2.1, "breakup": -2.0, "dumped": -2.0,
+    "ignore": -1.5, "ignored": -1.7, "ghosted": -2.1, "cheated": -3.0, "liar": -2.7, "lied": -1.6,
+    "jealous": -2.0, "miserable": -2.9, "depressed": -2.3, "pain": -2.3, "no": -1.2, "never": -0.5,
+    "ugh": -1.8, "meh": -0.8, "wtf": -2.8, "kill": -3.7, "die": -2.9, "dead": -3.3,
+    ":(": -1.9, ":-(": -1.9, ":'(": -2.2, "</3": -3.0,
+}
+
+NEGATIONS = {
+    "not", "no", "never", "isn't", "isnt", "aren't", "arent", "wasn't", "wasnt", "don't", "dont",
+    "doesn't", "doesnt", "didn't", "didnt", "can't", "cant", "won't", "wont", "couldn't", "couldnt",
+    "shouldn't", "shouldnt", "wouldn't", "wouldnt", "nothing", "nobody", "neither", "nor", "without",
+    "ain't", "aint",
+}
+
+BOOSTERS = {
+    "very": 0.3, "so": 0.3, "really": 0.3, "extremely": 0.4, "super": 0.3, "totally": 0.3,
+    "absolutely": 0.3, "incredibly": 0.4, "too": 0.2, "much": 0.2, "most": 0.3, "sooo": 0.4,
+    "kinda": -0.3, "somewhat": -0.3, "slightly": -0.3, "barely": -0.4, "little": -0.2, "bit": -0.2,
+}
+
+# Words that usually mean the sentence holds two opposite sentiments
+CONTRASTS = {"but", "however", "although", "though", "yet"}
+
+_TOKEN_RE = re.compile(r"</?3+|[:;>][-']?[()dDpP*]|\^\^|[\w']+|[!?]")
+# Normalization constant from VADER, maps the raw sum into -1..1
+ALPHA = 15.0
+
+
+class LocalSentiment:
+    """
+    Result of the local scorer. score runs from -10 to 10 like the LLM prompt,
+    confidence from 0 (no idea) to 1 (clearly polar).
+    """
+    __slots__ = ("score", "confidence", "positive", "negative")
+
+    def __init__(self, score: int, confidence: float, positive: list, negative: list):
+        self.score = score
+        self.confidence = confidence
+        self.positive = positive
+        self.negative = negative
+
+    @property
+    def label(self) -> str:
+        if self.score > 0:
+            return "Positive"
+        if self.score < 0:
+            return "Negative"
+        return "Neutral"
+
+    def to_text(self) -> str:
+        """
+        Formats the result like the analysis returned by perform_analysis.
+        """
+        words = self.positive if self.score > 0 else self.negative
+        reason = f"Driven by words like: {', '.join(words[:4])}." if words else "No strongly emotional words found."
+        return f"**Sentiment:** {self.label}\n**Score:** {self.score}/10\n{reason}"
+
+
+def score_text(text: str, max_words: int = 25) -> LocalSentiment:
+    """
+    Lexicon based sentiment score with VADER-style negation, boosters,
+    capitalization and exclamation handling. Runs in microseconds and never
+    touches the network.
+
+    Texts longer than max_words, mixed or contrasted sentiment and texts with
+    no lexicon words get a low confidence, so callers can send them to the LLM.
+    """
+    tokens = _TOKEN_RE.findall(text)
+    words = [t for t in tokens if t not in ("!", "?")]
+    total = 0.0
+    hits = 0
+    positive = []
+    negative = []
+    contrast = False
+    for i, token in enumerate(words):
+        lower = token.lower()
+        if lower in CONTRASTS:
+            contrast = True
+        valence = LEXICON.get(lower)
+        if valence is None:
+            continue
+        # "no" and "never" are only counted when they stand alone as an answer
+        if lower in NEGATIONS and len(words) > 2:
+            continue
+        if token.isupper() and len(token) > 1 and not text.isupper():
+            valence += 0.7 if valence > 0 else -0.7
+        for previous in words[max(0, i - 3):i]:
+            boost = BOOSTERS.get(previous.lower())
+            if boost:
+                valence += boost if valence > 0 else -boost
+        if any(w.lower() in NEGATIONS for w in words[max(0, i - 3):i]):
+            valence *= -0.74
+        total += valence
+        hits += 1
+        (positive if valence > 0 else negative).append(lower)
+
+    if total:
+        exclamations = min(tokens.count("!"), 4)
+        total += exclamations * 0.292 if total > 0 else -exclamations * 0.292
+
+    compound = total / math.sqrt(total * total + ALPHA)
+    score = int(round(compound * 10))
+
+    confidence = abs(compound)
+    if hits == 0:
+        confidence = 0.0
+    if positive and negative:
+        confidence *= 1.0 - min(len(positive), len(negative)) / (len(positive) + len(negative))
+    if contrast:
+        confidence *= 0.5
+    if "?" in tokens:
+        confidence *= 0.8
+    if len(words) > max_words:
+        confidence *= max_words / len(words)
+    return LocalSentiment(score, round(confidence, 3), positive, negative)
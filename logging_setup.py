@@ -0,0 +1,115 @@
+import json
+import queue
+import atexit
+import random
+import logging
+import logging.handlers
+from datetime import datetime, timezone
+
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+
+def _payload(value):
+    """
+    Makes a logged payload JSON serializable (API responses are pydantic models).
+    """
+    if hasattr(value, "model_dump"):
+        return value.model_dump()
+    return value
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    Formats each record as one line of JSON.
+    """
+
+    def format(self, record: logging.LogRecord) -> str:
+        data = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        if hasattr(record, "payload"):
+            data["payload"] = _payload(record.payload)
+        if record.exc_info:
+            data["exception"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            data["exception"] = record.exc_text
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    """
+    The usual one line text format, with the payload (if any) appended.
+    """
+
+    def __init__(self):
+        super().__init__(TEXT_FORMAT)
+
+    def format(self, record: logging.LogRecord) -> str:
+        text = super().format(record)
+        if hasattr(record, "payload"):
+            text += f" {json.dumps(_payload(record.payload), ensure_ascii=False, default=str)}"
+        return text
+
+
+class PayloadSampler(logging.Filter):
+    """
+    Lets through only a sample_rate share of the records carrying a payload
+    (logged with extra={"payload": ...}). Other records always pass.
+    """
+
+    def __init__(self, sample_rate: float):
+        super().__init__()
+        self.sample_rate = sample_rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        return not hasattr(record, "payload") or random.random() < self.sample_rate
+
+
+class PayloadQueueHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler that leaves the payload object on the record, so it is only
+    serialized by the listener thread and not on the event loop.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record.message = record.getMessage()
+        record.msg = record.message
+        record.args = None
+        if record.exc_info:
+            # Tracebacks can't cross to the other thread, format them now
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+def setup_logging(level: str = "INFO", format: str = "text", levels: dict = None,
+                  sample_rate: float = 0.01) -> logging.handlers.QueueListener:
+    """
+    Sends all logging through a queue to a background thread, so logging
+    never blocks the event loop on stderr. format is "text" or "json", levels
+    maps logger names to their own level (e.g. {"httpx": "WARNING"}) and
+    sample_rate is the share of payload records that are kept.
+
+    Returns the started listener. It is stopped (flushing the queue) when
+    the interpreter exits.
+    """
+    output = logging.StreamHandler()
+    output.setFormatter(JsonFormatter() if format == "json" else TextFormatter())
+    listener = logging.handlers.QueueListener(queue.SimpleQueue(), output)
+
+    handler = PayloadQueueHandler(listener.queue)
+    handler.addFilter(PayloadSampler(sample_rate))
+    root = logging.getLogger()
+    for old in root.handlers[:]:
+        root.removeHandler(old)
+    root.addHandler(handler)
+    root.setLevel(level)
+    for name, module_level in (levels or {}).items():
+        logging.getLogger(name).setLevel(module_level)
+
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
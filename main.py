@@ -1,8 +1,9 @@
-import re
+import time
+import asyncio
 import logging
-import asyncio  # Import asyncio to get the running loop
 from telegram import InlineKeyboardMarkup, InlineKeyboardButton
 from telegram import Update
+from telegram.error import BadRequest
 from telegram.ext import (
     ApplicationBuilder,
     CommandHandler,
@@ -11,259 +12,688 @@ from telegram.ext import (
     ContextTypes,
     CallbackQueryHandler,
 )
-from openai import OpenAI  # Using the OpenAI client with OpenRouter configuration
 import config
+from llm import close_http_client, OPENROUTER_BASE_URL
+from key_pool import KeyPool, configured_keys
+from resilience import RetryPolicy, Hedger
+from circuit_breaker import CLOSED, HALF_OPEN, OPEN, CircuitBreakers, CircuitOpenError
+from model_router import ModelRouter
+from webhook import run_webhook
+from chat_scheduler import ChatScheduler
+from metrics import MetricsRegistry, MetricsServer
+from rate_limiter import RateLimiter
+from message_coalescer import MessageCoalescer
+from conversation_store import ConversationStore, ChatModes
+from state_backend import create_backend
+from context_window import ContextWindow
+from prompts import PromptRegistry, PromptCaching
+from sentiment_cache import SentimentCache, cache_key
+from single_flight import SingleFlight
+from streaming import TelegramStreamer
+from telegram_format import markdown_to_html, html_to_text, split_html, split_text
+from local_sentiment import score_text
+from sentiment_batcher import SentimentBatcher, build_batch_messages, parse_batch_reply
+from logging_setup import setup_logging
 
-logging.basicConfig(
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    level=logging.INFO
-)
 logger = logging.getLogger(__name__)
 
 # Retrieve tokens and model identifiers from environment variables
 TELEGRAM_TOKEN = config.TELEGRAM_TOKEN
-OPENROUTER_API_KEY = config.OPENROUTER_API_KEY
-OPENROUTER_API_KEY2 = config.OPENROUTER_API_KEY2
-OPENROUTER_API_KEY3 = config.OPENROUTER_API_KEY3
+OPENROUTER_API_KEYS = configured_keys(config)
 MODEL = config.MODEL
 MODEL2 = config.MODEL2
+# Other endpoints, e.g. a local Bot API server or another OpenAI-compatible gateway
+TELEGRAM_BASE_URL = getattr(config, "TELEGRAM_BASE_URL", None)
+OPENROUTER_URL = getattr(config, "OPENROUTER_BASE_URL", OPENROUTER_BASE_URL)
+# Updates handled at once across all chats, and updates one chat may have queued (the rest are dropped)
+MAX_CONCURRENT_UPDATES = getattr(config, "MAX_CONCURRENT_UPDATES", 256)
+CHAT_QUEUE_SIZE = getattr(config, "CHAT_QUEUE_SIZE", 16)
+# Webhook mode: set WEBHOOK_URL to the public https URL Telegram should post updates to
+WEBHOOK_URL = getattr(config, "WEBHOOK_URL", None)
+WEBHOOK_LISTEN = getattr(config, "WEBHOOK_LISTEN", "0.0.0.0")
+WEBHOOK_PORT = getattr(config, "WEBHOOK_PORT", 8443)
+WEBHOOK_PATH = getattr(config, "WEBHOOK_PATH", "/telegram")
+WEBHOOK_SECRET = getattr(config, "WEBHOOK_SECRET", None)
+# Webhook workers each handle one update at a time; past WEBHOOK_QUEUE_SIZE waiting updates Telegram gets a 503
+WEBHOOK_WORKERS = getattr(config, "WEBHOOK_WORKERS", MAX_CONCURRENT_UPDATES)
+WEBHOOK_QUEUE_SIZE = getattr(config, "WEBHOOK_QUEUE_SIZE", 10000)
+# Seconds a webhook client may stay silent, mid-request or idle on keep-alive, before it is disconnected
+WEBHOOK_READ_TIMEOUT = getattr(config, "WEBHOOK_READ_TIMEOUT", 10.0)
+# Token bucket rate limits: messages per second and burst size per user, per chat and
+# for the whole bot (None disables a limit). Messages over the limit get a canned reply.
+RATE_LIMIT_USER = getattr(config, "RATE_LIMIT_USER", 0.5)
+RATE_LIMIT_USER_BURST = getattr(config, "RATE_LIMIT_USER_BURST", 5)
+RATE_LIMIT_CHAT = getattr(config, "RATE_LIMIT_CHAT", 1.0)
+RATE_LIMIT_CHAT_BURST = getattr(config, "RATE_LIMIT_CHAT_BURST", 10)
+RATE_LIMIT_GLOBAL = getattr(config, "RATE_LIMIT_GLOBAL", None)
+RATE_LIMIT_GLOBAL_BURST = getattr(config, "RATE_LIMIT_GLOBAL_BURST", 100)
+# Shed advice/rizz messages are answered once the limits allow, unless that is over this many seconds away
+RATE_LIMIT_MAX_HOLD = getattr(config, "RATE_LIMIT_MAX_HOLD", 60.0)
+# Advice/rizz messages sent in quick succession are answered as one turn once the chat is
+# quiet for COALESCE_QUIET_PERIOD seconds (0 answers every message on its own)
+COALESCE_QUIET_PERIOD = getattr(config, "COALESCE_QUIET_PERIOD", 1.0)
+COALESCE_MAX_WAIT = getattr(config, "COALESCE_MAX_WAIT", 5.0)
+# Candidate models per mode in fallback order, the fastest healthy one is used
+SENTIMENT_MODELS = getattr(config, "SENTIMENT_MODELS", [MODEL])
+ADVICE_MODELS = getattr(config, "ADVICE_MODELS", [MODEL2])
+RIZZ_MODELS = getattr(config, "RIZZ_MODELS", [MODEL2])
+# Maximum number of in-flight OpenRouter requests for each key
+KEY_CONCURRENCY = getattr(config, "KEY_CONCURRENCY", 256)
+# Seconds a key is skipped after a 429/5xx (doubles on repeated failures)
+KEY_COOLDOWN = getattr(config, "KEY_COOLDOWN", 5.0)
+# Attempts per request and the exponential backoff between them
+RETRY_ATTEMPTS = getattr(config, "RETRY_ATTEMPTS", 3)
+RETRY_BASE_DELAY = getattr(config, "RETRY_BASE_DELAY", 0.5)
+RETRY_MAX_DELAY = getattr(config, "RETRY_MAX_DELAY", 20.0)
+# Send a backup request when a reply is slower than the recent p95 latency
+HEDGE_REQUESTS = getattr(config, "HEDGE_REQUESTS", False)
+HEDGE_PERCENTILE = getattr(config, "HEDGE_PERCENTILE", 95)
+# Failures in a row before a key/model circuit opens, and seconds until it is retried
+CIRCUIT_FAILURE_THRESHOLD = getattr(config, "CIRCUIT_FAILURE_THRESHOLD", 5)
+CIRCUIT_RESET_TIMEOUT = getattr(config, "CIRCUIT_RESET_TIMEOUT", 30.0)
+# Limits for stored conversation history (shared by advice and rizz mode)
+CONTEXT_MAX_BYTES = getattr(config, "CONTEXT_MAX_BYTES", 64 * 1024 * 1024)
+CONTEXT_MAX_TURNS = getattr(config, "CONTEXT_MAX_TURNS", 40)
+CONTEXT_MAX_TOKENS = getattr(config, "CONTEXT_MAX_TOKENS", 8000)
+CONTEXT_MAX_IDLE = getattr(config, "CONTEXT_MAX_IDLE", 6 * 60 * 60)
+# Token budget for the history sent with each advice/rizz request
+CONTEXT_TOKEN_BUDGET = getattr(config, "CONTEXT_TOKEN_BUDGET", 3000)
+# Share of the budget kept when the history has to be trimmed; the window start then
+# stays put for a few turns so requests share a cacheable prefix (1.0 trims every turn)
+CONTEXT_TRIM_RATIO = getattr(config, "CONTEXT_TRIM_RATIO", 0.75)
+# Fold turns that no longer fit the budget into a rolling summary
+CONTEXT_SUMMARIES = getattr(config, "CONTEXT_SUMMARIES", False)
+# Shared chat state for running several workers, e.g. "sqlite:///state.db" or "redis://localhost:6379/0"
+STATE_BACKEND = getattr(config, "STATE_BACKEND", None)
+# System prompts: <name>.txt files in PROMPTS_DIR and the PROMPTS dict replace the built-in ones
+PROMPTS_DIR = getattr(config, "PROMPTS_DIR", None)
+PROMPTS = getattr(config, "PROMPTS", {})
+# Model name prefixes that get cache_control hints on the system prompt and history ([] disables them)
+PROMPT_CACHE_MODELS = getattr(config, "PROMPT_CACHE_MODELS", ["anthropic/", "google/gemini"])
+# Sentiment results cache (set SENTIMENT_CACHE_PATH to keep it across restarts)
+SENTIMENT_CACHE_SIZE = getattr(config, "SENTIMENT_CACHE_SIZE", 10000)
+SENTIMENT_CACHE_TTL = getattr(config, "SENTIMENT_CACHE_TTL", 24 * 60 * 60)
+SENTIMENT_CACHE_PATH = getattr(config, "SENTIMENT_CACHE_PATH", None)
+SENTIMENT_CACHE_MAX_ROWS = getattr(config, "SENTIMENT_CACHE_MAX_ROWS", 100000)
+# Stream replies into the chat by editing the message as tokens arrive
+STREAM_REPLIES = getattr(config, "STREAM_REPLIES", False)
+STREAM_EDIT_INTERVAL = getattr(config, "STREAM_EDIT_INTERVAL", 1.0)
+# Group sentiment requests arriving close together into one API call
+SENTIMENT_BATCHING = getattr(config, "SENTIMENT_BATCHING", False)
+SENTIMENT_BATCH_SIZE = getattr(config, "SENTIMENT_BATCH_SIZE", 16)
+SENTIMENT_BATCH_WAIT = getattr(config, "SENTIMENT_BATCH_WAIT", 0.05)
+# Serve Prometheus metrics on http://METRICS_HOST:METRICS_PORT/metrics (None disables the endpoint)
+METRICS_PORT = getattr(config, "METRICS_PORT", None)
+METRICS_HOST = getattr(config, "METRICS_HOST", "127.0.0.1")
+# Answer clearly polar sentences with the local lexicon scorer instead of MODEL
+LOCAL_SENTIMENT = getattr(config, "LOCAL_SENTIMENT", False)
+LOCAL_SENTIMENT_THRESHOLD = getattr(config, "LOCAL_SENTIMENT_THRESHOLD", 0.75)
+# Logging: "text" or "json" lines, a level per module, and the share of full API
+# responses/replies kept when LOG_LEVEL is DEBUG
+LOG_LEVEL = getattr(config, "LOG_LEVEL", "INFO")
+LOG_FORMAT = getattr(config, "LOG_FORMAT", "text")
+LOG_LEVELS = getattr(config, "LOG_LEVELS", {"httpx": "WARNING"})
+LOG_PAYLOAD_SAMPLE_RATE = getattr(config, "LOG_PAYLOAD_SAMPLE_RATE", 0.01)
+
+# Log records are written by a background thread so handlers never block on stderr
+log_listener = setup_logging(LOG_LEVEL, LOG_FORMAT, LOG_LEVELS, LOG_PAYLOAD_SAMPLE_RATE)
 
-if not TELEGRAM_TOKEN or not OPENROUTER_API_KEY or not OPENROUTER_API_KEY2:
-    logger.error("Please set TELEGRAM_TOKEN, OPENROUTER_API_KEY and OPENROUTER_API_KEY2 environment variables")
+if not TELEGRAM_TOKEN or not OPENROUTER_API_KEYS:
+    logger.error("Please set TELEGRAM_TOKEN and OPENROUTER_API_KEYS (or OPENROUTER_API_KEY) in config.py")
     exit(1)
 
-# Initialize the first OpenRouter API client for sentiment analysis
-client = OpenAI(
-    base_url="https://openrouter.ai/api/v1",
-    api_key=OPENROUTER_API_KEY,
+# Appended to local scorer results sent because the sentiment models are unavailable
+DEGRADED_ANALYSIS_NOTE = "Quick offline estimate: the analysis service is busy right now."
+
+# Request counts and stage latencies for finding bottlenecks under load
+metrics = MetricsRegistry()
+requests_total = metrics.counter("sentimentbot_requests_total", "Requests handled per mode", ("mode",))
+request_failures = metrics.counter(
+    "sentimentbot_request_failures_total", "Requests answered with an error message", ("mode",)
+)
+stage_seconds = metrics.histogram(
+    "sentimentbot_stage_seconds", "Latency of each stage: receive, queue, llm and send", ("stage",)
+)
+retries_total = metrics.counter("sentimentbot_retries_total", "LLM requests sent again after a failure", ("mode",))
+placeholder_rejections = metrics.counter(
+    "sentimentbot_placeholder_rejections_total", "Replies rejected for containing <tool_response>", ("mode",)
 )
+degraded_replies = metrics.counter(
+    "sentimentbot_degraded_replies_total", "Replies answered offline while every model circuit was open", ("mode",)
+)
+tokens_total = metrics.counter("sentimentbot_tokens_total", "Tokens reported in response.usage", ("mode", "kind"))
 
-# Initialize the second OpenRouter API client for advice and rizz modes
-client2 = OpenAI(
-    base_url="https://openrouter.ai/api/v1",
-    api_key=OPENROUTER_API_KEY2,
+# Pool of OpenRouter keys shared by the sentiment, advice and rizz modes
+circuit_breakers = CircuitBreakers(CIRCUIT_FAILURE_THRESHOLD, CIRCUIT_RESET_TIMEOUT)
+llm_pool = KeyPool(
+    OPENROUTER_API_KEYS, KEY_CONCURRENCY, cooldown=KEY_COOLDOWN, base_url=OPENROUTER_URL, breakers=circuit_breakers
+)
+# Picks the model for each request from the candidates of its mode
+model_router = ModelRouter(
+    {"analysis": SENTIMENT_MODELS, "advice": ADVICE_MODELS, "rizz": RIZZ_MODELS},
+    pool=llm_pool,
 )
+# Backoff between attempts and hedging of slow requests
+retry_policy = RetryPolicy(RETRY_ATTEMPTS, RETRY_BASE_DELAY, RETRY_MAX_DELAY)
+hedger = Hedger(percentile=HEDGE_PERCENTILE)
+
+async def create_completion(name: str, **kwargs):
+    """
+    Sends a chat completion request through the key pool.
+    With HEDGE_REQUESTS on, a slow request is raced against a backup request.
+    """
+    if HEDGE_REQUESTS:
+        response = await hedger.run(name, lambda: llm_pool.create(**kwargs))
+    else:
+        response = await llm_pool.create(**kwargs)
+    record_usage(name, response)
+    return response
+
+async def call_model(mode: str, make_call):
+    """
+    Runs make_call(model) through the model router for mode and records the LLM stage latency.
+    """
+    with stage_seconds.labels("llm").time():
+        return await model_router.run(mode, make_call)
+
+def record_usage(mode: str, response) -> None:
+    """
+    Adds the token counts of a chat completion response to the metrics.
+    """
+    record_tokens(mode, getattr(response, "usage", None))
+
+def record_tokens(mode: str, usage) -> None:
+    """
+    Adds the token counts of a response.usage to the metrics. "cached" counts the
+    prompt tokens the provider served from its prompt cache, "cache_write" the ones
+    it stored (only reported by some providers).
+    """
+    if usage is None:
+        return
+    tokens_total.labels(mode, "prompt").inc(usage.prompt_tokens or 0)
+    tokens_total.labels(mode, "completion").inc(usage.completion_tokens or 0)
+    details = getattr(usage, "prompt_tokens_details", None)
+    if details is not None:
+        tokens_total.labels(mode, "cached").inc(getattr(details, "cached_tokens", None) or 0)
+        tokens_total.labels(mode, "cache_write").inc(getattr(details, "cache_write_tokens", None) or 0)
 
-client3 = OpenAI(
-    base_url="https://openrouter.ai/api/v1",
-    api_key=OPENROUTER_API_KEY3,
+async def stream_completion(name: str, on_text, **kwargs) -> str:
+    """
+    Streams a chat completion through the key pool, awaiting on_text with the text so far.
+    The token usage sent at the end of the stream goes to the metrics.
+    """
+    return await llm_pool.stream_text(
+        on_text,
+        stream_options={"include_usage": True},
+        on_usage=lambda usage: record_tokens(name, usage),
+        **kwargs,
+    )
+
+# Runs the updates of each chat in order and different chats in parallel
+chat_scheduler = ChatScheduler(
+    MAX_CONCURRENT_UPDATES, CHAT_QUEUE_SIZE, on_wait=stage_seconds.labels("queue").observe
+)
+# Sheds messages from users and chats that send faster than the rate limits
+rate_limiter = RateLimiter(
+    user_rate=RATE_LIMIT_USER,
+    user_burst=RATE_LIMIT_USER_BURST,
+    chat_rate=RATE_LIMIT_CHAT,
+    chat_burst=RATE_LIMIT_CHAT_BURST,
+    global_rate=RATE_LIMIT_GLOBAL,
+    global_burst=RATE_LIMIT_GLOBAL_BURST,
 )
+# Merges bursts of advice/rizz messages into one turn
+message_coalescer = MessageCoalescer(COALESCE_QUIET_PERIOD, COALESCE_MAX_WAIT, max_hold=RATE_LIMIT_MAX_HOLD)
+# Chat modes and conversations live here when several workers serve the bot;
+# conversations expire after CONTEXT_MAX_IDLE, modes are kept
+state_backend = create_backend(STATE_BACKEND, ttl=CONTEXT_MAX_IDLE)
+# Tracks chat modes per chat ("analysis", "advice", or "rizz")
+chat_modes = ChatModes(state_backend)
+# Cache of sentiment analysis results keyed on the normalized sentence
+sentiment_cache = SentimentCache(
+    max_size=SENTIMENT_CACHE_SIZE,
+    ttl=SENTIMENT_CACHE_TTL,
+    path=SENTIMENT_CACHE_PATH,
+    max_rows=SENTIMENT_CACHE_MAX_ROWS,
+)
+# System prompts, loaded once and shared by every chat
+prompts = PromptRegistry.load(PROMPTS_DIR, PROMPTS)
+# Sentiment results are keyed on the whole fallback chain and the prompt, not on the model that
+# answered: any model of the chain is an acceptable answer, and changing either starts a fresh cache
+sentiment_cache_namespace = "\x00".join([*SENTIMENT_MODELS, prompts["sentiment"].text])
+# Marks the cacheable prefix for providers that only cache when asked to
+prompt_caching = PromptCaching(prompts, PROMPT_CACHE_MODELS)
+# Memory-capped store holding the conversation history of every chat
+conversations = ConversationStore(
+    max_bytes=CONTEXT_MAX_BYTES,
+    max_turns=CONTEXT_MAX_TURNS,
+    max_tokens=CONTEXT_MAX_TOKENS,
+    max_idle=CONTEXT_MAX_IDLE,
+    backend=state_backend,
+    prompts=prompts,
+)
+# Conversation context for advice mode per chat
+advice_context = conversations.namespace("advice")
+# Conversation context for rizz mode per chat
+rizz_context = conversations.namespace("rizz")
 
-# Dictionary to track chat modes per chat ("analysis", "advice", or "rizz")
-chat_modes = {}
-# Dictionary to maintain conversation context for advice mode per chat
-advice_context = {}
-# Dictionary to maintain conversation context for rizz mode per chat
-rizz_context = {}
+# Value of the sentimentbot_circuit_state gauge for each circuit state
+CIRCUIT_STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+# Saturation and component counters, read from their stats() when /metrics is scraped
+metrics.gauge("sentimentbot_updates_active", "Updates being processed", lambda: chat_scheduler.active)
+metrics.gauge("sentimentbot_updates_queued", "Updates waiting for their chat or a free slot",
+              lambda: chat_scheduler.stats()["queued"])
+metrics.gauge("sentimentbot_updates_limit", "Maximum updates processed at once", lambda: MAX_CONCURRENT_UPDATES)
+metrics.counter_function("sentimentbot_updates_dropped_total", "Updates dropped because their chat queue was full",
+                         lambda: chat_scheduler.dropped)
+metrics.gauge("sentimentbot_llm_in_flight", "OpenRouter requests in flight per key",
+              lambda: {(key["key"],): key["in_flight"] for key in llm_pool.stats()}, ("key",))
+metrics.gauge("sentimentbot_llm_in_flight_limit", "Maximum OpenRouter requests in flight per key",
+              lambda: KEY_CONCURRENCY)
+metrics.counter_function("sentimentbot_llm_requests_total", "OpenRouter requests sent per key",
+                         lambda: {(key["key"],): key["requests"] for key in llm_pool.stats()}, ("key",))
+metrics.counter_function("sentimentbot_llm_errors_total", "Failed OpenRouter requests per key",
+                         lambda: {(key["key"],): key["errors"] for key in llm_pool.stats()}, ("key",))
+metrics.gauge("sentimentbot_circuit_state", "Circuit per key and model: 0 closed, 1 half-open, 2 open",
+              lambda: {key: CIRCUIT_STATE_VALUES[breaker.state] for key, breaker in circuit_breakers._breakers.items()},
+              ("key", "model"))
+metrics.counter_function("sentimentbot_circuit_opened_total", "Times each circuit opened",
+                         lambda: {key: breaker.times_opened for key, breaker in circuit_breakers._breakers.items()},
+                         ("key", "model"))
+metrics.counter_function("sentimentbot_circuit_rejected_total", "Requests refused because every circuit was open",
+                         lambda: {key: breaker.rejected for key, breaker in circuit_breakers._breakers.items()},
+                         ("key", "model"))
+metrics.counter_function("sentimentbot_rate_limit_admitted_total", "Messages let through by the rate limiter",
+                         lambda: rate_limiter.accepted)
+metrics.counter_function("sentimentbot_rate_limited_total", "Messages shed by the rate limiter",
+                         lambda: {(scope,): count for scope, count in rate_limiter.rejected.items()}, ("scope",))
+metrics.counter_function("sentimentbot_sentiment_cache_hits_total", "Sentiment cache hits",
+                         lambda: sentiment_cache.hits)
+metrics.counter_function("sentimentbot_sentiment_cache_misses_total", "Sentiment cache misses",
+                         lambda: sentiment_cache.misses)
+metrics.counter_function("sentimentbot_sentiment_joins_total", "Sentiment requests that joined an identical one",
+                         lambda: sentiment_flights.joins)
+metrics.gauge("sentimentbot_conversation_bytes", "Memory used by stored conversations",
+              lambda: conversations.total_bytes)
+metrics.counter_function("sentimentbot_conversation_turns_lost_total",
+                         "Turns dropped because their conversation was evicted or reset meanwhile",
+                         lambda: conversations.lost_turns)
+# Serves the metrics above when METRICS_PORT is set
+metrics_server = MetricsServer(metrics, METRICS_HOST, METRICS_PORT) if METRICS_PORT else None
 
-def convert_bold_markdown_to_html(text: str) -> str:
+async def summarize_turns(summary: str, turns: list) -> str:
     """
-    Converts markdown bold markers **text** in the input to HTML <b>text</b>.
-    Only text between ** and ** is replaced.
+    Folds older conversation turns into the running summary of a chat.
+    Returns None if the summary could not be generated.
     """
-    return re.sub(r'\*\*(.+?)\*\*', r'<b>\1</b>', text)
+    transcript = "\n".join(f"{turn['role']}: {turn['content']}" for turn in turns)
+    if summary:
+        transcript = f"Previous summary: {summary}\n\n{transcript}"
+    try:
+        response = await call_model("advice", lambda model: llm_pool.create(
+            model=model,
+            messages=[
+                prompts["summary"].message,
+                {"role": "user", "content": transcript}
+            ]
+        ))
+        record_usage("summary", response)
+        return response.choices[0].message.content
+    except Exception as e:
+        logger.error("Error during summarize_turns: %s", e)
+        return None
 
-async def send_html_message(update: Update, text: str) -> None:
+# Trims the history sent with each request to the token budget
+context_window = ContextWindow(
+    token_budget=CONTEXT_TOKEN_BUDGET,
+    summarize=summarize_turns if CONTEXT_SUMMARIES else None,
+    trim_ratio=CONTEXT_TRIM_RATIO,
+)
+
+async def send_html_message(update: Update, text: str):
     """
-    Converts text from markdown bold to HTML bold and sends the reply with HTML parse mode.
+    Converts the Markdown in text to Telegram HTML and sends it as the reply, split over
+    several messages if it is too long for one. If Telegram rejects the formatting of a
+    chunk, that chunk and the ones after it are sent as plain text instead.
+    Returns the last sent message.
     """
-    formatted_text = convert_bold_markdown_to_html(text)
-    print(formatted_text)
-    await update.message.reply_text(formatted_text, parse_mode="HTML")
+    formatted_text = markdown_to_html(text)
+    logger.debug("Sending reply", extra={"payload": formatted_text})
+    chunks = split_html(formatted_text)
+    message = None
+    with stage_seconds.labels("send").time():
+        for sent, chunk in enumerate(chunks):
+            try:
+                message = await update.message.reply_text(chunk, parse_mode="HTML")
+            except BadRequest as e:
+                # The chunks before it were delivered, the rest is still worth delivering as plain text
+                logger.error("Telegram rejected the formatted reply: %s", e)
+                for rest in chunks[sent:]:
+                    message = await update.message.reply_text(html_to_text(rest))
+                break
+    return message
 
 async def send_normal_message(update: Update, text: str) -> None:
     """
-    Converts text from markdown bold to HTML bold and sends the reply with HTML parse mode.
+    Sends the reply as plain text, split over several messages if it is too long for one.
+    """
+    with stage_seconds.labels("send").time():
+        for chunk in split_text(text):
+            await update.message.reply_text(chunk)
+
+def sender_id(update: Update) -> int:
+    """
+    The user the rate limits charge for a message, the chat if Telegram doesn't say.
+    """
+    return update.effective_user.id if update.effective_user else update.message.chat_id
+
+async def admit_message(update: Update) -> bool:
+    """
+    Applies the rate limits to an incoming message. If it is shed, the chat gets a short
+    canned reply (once until it is admitted again) and False is returned.
     """
-    # formatted_text = convert_bold_markdown_to_html(text)
-    # print(formatted_text)
-    await update.message.reply_text(text)
+    chat_id = update.message.chat_id
+    if rate_limiter.admit(sender_id(update), chat_id):
+        return True
+    if rate_limiter.should_notify(chat_id):
+        await send_normal_message(update, "Whoa, slow down a little! Give me a few seconds before your next message.")
+    return False
 
-def perform_analysis(sentence: str) -> str:
+async def analyze_batch(sentences: list) -> list:
+    """
+    Analyses several sentences with a single OpenRouter call.
+    A lone sentence, or a reply that can't be parsed, gives None results so
+    perform_analysis falls back to the normal single-sentence prompt. So do
+    placeholder analyses, like placeholder replies on the single-sentence path.
+    """
+    if len(sentences) == 1:
+        return [None]
+    try:
+        messages = build_batch_messages(sentences, prompts["sentiment"].text)
+        response = await call_model("analysis", lambda model: llm_pool.create(model=model, messages=messages))
+        record_usage("batch", response)
+        results = parse_batch_reply(response.choices[0].message.content, len(sentences))
+    except Exception as e:
+        logger.error("Error during analyze_batch: %s", e)
+        results = None
+    if results is None:
+        logger.error("Could not parse the batch reply for %d sentences", len(sentences))
+        return [None] * len(sentences)
+    for i, analysis in enumerate(results):
+        if analysis is not None and "<tool_response>" in analysis:
+            logger.error("Batch item %d: Received placeholder response", i+1)
+            placeholder_rejections.labels("analysis").inc()
+            results[i] = None
+    return results
+
+# Lets concurrent requests for the same sentence share one API call
+sentiment_flights = SingleFlight()
+# Collects sentiment requests from concurrent handlers into batches
+sentiment_batcher = SentimentBatcher(
+    analyze_batch,
+    max_items=SENTIMENT_BATCH_SIZE,
+    max_wait=SENTIMENT_BATCH_WAIT,
+)
+
+async def perform_analysis(sentence: str, on_text=None) -> str:
     """
     Calls the OpenRouter API to perform sentiment analysis on the provided sentence.
-    Retries up to 3 times if a placeholder response is returned.
+    Results are cached, so repeated sentences are answered without an API call.
+    With LOCAL_SENTIMENT on, clearly polar sentences are scored locally without any API call.
+    Concurrent requests for the same sentence share one API call.
+    If on_text is given the reply is streamed and on_text is awaited with the text so far
+    (only for the request that started the call).
+    """
+    key = cache_key(sentence, sentiment_cache_namespace)
+    cached = sentiment_cache.get(key)
+    if cached is not None:
+        return cached
+    if LOCAL_SENTIMENT:
+        local = score_text(sentence)
+        if local.confidence >= LOCAL_SENTIMENT_THRESHOLD:
+            return local.to_text()
+    return await sentiment_flights.run(key, lambda: request_analysis(sentence, key, on_text))
+
+async def request_analysis(sentence: str, key: str, on_text=None) -> str:
     """
-    max_attempts = 3
-    for attempt in range(max_attempts):
-        print(f"\nAttempt {attempt+1} for input: {sentence}\n")
+    Sends the sentiment analysis request for perform_analysis and caches the result under key.
+    With SENTIMENT_BATCHING on, concurrent requests are first sent together as one batch.
+    While every circuit for the sentiment models is open the local scorer's result is returned instead,
+    marked as an estimate and not cached, if it clears LOCAL_SENTIMENT_THRESHOLD.
+    Retries with backoff if a placeholder response is returned or the call fails.
+    """
+    if SENTIMENT_BATCHING:
+        analysis = await sentiment_batcher.submit(sentence)
+        if analysis is not None:
+            sentiment_cache.put(key, analysis)
+            return analysis
+    messages = [
+        prompts["sentiment"].message,
+        {"role": "user", "content": f"Sentence: {sentence}"}
+    ]
+    error = None
+    for attempt in range(retry_policy.max_attempts):
+        await retry_policy.wait(attempt, error)
+        error = None
+        if attempt:
+            retries_total.labels("analysis").inc()
+        logger.debug("Attempt %d for input: %s", attempt+1, sentence)
         try:
-            response = client.chat.completions.create(
-                model=MODEL,
-                messages=[
-                    {
-                        "role": "system",
-                        "content": (
-                            "You are a helpful sentiment analysis assistant. For the given sentence, "
-                            "provide a concise analysis of its sentiment: state whether it is positive, negative, or neutral, "
-                            "and include a sentiment score from -10 (very negative) to 10 (very positive)."
-                        )
-                    },
-                    {"role": "user", "content": f"Sentence: {sentence}"}
-                ]
-            )
-            print(response)
-            analysis = response.choices[0].message.content
+            if on_text is not None:
+                analysis = await call_model(
+                    "analysis", lambda model: stream_completion("analysis", on_text, model=model, messages=messages)
+                )
+            else:
+                response = await call_model(
+                    "analysis", lambda model: create_completion("analysis", model=model, messages=messages)
+                )
+                logger.debug("Sentiment response", extra={"payload": response})
+                analysis = response.choices[0].message.content
             if "<tool_response>" in analysis:
                 logger.error("Attempt %d: Received placeholder response", attempt+1)
+                placeholder_rejections.labels("analysis").inc()
                 continue
+            sentiment_cache.put(key, analysis)
             return analysis
+        except CircuitOpenError as e:
+            # Every sentiment model is down, answer with the local scorer instead of waiting on retries,
+            # but only when it is as sure as on the fast path; otherwise the user gets the error message
+            logger.error("Attempt %d: %s", attempt+1, e)
+            local = score_text(sentence)
+            if local.confidence < LOCAL_SENTIMENT_THRESHOLD:
+                return None
+            degraded_replies.labels("analysis").inc()
+            return f"{local.to_text()}\n_{DEGRADED_ANALYSIS_NOTE}_"
         except Exception as e:
+            error = e
             logger.error("Attempt %d: Error during perform_analysis: %s", attempt+1, e)
     return None
 
-def perform_advice(chat_id: int, question: str) -> str:
+async def perform_advice(chat_id: int, question: str, on_text=None) -> str:
     """
     Maintains conversation context for advice mode.
     Appends the new question to the chat's advice context and calls the OpenRouter API
-    to get dating advice. Retries up to 3 times if a placeholder response is returned.
-    """
-    max_attempts = 3
-    if chat_id not in advice_context:
-        advice_context[chat_id] = [
-            {
-                "role": "system",
-                "content": (
-                    "You are a knowledgeable and supportive dating coach. "
-                    "Provide advice and answer questions related to dating, relationships, and personal development. "
-                    "Keep your responses friendly, encouraging, and clear."
-                )
-            }
-        ]
-    advice_context[chat_id].append({"role": "user", "content": question})
+    to get dating advice. Retries with backoff if a placeholder response is returned or the call fails.
+    If on_text is given the reply is streamed and on_text is awaited with the text so far.
+    """
+    await advice_context.start(chat_id, prompts["advice"])
+    await advice_context.append(chat_id, "user", question)
     
-    for attempt in range(max_attempts):
-        print(f"\nAdvice Attempt {attempt+1} for chat {chat_id} with input: {question}\n")
+    error = None
+    for attempt in range(retry_policy.max_attempts):
+        await retry_policy.wait(attempt, error)
+        error = None
+        if attempt:
+            retries_total.labels("advice").inc()
+        logger.debug("Advice Attempt %d for chat %s with input: %s", attempt+1, chat_id, question)
         try:
-            response = client2.chat.completions.create(
-                model=MODEL2,
-                messages=advice_context[chat_id]
-            )
-            print(response)
-            advice = response.choices[0].message.content
+            conversation = await advice_context.get(chat_id)
+            window_start = context_window.window_start(conversation)
+            messages = context_window.build(conversation, window_start)
+            if on_text is not None:
+                advice = await call_model(
+                    "advice", lambda model: stream_completion(
+                        "advice", on_text, model=model, messages=prompt_caching.apply(model, messages)
+                    )
+                )
+            else:
+                response = await call_model(
+                    "advice", lambda model: create_completion(
+                        "advice", model=model, messages=prompt_caching.apply(model, messages)
+                    )
+                )
+                logger.debug("Advice response", extra={"payload": response})
+                advice = response.choices[0].message.content
             if "<tool_response>" in advice:
                 logger.error("Advice Attempt %d: Received placeholder response", attempt+1)
+                placeholder_rejections.labels("advice").inc()
                 continue
-            advice_context[chat_id].append({"role": "assistant", "content": advice})
+            # Saved with the reply so the next request starts its window at the same turn
+            await advice_context.append(chat_id, "assistant", advice, window_start=window_start)
             return advice
+        except CircuitOpenError as e:
+            logger.error("Advice Attempt %d: %s", attempt+1, e)
+            return None
         except Exception as e:
+            error = e
             logger.error("Advice Attempt %d: Error during perform_advice: %s", attempt+1, e)
     return None
 
-def perform_rizz(chat_id: int, message: str) -> str:
+async def perform_rizz(chat_id: int, message: str, on_text=None) -> str:
     """
     Maintains conversation context for rizz mode.
     Appends the new message to the chat's rizz context and calls the OpenRouter API
     to get a flirtatious reply.
     The system prompt is adjusted so that replies are genuine, short, and like texting a real person.
-    Retries up to 3 times if a placeholder response is returned.
-    """
-    max_attempts = 3
-    if chat_id not in rizz_context:
-        rizz_context[chat_id] = [
-            {
-                "role": "system",
-                "content": (
-                    "You are a smooth, charismatic, and genuine conversationalist. "
-                    "Reply as if you're texting a real person: short, natural, and flirtatious. "
-                    "Keep your responses friendly and believable, without overdoing it."
-                    "You can also respond with smooth and casual jokes or pick-up lines."
-                    "Sound more flirtatious if possible, with a slight hint of innuendous"
-                    "Example responses to 'hey baby i am bored' can be 'Whats up babygirl?'' or 'U alone tonight?'"
-                    "responses to 'hello' can be similar to 'hey bby whatsup <3' or 'hi angel' or 'did u fall from heaven?'"
-                    "what is most important is conversation resumption, phrase the message in a way that allows the user to easier reply to the sent message"
-                    "always include things like 'how about you?' or 'what was it?' in order to allow user to reply"
-                    "Keep responses short and concise, include things like shorthand acronyms and emojis"
-                     "ILY / ILU - I Love You"
-                    "ILYSM - I Love You So Much"
-                    "XOXO - Hugs and Kisses"
-                    "WYD - What Are You Doing?"
-                    "LMIRL - Let's Meet In Real Life"
-                    "TTYL - Talk To You Later"
-                    "CU - See You (or CU later)"
-                    "DM - Direct Message (often used as 'slide into my DMs')"
-                    #"emoji replacements include:"
-                    "<3"    # Heart
-                    ":*"    # Kiss
-                    "xoxo"  # Hugs and kisses
-                    ";)"    # Wink
-                    ":-P"   # Playful tongue out
-                    "^^"    # Happy eyes/smile
-                    "<33"    # Extra love
-                    "never use emojis at the start of a message"
-
-                )
-            }
-        ]
-    rizz_context[chat_id].append({"role": "user", "content": message})
+    Retries with backoff if a placeholder response is returned or the call fails.
+    If on_text is given the reply is streamed and on_text is awaited with the text so far.
+    """
+    await rizz_context.start(chat_id, prompts["rizz"])
+    await rizz_context.append(chat_id, "user", message)
     
-    for attempt in range(max_attempts):
-        print(f"\nRizz Attempt {attempt+1} for chat {chat_id} with input: {message}\n")
+    error = None
+    for attempt in range(retry_policy.max_attempts):
+        await retry_policy.wait(attempt, error)
+        error = None
+        if attempt:
+            retries_total.labels("rizz").inc()
+        logger.debug("Rizz Attempt %d for chat %s with input: %s", attempt+1, chat_id, message)
         try:
-            response = client3.chat.completions.create(
-                model=MODEL2,
-                messages=rizz_context[chat_id]
-            )
-            # print(response)
-            rizz_reply = response.choices[0].message.content
-            print(rizz_reply)
+            conversation = await rizz_context.get(chat_id)
+            window_start = context_window.window_start(conversation)
+            messages = context_window.build(conversation, window_start)
+            if on_text is not None:
+                rizz_reply = await call_model(
+                    "rizz", lambda model: stream_completion(
+                        "rizz", on_text, model=model, messages=prompt_caching.apply(model, messages)
+                    )
+                )
+            else:
+                response = await call_model(
+                    "rizz", lambda model: create_completion(
+                        "rizz", model=model, messages=prompt_caching.apply(model, messages)
+                    )
+                )
+                rizz_reply = response.choices[0].message.content
+            logger.debug("Rizz reply", extra={"payload": rizz_reply})
             if "<tool_response>" in rizz_reply:
                 logger.error("Rizz Attempt %d: Received placeholder response", attempt+1)
+                placeholder_rejections.labels("rizz").inc()
                 continue
-            rizz_context[chat_id].append({"role": "assistant", "content": rizz_reply})
+            # Saved with the reply so the next request starts its window at the same turn
+            await rizz_context.append(chat_id, "assistant", rizz_reply, window_start=window_start)
             return rizz_reply
+        except CircuitOpenError as e:
+            logger.error("Rizz Attempt %d: %s", attempt+1, e)
+            return None
         except Exception as e:
+            error = e
             logger.error("Rizz Attempt %d: Error during perform_rizz: %s", attempt+1, e)
     return None
 
 async def analyze_message(update: Update, context: ContextTypes.DEFAULT_TYPE, sentence: str) -> None:
     """
-    Runs sentiment analysis in an executor and sends the result back to the user.
+    Runs sentiment analysis and sends the result back to the user.
     """
-    await send_html_message(update, "processing...")
-    loop = asyncio.get_running_loop()
-    analysis = await loop.run_in_executor(None, perform_analysis, sentence)
+    requests_total.labels("analysis").inc()
+    placeholder = await send_html_message(update, "processing...")
+    if STREAM_REPLIES:
+        streamer = TelegramStreamer(update, placeholder, STREAM_EDIT_INTERVAL)
+        analysis = await perform_analysis(sentence, lambda text: streamer.update(f"Sentiment Analysis:\n{text}"))
+        if analysis is None:
+            request_failures.labels("analysis").inc()
+            await streamer.finish("Sorry, an error occurred during sentiment analysis. Please try again later.")
+        else:
+            await streamer.finish(markdown_to_html(f"Sentiment Analysis:\n{analysis}"), "HTML")
+        return
+    analysis = await perform_analysis(sentence)
     if analysis is None:
+        request_failures.labels("analysis").inc()
         await send_html_message(update, "Sorry, an error occurred during sentiment analysis. Please try again later.")
     else:
         await send_html_message(update, f"Sentiment Analysis:\n{analysis}")
 
 async def advice_message(update: Update, context: ContextTypes.DEFAULT_TYPE, question: str) -> None:
     """
-    Runs the dating advice request (with conversation continuity) in an executor and sends the result back to the user.
+    Runs the dating advice request (with conversation continuity) and sends the result back to the user.
     """
-    await send_html_message(update, "processing advice...")
-    loop = asyncio.get_running_loop()
+    requests_total.labels("advice").inc()
+    placeholder = await send_html_message(update, "processing advice...")
     chat_id = update.message.chat_id
-    advice = await loop.run_in_executor(None, perform_advice, chat_id, question)
+    if STREAM_REPLIES:
+        streamer = TelegramStreamer(update, placeholder, STREAM_EDIT_INTERVAL)
+        advice = await perform_advice(chat_id, question, streamer.update)
+        if advice is None:
+            request_failures.labels("advice").inc()
+            await streamer.finish("Sorry, an error occurred while seeking dating advice. Please try again later.")
+        else:
+            await streamer.finish(markdown_to_html(advice), "HTML")
+        return
+    advice = await perform_advice(chat_id, question)
     if advice is None:
+        request_failures.labels("advice").inc()
         await send_html_message(update, "Sorry, an error occurred while seeking dating advice. Please try again later.")
     else:
         await send_html_message(update, advice)
 
 async def rizz_message(update: Update, context: ContextTypes.DEFAULT_TYPE, message: str) -> None:
     """
-    Runs the flirtatious (rizz mode) reply in an executor and sends the result back to the user.
+    Runs the flirtatious (rizz mode) reply and sends the result back to the user.
     """
-    loop = asyncio.get_running_loop()
+    requests_total.labels("rizz").inc()
     chat_id = update.message.chat_id
-    rizz_reply = await loop.run_in_executor(None, perform_rizz, chat_id, message)
+    if STREAM_REPLIES:
+        streamer = TelegramStreamer(update, interval=STREAM_EDIT_INTERVAL)
+        rizz_reply = await perform_rizz(chat_id, message, streamer.update)
+        if rizz_reply is None:
+            request_failures.labels("rizz").inc()
+            await streamer.finish("Sorry, an error occurred while processing your rizz. Please try again later.")
+        else:
+            await streamer.finish(rizz_reply)
+        return
+    rizz_reply = await perform_rizz(chat_id, message)
     if rizz_reply is None:
+        request_failures.labels("rizz").inc()
         await send_normal_message(update, "Sorry, an error occurred while processing your rizz. Please try again later.")
     else:
         await send_normal_message(update, rizz_reply)
 
+async def discard_context(chat_id: int, modes: tuple = ("advice", "rizz")) -> None:
+    """
+    Forgets the chat's conversation in each of modes and any of its messages still waiting to be answered there.
+    """
+    for mode in modes:
+        await (advice_context if mode == "advice" else rizz_context).discard(chat_id)
+        message_coalescer.discard((mode, chat_id))
+
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """
     Switches the chat to advice mode (default), clears any advice or rizz context,
     sends a welcome message, and then displays the inline menu.
     """
     chat_id = update.message.chat_id
-    chat_modes[chat_id] = "advice"  # default mode is advice
-    if chat_id in advice_context:
-        del advice_context[chat_id]
-    if chat_id in rizz_context:
-        del rizz_context[chat_id]
+    await chat_modes.set(chat_id, "advice")  # default mode is advice
+    await discard_context(chat_id)
     await send_html_message(update, "Welcome to DateAI!\nCC0002 project by team 2\n\nI am your personal AI dating assistant...\n\n-I can give advice and answer questions:\n/advice \n\n-Analyse messages for sentiment:\n/sentiment\n\n-Chat with me! :)\n/rizz\n\n/menu to display the menu...")
     await menu_inline_command(update, context)
 
@@ -273,13 +703,12 @@ async def analyze_command(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     Processes the /sentiment command, switching the chat to sentiment analysis mode.
     """
     chat_id = update.message.chat_id
-    chat_modes[chat_id] = "analysis"
-    if chat_id in advice_context:
-        del advice_context[chat_id]
-    if chat_id in rizz_context:
-        del rizz_context[chat_id]
+    await chat_modes.set(chat_id, "analysis")
+    await discard_context(chat_id)
     sentence = " ".join(context.args)
     if sentence:
+        if not await admit_message(update):
+            return
         await analyze_message(update, context, sentence)
     else:
         await send_html_message(update, "In sentiment mode")
@@ -291,11 +720,12 @@ async def advice_command(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     If a question is provided immediately, it will answer that; otherwise, the chat remains in advice mode.
     """
     chat_id = update.message.chat_id
-    chat_modes[chat_id] = "advice"
-    if chat_id in rizz_context:
-        del rizz_context[chat_id]
+    await chat_modes.set(chat_id, "advice")
+    await discard_context(chat_id, ("rizz",))
     question = " ".join(context.args)
     if question:
+        if not await admit_message(update):
+            return
         await advice_message(update, context, question)
     else:
         await send_html_message(update, "Hello! I am your friendly AI dating coach 😊\nAsk me anything!! I'm happy to help:)")
@@ -306,13 +736,12 @@ async def rizz_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
     If a message is provided immediately, it will reply flirtatiously; otherwise, the chat remains in rizz mode.
     """
     chat_id = update.message.chat_id
-    chat_modes[chat_id] = "rizz"
-    if chat_id in advice_context:
-        del advice_context[chat_id]
-    if chat_id in rizz_context:
-        del rizz_context[chat_id]
+    await chat_modes.set(chat_id, "rizz")
+    await discard_context(chat_id)
     message = " ".join(context.args)
     if message:
+        if not await admit_message(update):
+            return
         await rizz_message(update, context, message)
     else:
         await send_html_message(update, "Ni hao fine shyt😊")
@@ -321,11 +750,25 @@ async def text_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
     """
     Handles all text messages for active chats according to the current mode.
     """
+    # Telegram dates have one second resolution, so this is only a rough delivery delay
+    stage_seconds.labels("receive").observe(max(0.0, time.time() - update.message.date.timestamp()))
     chat_id = update.message.chat_id
-    if chat_id not in chat_modes:
+    mode = await chat_modes.get(chat_id)
+    if mode is None:
         return
     sentence = update.message.text
-    mode = chat_modes.get(chat_id, "analysis")
+    if mode != "analysis" and COALESCE_QUIET_PERIOD:
+        # The merged turn is charged to the rate limits once, in coalesced_message
+        message_coalescer.add((mode, chat_id), sentence, lambda text: coalesced_message(update, context, mode, text))
+        return
+    if not await admit_message(update):
+        if mode != "analysis":
+            # Held back and answered, together with anything the chat sends meanwhile, once the limits allow
+            message_coalescer.add(
+                (mode, chat_id), sentence, lambda text: coalesced_message(update, context, mode, text),
+                hold=rate_limiter.retry_after(sender_id(update), chat_id),
+            )
+        return
     if mode == "advice":
         await advice_message(update, context, sentence)
     elif mode == "rizz":
@@ -333,6 +776,21 @@ async def text_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
     else:
         await analyze_message(update, context, sentence)
 
+async def coalesced_message(update: Update, context: ContextTypes.DEFAULT_TYPE, mode: str, text: str) -> float:
+    """
+    Answers a burst of advice/rizz messages as one turn, unless the chat switched mode meanwhile.
+    The turn takes one token from the rate limits; if it is shed, returns the seconds until it
+    would be admitted so message_coalescer tries again then.
+    Goes through chat_scheduler so it stays in order with the chat's other updates.
+    """
+    chat_id = update.message.chat_id
+    if await chat_modes.get(chat_id) != mode:
+        return None
+    if not await admit_message(update):
+        return rate_limiter.retry_after(sender_id(update), chat_id)
+    reply = advice_message if mode == "advice" else rizz_message
+    await chat_scheduler.process_update(update, reply(update, context, text))
+
 async def menu_inline_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     keyboard = [
         [InlineKeyboardButton("/Advice", callback_data="menu_advice")],
@@ -349,30 +807,55 @@ async def menu_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
     chat_id = query.message.chat_id
 
     if data == "menu_advice":
-        chat_modes[chat_id] = "advice"
-        if chat_id in advice_context:
-            del advice_context[chat_id]
-        if chat_id in rizz_context:
-            del rizz_context[chat_id]
+        await chat_modes.set(chat_id, "advice")
+        await discard_context(chat_id)
         await query.edit_message_text("Hello! I am your friendly AI dating coach 😊\nAsk me anything!! I'm happy to help:)")
     elif data == "menu_sentiment":
-        chat_modes[chat_id] = "analysis"
-        if chat_id in advice_context:
-            del advice_context[chat_id]
-        if chat_id in rizz_context:
-            del rizz_context[chat_id]
+        await chat_modes.set(chat_id, "analysis")
+        await discard_context(chat_id)
         await query.edit_message_text("Switched to sentiment analysis mode... Send your messages for analysis")
     elif data == "menu_rizz":
-        chat_modes[chat_id] = "rizz"
-        if chat_id in advice_context:
-            del advice_context[chat_id]
-        if chat_id in rizz_context:
-            del rizz_context[chat_id]
+        await chat_modes.set(chat_id, "rizz")
+        await discard_context(chat_id)
         await query.edit_message_text("Ni hao fine shyt😊")
 
-def main() -> None:
-    """Start the bot."""
-    app = ApplicationBuilder().token(TELEGRAM_TOKEN).build()
+async def start_metrics(app) -> None:
+    """Starts the /metrics endpoint once the bot is initialized."""
+    if metrics_server is not None:
+        await metrics_server.start()
+
+async def shutdown(app) -> None:
+    """Closes the shared OpenRouter connection pool, the sentiment cache and the state backend when the bot stops."""
+    await close_http_client()
+    if metrics_server is not None:
+        await metrics_server.stop()
+    logger.info("Scheduler stats: %s", chat_scheduler.stats())
+    logger.info("Rate limiter stats: %s", rate_limiter.stats())
+    logger.info("Coalescer stats: %s", message_coalescer.stats())
+    logger.info("Key pool stats: %s", llm_pool.stats())
+    logger.info("Hedging stats: %s", hedger.stats())
+    logger.info("Circuit breaker stats: %s", circuit_breakers.stats())
+    logger.info("Model router stats: %s", model_router.stats())
+    logger.info("Sentiment cache stats: %s", sentiment_cache.stats())
+    logger.info("Sentiment single-flight stats: %s", sentiment_flights.stats())
+    logger.info("Conversation store stats: %s", conversations.stats())
+    logger.info("Prompt caching stats: %s", prompt_caching.stats())
+    sentiment_cache.close()
+    if state_backend is not None:
+        await state_backend.close()
+
+def build_application():
+    """Builds the bot application with all handlers registered."""
+    builder = ApplicationBuilder().token(TELEGRAM_TOKEN)
+    if TELEGRAM_BASE_URL:
+        builder = builder.base_url(TELEGRAM_BASE_URL)
+    app = (
+        builder
+        .concurrent_updates(chat_scheduler)
+        .post_init(start_metrics)
+        .post_shutdown(shutdown)
+        .build()
+    )
     app.add_handler(CommandHandler("start", start))
     app.add_handler(CommandHandler("menu", menu_inline_command))
     app.add_handler(CallbackQueryHandler(menu_callback, pattern="^menu_"))
@@ -380,7 +863,25 @@ def main() -> None:
     app.add_handler(CommandHandler("advice", advice_command))
     app.add_handler(CommandHandler("rizz", rizz_command))
     app.add_handler(MessageHandler(filters.TEXT & (~filters.COMMAND), text_handler))
-    app.run_polling()
+    return app
+
+def main() -> None:
+    """Start the bot, long polling by default or in webhook mode if WEBHOOK_URL is set."""
+    app = build_application()
+    if WEBHOOK_URL:
+        asyncio.run(run_webhook(
+            app,
+            WEBHOOK_URL,
+            host=WEBHOOK_LISTEN,
+            port=WEBHOOK_PORT,
+            path=WEBHOOK_PATH,
+            secret_token=WEBHOOK_SECRET,
+            workers=WEBHOOK_WORKERS,
+            queue_size=WEBHOOK_QUEUE_SIZE,
+            read_timeout=WEBHOOK_READ_TIMEOUT,
+        ))
+    else:
+        app.run_polling()
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,154 @@
+import time
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class PendingMessages:
+    """
+    Messages of one chat waiting for the chat to go quiet.
+    """
+    __slots__ = ("texts", "first", "last", "not_before", "flush", "task")
+
+    def __init__(self, now: float):
+        self.texts = []
+        self.first = now
+        self.last = now
+        self.not_before = now
+        self.flush = None
+        self.task = None
+
+
+class MessageCoalescer:
+    """
+    Merges messages sent in quick succession into a single turn.
+
+    add() buffers a message and returns right away. Once no new message has
+    arrived for quiet_period seconds (or max_wait seconds after the first
+    one, or after max_messages messages) the buffered texts are joined with
+    newlines and passed to the flush coroutine given with the latest message.
+    If flush returns a number of seconds instead of None (for example because
+    the turn was rate limited) the texts are buffered again, in front of any
+    that arrived meanwhile, and flushed once that time has passed.
+
+    A message added with hold (for example one shed by the rate limiter) keeps
+    the whole burst back for at least that many seconds. Messages that would
+    be held for more than max_hold seconds after the first one are dropped
+    and counted in expired instead, and so are messages past max_messages
+    while the burst is held back (counted in dropped).
+    """
+
+    def __init__(self, quiet_period: float = 1.0, max_wait: float = 5.0, max_messages: int = 10,
+                 max_hold: float = 60.0):
+        self.quiet_period = quiet_period
+        self.max_wait = max_wait
+        self.max_messages = max_messages
+        self.max_hold = max_hold
+        self._pending = {}
+        # The loop only keeps weak references to tasks, this keeps waiting and flushing bursts alive
+        self._tasks = set()
+        self.messages = 0
+        self.turns = 0
+        self.deferred = 0
+        self.expired = 0
+        self.dropped = 0
+        self.discarded = 0
+
+    def add(self, key, text: str, flush, hold: float = 0.0) -> None:
+        """
+        Buffers text for key (usually the chat). flush(merged_text) is awaited
+        once the burst is over, and no sooner than hold seconds from now.
+        """
+        now = time.monotonic()
+        self.messages += 1
+        pending = self._pending.get(key)
+        if now + hold - (pending.first if pending is not None else now) > self.max_hold:
+            self.expired += 1
+            logger.warning("Dropping message for %s, it would be held for over %.0fs", key, self.max_hold)
+            return
+        if pending is not None and len(pending.texts) >= self.max_messages:
+            # Only possible while held back, the burst is flushed as soon as it may be
+            self.dropped += 1
+            return
+        if pending is None:
+            pending = self._pending[key] = PendingMessages(now)
+            pending.task = self._start(self._wait_and_flush(key, pending))
+        pending.texts.append(text)
+        pending.last = now
+        pending.not_before = max(pending.not_before, now + hold)
+        pending.flush = flush
+        if len(pending.texts) >= self.max_messages and pending.not_before <= now:
+            pending.task.cancel()
+            self._start(self._flush(key, pending))
+
+    def discard(self, key) -> None:
+        """
+        Drops the buffered messages of key without flushing them.
+        """
+        pending = self._pending.pop(key, None)
+        if pending is not None:
+            pending.task.cancel()
+            self.discarded += len(pending.texts)
+
+    def _start(self, coroutine) -> asyncio.Task:
+        task = asyncio.create_task(coroutine)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    async def _wait_and_flush(self, key, pending: PendingMessages) -> None:
+        while True:
+            due = min(pending.last + self.quiet_period, pending.first + self.max_wait)
+            delay = max(due, pending.not_before) - time.monotonic()
+            if delay <= 0:
+                break
+            await asyncio.sleep(delay)
+        await self._flush(key, pending)
+
+    async def _flush(self, key, pending: PendingMessages) -> None:
+        if self._pending.get(key) is not pending:
+            return
+        del self._pending[key]
+        try:
+            retry_in = await pending.flush("\n".join(pending.texts))
+        except Exception as e:
+            logger.error("Error while handling coalesced messages for %s: %s", key, e)
+            retry_in = None
+        if retry_in is None:
+            self.turns += 1
+        else:
+            self._defer(key, pending, retry_in)
+
+    def _defer(self, key, pending: PendingMessages, retry_in: float) -> None:
+        """
+        Buffers the texts of a flush that asked to be retried in retry_in seconds.
+        """
+        now = time.monotonic()
+        if now + retry_in - pending.first > self.max_hold:
+            self.expired += len(pending.texts)
+            logger.warning("Dropping %d messages for %s, held for over %.0fs", len(pending.texts), key, self.max_hold)
+            return
+        self.deferred += 1
+        newer = self._pending.get(key)
+        if newer is not None:
+            newer.texts[:0] = pending.texts
+            newer.first = pending.first
+            newer.not_before = max(newer.not_before, now + retry_in)
+            return
+        pending.not_before = now + retry_in
+        self._pending[key] = pending
+        pending.task = self._start(self._wait_and_flush(key, pending))
+
+    def stats(self) -> dict:
+        return {
+            "messages": self.messages,
+            "turns": self.turns,
+            "merged": self.messages - self.turns - self.discarded - self.expired - self.dropped
+            - sum(len(p.texts) for p in self._pending.values()),
+            "pending": len(self._pending),
+            "deferred": self.deferred,
+            "expired": self.expired,
+            "dropped": self.dropped,
+            "discarded": self.discarded,
+        }
@@ -0,0 +1,253 @@
+import time
+import asyncio
+import logging
+from bisect import bisect_left
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# Latency buckets in seconds, from fast cache hits to slow LLM replies
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: tuple, values: tuple, extra: str = "") -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class Metric:
+    """
+    Base class of the metric types. A metric with label names holds one child
+    per combination of label values, see labels().
+    """
+    kind = None
+
+    def __init__(self, name: str, help: str, labelnames: tuple = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+
+    def labels(self, *values, **kwargs):
+        """
+        Returns the child for the given label values (positional or by name).
+        """
+        if kwargs:
+            values = tuple(kwargs[name] for name in self.labelnames)
+        child = self._children.get(values)
+        if child is None:
+            child = self._children[values] = self._new_child()
+        return child
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def _samples(self) -> list:
+        """
+        Returns (suffix, label values, extra label, value) tuples to render.
+        """
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for suffix, values, extra, value in self._samples():
+            lines.append(f"{self.name}{suffix}{_format_labels(self.labelnames, values, extra)} {value}")
+        return "\n".join(lines)
+
+
+class CounterValue:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount: float = 1) -> None:
+        self.value += amount
+
+
+class Counter(Metric):
+    """
+    A value that only goes up, like the number of requests.
+    """
+    kind = "counter"
+
+    def _new_child(self):
+        return CounterValue()
+
+    def inc(self, amount: float = 1) -> None:
+        self.labels().inc(amount)
+
+    def _samples(self) -> list:
+        return [("", values, "", child.value) for values, child in self._children.items()]
+
+
+class Gauge(Metric):
+    """
+    A value read when the metrics are collected. function returns a number,
+    or for a gauge with labels a dict mapping label value tuples to numbers.
+    """
+    kind = "gauge"
+
+    def __init__(self, name: str, help: str, labelnames: tuple = (), function=None):
+        super().__init__(name, help, labelnames)
+        self.function = function
+
+    def _samples(self) -> list:
+        value = self.function()
+        if not self.labelnames:
+            return [("", (), "", value)]
+        return [("", values, "", sample) for values, sample in value.items()]
+
+
+class CounterFunction(Gauge):
+    """
+    A counter kept elsewhere (for example in a component's stats()), read
+    when the metrics are collected.
+    """
+    kind = "counter"
+
+
+class HistogramValue:
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets: tuple):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    @contextmanager
+    def time(self):
+        """
+        Observes how long the with block took.
+        """
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.observe(time.monotonic() - start)
+
+
+class Histogram(Metric):
+    """
+    Distribution of observed values (usually latencies) over fixed buckets.
+    """
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def _new_child(self):
+        return HistogramValue(self.buckets)
+
+    def observe(self, value: float) -> None:
+        self.labels().observe(value)
+
+    def _samples(self) -> list:
+        samples = []
+        for values, child in self._children.items():
+            total = 0
+            for bound, count in zip(self.buckets + (float("inf"),), child.counts):
+                total += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                samples.append(("_bucket", values, f'le="{le}"', total))
+            samples.append(("_sum", values, "", child.sum))
+            samples.append(("_count", values, "", child.count))
+        return samples
+
+
+class MetricsRegistry:
+    """
+    Holds the metrics of the bot and renders them in the Prometheus text format.
+    """
+
+    def __init__(self):
+        self._metrics = {}
+
+    def _add(self, metric: Metric) -> Metric:
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric {metric.name} already registered")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help: str, labelnames: tuple = ()) -> Counter:
+        return self._add(Counter(name, help, labelnames))
+
+    def gauge(self, name: str, help: str, function, labelnames: tuple = ()) -> Gauge:
+        return self._add(Gauge(name, help, labelnames, function))
+
+    def counter_function(self, name: str, help: str, function, labelnames: tuple = ()) -> CounterFunction:
+        return self._add(CounterFunction(name, help, labelnames, function))
+
+    def histogram(self, name: str, help: str, labelnames: tuple = (), buckets: tuple = DEFAULT_BUCKETS) -> Histogram:
+        return self._add(Histogram(name, help, labelnames, buckets))
+
+    def render(self) -> str:
+        parts = []
+        for metric in self._metrics.values():
+            try:
+                parts.append(metric.render())
+            except Exception as e:
+                logger.error("Could not collect metric %s: %s", metric.name, e)
+        return "\n".join(parts) + "\n"
+
+
+class MetricsServer:
+    """
+    Serves the registry on GET path (default /metrics) for Prometheus to scrape.
+    Listens on localhost by default.
+    """
+
+    def __init__(self, registry: MetricsRegistry, host: str = "127.0.0.1", port: int = 9090, path: str = "/metrics"):
+        self.registry = registry
+        self.host = host
+        self.port = port
+        self.path = path
+        self._server = None
+
+    async def start(self) -> None:
+        self._server = await asyncio.start_server(self._handle_connection, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        logger.info("Metrics served on http://%s:%d%s", self.host, self.port, self.path)
+
+    async def stop(self) -> None:
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _handle_connection(self, reader, writer) -> None:
+        try:
+            request_line = await reader.readline()
+            while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+                pass
+            method, target = (request_line.decode("latin-1").split() + ["", ""])[:2]
+            if target.split("?")[0] != self.path:
+                status, body = "404 Not Found", b""
+            elif method != "GET":
+                status, body = "405 Method Not Allowed", b""
+            else:
+                status, body = "200 OK", self.registry.render().encode("utf-8")
+            writer.write(
+                f"HTTP/1.1 {status}\r\n"
+                f"Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+                f"Content-Length: {len(body)}\r\n"
+                f"Connection: close\r\n\r\n".encode("latin-1") + body
+            )
+            await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
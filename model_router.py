@@ -0,0 +1,130 @@
+import time
+import random
+import logging
+
+from circuit_breaker import CircuitOpenError
+
+logger = logging.getLogger(__name__)
+
+# Weight of the newest sample in the moving averages
+ALPHA = 0.2
+
+
+class ModelStats:
+    """
+    Rolling latency and success rate of one model.
+    """
+    __slots__ = ("requests", "failures", "latency", "success_rate", "last_failure")
+
+    def __init__(self):
+        self.requests = 0
+        self.failures = 0
+        self.latency = None
+        self.success_rate = 1.0
+        self.last_failure = 0.0
+
+    def record(self, ok: bool, latency: float = None) -> None:
+        self.requests += 1
+        if not ok:
+            self.failures += 1
+            self.last_failure = time.monotonic()
+        self.success_rate = ALPHA * (1.0 if ok else 0.0) + (1 - ALPHA) * self.success_rate
+        if latency is not None:
+            self.latency = latency if self.latency is None else ALPHA * latency + (1 - ALPHA) * self.latency
+
+
+class ModelRouter:
+    """
+    Chooses which model serves a request, from an ordered list of candidate
+    models per mode.
+
+    Healthy models (recent success rate at least min_success_rate and not
+    every circuit open) are tried fastest first, except that models with no
+    latency measured yet go first (in configured order) so every candidate
+    gets measured. Unhealthy models are tried last
+    and count as healthy again recovery_time seconds after their last failure.
+    Once in a while (explore_rate) a random healthy model is tried first so
+    its latency stays up to date.
+
+    Every mode needs at least one candidate, otherwise ValueError is raised.
+    """
+
+    def __init__(self, models: dict, pool=None, min_success_rate: float = 0.5, explore_rate: float = 0.05,
+                 recovery_time: float = 60.0):
+        self.models = {mode: list(dict.fromkeys(candidates)) for mode, candidates in models.items()}
+        empty = [mode for mode, candidates in self.models.items() if not candidates]
+        if empty:
+            # run() would have nothing to try, fail at startup instead of on the first message
+            raise ValueError(f"No candidate models configured for: {', '.join(empty)}")
+        self.pool = pool
+        self.min_success_rate = min_success_rate
+        self.recovery_time = recovery_time
+        self.explore_rate = explore_rate
+        self._stats = {}
+
+    def stats_for(self, model: str) -> ModelStats:
+        stats = self._stats.get(model)
+        if stats is None:
+            stats = self._stats[model] = ModelStats()
+        return stats
+
+    def healthy(self, model: str) -> bool:
+        stats = self.stats_for(model)
+        if (stats.success_rate < self.min_success_rate
+                and time.monotonic() - stats.last_failure < self.recovery_time):
+            return False
+        return self.pool is None or self.pool.available(model)
+
+    def order(self, mode: str) -> list:
+        """
+        Returns the candidate models for mode in the order they should be tried.
+        """
+        candidates = self.models[mode]
+        healthy = [model for model in candidates if self.healthy(model)]
+        unhealthy = [model for model in candidates if model not in healthy]
+        # sort() is stable, so models with equal latency keep the configured order
+        healthy.sort(key=self._sort_latency)
+        if len(healthy) > 1 and random.random() < self.explore_rate:
+            healthy.insert(0, healthy.pop(random.randrange(1, len(healthy))))
+        return healthy + unhealthy
+
+    def _sort_latency(self, model: str) -> float:
+        stats = self.stats_for(model)
+        if stats.latency is not None:
+            return stats.latency
+        # Not measured yet: try it early unless it has only ever failed
+        return 0.0 if stats.failures == 0 else float("inf")
+
+    async def run(self, mode: str, make_call):
+        """
+        Awaits make_call(model) for each candidate model until one succeeds.
+        Raises the last API error, or CircuitOpenError if every model's
+        circuit was open.
+        """
+        error = None
+        for model in self.order(mode):
+            start = time.monotonic()
+            try:
+                result = await make_call(model)
+            except CircuitOpenError as e:
+                error = error or e
+                continue
+            except Exception as e:
+                self.stats_for(model).record(False)
+                logger.error("Model %s failed for %s: %s", model, mode, e)
+                error = e
+                continue
+            self.stats_for(model).record(True, time.monotonic() - start)
+            return result
+        raise error
+
+    def stats(self) -> dict:
+        return {
+            model: {
+                "requests": stats.requests,
+                "failures": stats.failures,
+                "success_rate": stats.success_rate,
+                "latency": stats.latency,
+            }
+            for model, stats in self._stats.items()
+        }
@@ -0,0 +1,167 @@
+import os
+import glob
+import logging
+
+from context_window import estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+# Marks the end of a prefix the provider should cache, for the providers that need to be told
+CACHE_CONTROL = {"type": "ephemeral"}
+
+# Built-in system prompts, by name. PROMPTS_DIR files and the PROMPTS setting override them.
+DEFAULT_PROMPTS = {
+    "sentiment": (
+        "You are a helpful sentiment analysis assistant. For the given sentence, "
+        "provide a concise analysis of its sentiment: state whether it is positive, negative, or neutral, "
+        "and include a sentiment score from -10 (very negative) to 10 (very positive)."
+    ),
+    "advice": (
+        "You are a knowledgeable and supportive dating coach. "
+        "Provide advice and answer questions related to dating, relationships, and personal development. "
+        "Keep your responses friendly, encouraging, and clear."
+    ),
+    "rizz": (
+        "You are a smooth, charismatic, and genuine conversationalist. "
+        "Reply as if you're texting a real person: short, natural, and flirtatious. "
+        "Keep your responses friendly and believable, without overdoing it."
+        "You can also respond with smooth and casual jokes or pick-up lines."
+        "Sound more flirtatious if possible, with a slight hint of innuendous"
+        "Example responses to 'hey baby i am bored' can be 'Whats up babygirl?'' or 'U alone tonight?'"
+        "responses to 'hello' can be similar to 'hey bby whatsup <3' or 'hi angel' or 'did u fall from heaven?'"
+        "what is most important is conversation resumption, phrase the message in a way that allows the user to easier reply to the sent message"
+        "always include things like 'how about you?' or 'what was it?' in order to allow user to reply"
+        "Keep responses short and concise, include things like shorthand acronyms and emojis"
+        "ILY / ILU - I Love You"
+        "ILYSM - I Love You So Much"
+        "XOXO - Hugs and Kisses"
+        "WYD - What Are You Doing?"
+        "LMIRL - Let's Meet In Real Life"
+        "TTYL - Talk To You Later"
+        "CU - See You (or CU later)"
+        "DM - Direct Message (often used as 'slide into my DMs')"
+        #"emoji replacements include:"
+        "<3"    # Heart
+        ":*"    # Kiss
+        "xoxo"  # Hugs and kisses
+        ";)"    # Wink
+        ":-P"   # Playful tongue out
+        "^^"    # Happy eyes/smile
+        "<33"    # Extra love
+        "never use emojis at the start of a message"
+    ),
+    "summary": (
+        "Summarize this conversation in a few sentences. "
+        "Keep names, facts about the user and anything they asked to remember."
+    ),
+}
+
+
+def cache_breakpoint(message: dict) -> dict:
+    """
+    Copy of message with its text marked as a prompt cache breakpoint.
+    """
+    if not isinstance(message["content"], str):
+        return message
+    return {**message, "content": [{"type": "text", "text": message["content"], "cache_control": CACHE_CONTROL}]}
+
+
+class Prompt:
+    """
+    A system prompt, prepared once and shared by every chat and request that
+    uses it. message is the ready-made system message and cached_message the
+    same marked as a prompt cache breakpoint; neither must be changed.
+    """
+    __slots__ = ("name", "text", "tokens", "message", "cached_message")
+
+    def __init__(self, name: str, text: str):
+        self.name = name
+        self.text = text
+        self.tokens = estimate_tokens(text)
+        self.message = {"role": "system", "content": text}
+        self.cached_message = cache_breakpoint(self.message)
+
+    def __repr__(self) -> str:
+        return f"Prompt({self.name!r}, {self.tokens} tokens)"
+
+
+class PromptRegistry:
+    """
+    All system prompts of the bot by name, loaded once at startup.
+    """
+
+    def __init__(self, texts: dict):
+        self._prompts = {name: Prompt(name, text) for name, text in texts.items()}
+        self._by_text = {prompt.text: prompt for prompt in self._prompts.values()}
+
+    @classmethod
+    def load(cls, directory: str = None, overrides: dict = None) -> "PromptRegistry":
+        """
+        The built-in prompts, replaced by <name>.txt files from directory and
+        then by the overrides dict (name -> text).
+        """
+        texts = dict(DEFAULT_PROMPTS)
+        if directory:
+            paths = sorted(glob.glob(os.path.join(directory, "*.txt")))
+            if not paths:
+                logger.warning("No prompt files found in %s", directory)
+            for path in paths:
+                with open(path, encoding="utf-8") as f:
+                    texts[os.path.splitext(os.path.basename(path))[0]] = f.read().rstrip("\n")
+        texts.update(overrides or {})
+        return cls(texts)
+
+    def __getitem__(self, name: str) -> Prompt:
+        return self._prompts[name]
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._prompts
+
+    def get(self, name: str):
+        return self._prompts.get(name)
+
+    def find(self, text: str):
+        """
+        Returns the registered prompt with exactly this text, or None.
+        """
+        return self._by_text.get(text)
+
+    def names(self) -> list:
+        return list(self._prompts)
+
+
+class PromptCaching:
+    """
+    Adds cache_control breakpoints for models whose provider only caches
+    prompts it is told to (matched by model name prefix, e.g. "anthropic/").
+    Other providers cache repeated prefixes on their own and get the
+    messages unchanged.
+
+    Breakpoints go on the system prompt and on the latest message, so the
+    next request of the same chat can reuse everything before its new turn.
+    """
+
+    def __init__(self, registry: PromptRegistry, models=("anthropic/", "google/gemini")):
+        self.registry = registry
+        self.models = tuple(models or ())
+        self.hinted = 0
+
+    def supports(self, model: str) -> bool:
+        return bool(self.models) and model is not None and model.startswith(self.models)
+
+    def apply(self, model: str, messages: list) -> list:
+        if not messages or not self.supports(model):
+            return messages
+        first = messages[0]
+        if first["role"] == "system":
+            prompt = self.registry.find(first["content"]) if isinstance(first["content"], str) else None
+            first = prompt.cached_message if prompt is not None else cache_breakpoint(first)
+        if len(messages) == 1:
+            messages = [first]
+        else:
+            messages = [first, *messages[1:-1], cache_breakpoint(messages[-1])]
+        self.hinted += 1
+        return messages
+
+    def stats(self) -> dict:
+        return {"hinted_requests": self.hinted}
@@ -0,0 +1,117 @@
+import time
+import logging
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    """
+    Allows rate requests per second on average with bursts of up to burst.
+    """
+    __slots__ = ("rate", "burst", "tokens", "updated")
+
+    def __init__(self, rate: float, burst: float, now: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = now
+
+    def refill(self, now: float) -> float:
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        return self.tokens
+
+
+class RateLimiter:
+    """
+    Token bucket admission control per user, per chat and for the whole bot.
+
+    A message is admitted only if all three buckets have a token left, and
+    only then is a token taken from each, so a rejected message costs
+    nothing. Any rate set to None disables that bucket. At most max_buckets
+    user and chat buckets are kept; the least recently used are dropped,
+    which just gives them a full bucket again.
+
+    retry_after() tells how long a shed message has to wait before it would
+    be admitted, so callers can hold it back instead of dropping it.
+    """
+
+    def __init__(self, user_rate: float = 0.5, user_burst: float = 5, chat_rate: float = 1.0,
+                 chat_burst: float = 10, global_rate: float = None, global_burst: float = 100,
+                 max_buckets: int = 100000):
+        self.user_rate = user_rate
+        self.user_burst = user_burst
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_buckets = max_buckets
+        self._global = TokenBucket(global_rate, global_burst, time.monotonic()) if global_rate else None
+        self._users = OrderedDict()
+        self._chats = OrderedDict()
+        self._notified = set()
+        self.accepted = 0
+        self.rejected = {"user": 0, "chat": 0, "global": 0}
+
+    def admit(self, user_id, chat_id) -> bool:
+        """
+        Takes a token for the message if every bucket has one. Returns whether
+        the message may be processed.
+        """
+        now = time.monotonic()
+        buckets = self._buckets(user_id, chat_id, now)
+        for scope, bucket in buckets:
+            if bucket.refill(now) < 1:
+                self.rejected[scope] += 1
+                return False
+        for _, bucket in buckets:
+            bucket.tokens -= 1
+        self.accepted += 1
+        self._notified.discard(chat_id)
+        return True
+
+    def should_notify(self, chat_id) -> bool:
+        """
+        Whether the chat should be told it is being rate limited. True only for
+        the first rejection until a message of the chat is admitted again.
+        """
+        if chat_id in self._notified:
+            return False
+        if len(self._notified) >= self.max_buckets:
+            self._notified.clear()
+        self._notified.add(chat_id)
+        return True
+
+    def retry_after(self, user_id, chat_id) -> float:
+        """
+        Seconds until every bucket of the message has a token again (0 if it would be admitted now).
+        """
+        now = time.monotonic()
+        return max(
+            [(1 - bucket.refill(now)) / bucket.rate for _, bucket in self._buckets(user_id, chat_id, now)] + [0.0]
+        )
+
+    def _buckets(self, user_id, chat_id, now: float) -> list:
+        buckets = []
+        if self.user_rate:
+            buckets.append(("user", self._bucket(self._users, user_id, self.user_rate, self.user_burst, now)))
+        if self.chat_rate:
+            buckets.append(("chat", self._bucket(self._chats, chat_id, self.chat_rate, self.chat_burst, now)))
+        if self._global is not None:
+            buckets.append(("global", self._global))
+        return buckets
+
+    def _bucket(self, buckets: OrderedDict, key, rate: float, burst: float, now: float) -> TokenBucket:
+        bucket = buckets.get(key)
+        if bucket is None:
+            bucket = buckets[key] = TokenBucket(rate, burst, now)
+            if len(buckets) > self.max_buckets:
+                buckets.popitem(last=False)
+        else:
+            buckets.move_to_end(key)
+        return bucket
+
+    def stats(self) -> dict:
+        return {
+            "accepted": self.accepted,
+            "rejected": dict(self.rejected),
+        }
@@ -0,0 +1,134 @@
+import random
+import asyncio
+import logging
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+
+def retry_after_seconds(error) -> float:
+    """
+    Reads the Retry-After header of a failed API response, if there is one.
+    """
+    response = getattr(error, "response", None)
+    if response is None:
+        return None
+    value = response.headers.get("retry-after")
+    try:
+        return float(value) if value is not None else None
+    except ValueError:
+        return None
+
+
+class RetryPolicy:
+    """
+    How often and how long to wait before retrying an API call.
+
+    Waits follow exponential backoff with full jitter (a random time between 0
+    and base_delay * 2**attempt, capped at max_delay), so retries from many
+    handlers don't hit the provider at the same moment. A Retry-After header
+    on the previous error takes precedence.
+    """
+
+    def __init__(self, max_attempts: int = 3, base_delay: float = 0.5, max_delay: float = 20.0):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def delay(self, attempt: int, error=None) -> float:
+        """
+        Seconds to wait before the given attempt (0 is the first attempt).
+        """
+        if attempt == 0:
+            return 0.0
+        retry_after = retry_after_seconds(error) if error is not None else None
+        if retry_after is not None:
+            return min(retry_after, self.max_delay) + random.uniform(0, self.base_delay)
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+
+    async def wait(self, attempt: int, error=None) -> None:
+        delay = self.delay(attempt, error)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+class Hedger:
+    """
+    Sends a second, backup request when the first one is slower than the
+    recent p-th percentile latency, and returns whichever finishes first.
+
+    Latencies are tracked separately per name (e.g. per mode). Until
+    min_samples latencies are known no backup is sent.
+    """
+
+    def __init__(self, percentile: float = 95, window: int = 200, min_samples: int = 20):
+        self.percentile = percentile
+        self.window = window
+        self.min_samples = min_samples
+        self._latencies = {}
+        self.hedged = 0
+        self.hedge_wins = 0
+
+    def threshold(self, name: str) -> float:
+        samples = self._latencies.get(name)
+        if not samples or len(samples) < self.min_samples:
+            return None
+        ordered = sorted(samples)
+        index = min(len(ordered) - 1, int(len(ordered) * self.percentile / 100))
+        return ordered[index]
+
+    def record(self, name: str, latency: float) -> None:
+        samples = self._latencies.get(name)
+        if samples is None:
+            samples = self._latencies[name] = deque(maxlen=self.window)
+        samples.append(latency)
+
+    async def run(self, name: str, make_call):
+        """
+        Awaits make_call(), calling it a second time if the first call is too slow.
+        make_call must return a new coroutine every time it is called.
+        """
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        threshold = self.threshold(name)
+        tasks = [asyncio.ensure_future(make_call())]
+        try:
+            primary = tasks[0]
+            if threshold is None:
+                result = await primary
+                self.record(name, loop.time() - start)
+                return result
+
+            done, _ = await asyncio.wait({primary}, timeout=threshold)
+            if done:
+                result = primary.result()
+                self.record(name, loop.time() - start)
+                return result
+
+            self.hedged += 1
+            backup = asyncio.ensure_future(make_call())
+            tasks.append(backup)
+            pending = {primary, backup}
+            error = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is backup:
+                            self.hedge_wins += 1
+                        self.record(name, loop.time() - start)
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            # Also reached when the caller is cancelled while waiting, the requests must not outlive it
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+
+    def stats(self) -> dict:
+        return {
+            "hedged": self.hedged,
+            "hedge_wins": self.hedge_wins,
+            "thresholds": {name: self.threshold(name) for name in self._latencies},
+        }
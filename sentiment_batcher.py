@@ -0,0 +1,125 @@
+import json
+import asyncio
+import logging
+
+from prompts import DEFAULT_PROMPTS
+
+logger = logging.getLogger(__name__)
+
+# Appended to the single-sentence system prompt, so every analysis in a batch reads like a single reply
+BATCH_INSTRUCTIONS = (
+    "You will be given a numbered list of sentences. Analyse every sentence on its own, exactly as "
+    "you would if it were the only one. Reply only with a JSON array containing one object per "
+    "sentence, in the same order, like "
+    '[{"sentiment": "positive", "score": 7, "analysis": "..."}], '
+    "where analysis is your complete answer for that sentence."
+)
+
+
+def build_batch_messages(sentences: list, prompt: str = DEFAULT_PROMPTS["sentiment"]) -> list:
+    """
+    Builds the chat messages asking for an analysis of every sentence at once.
+    prompt is the system prompt used for a single sentence.
+    """
+    lines = "\n".join(f"{i + 1}. {json.dumps(sentence, ensure_ascii=False)}" for i, sentence in enumerate(sentences))
+    return [
+        {"role": "system", "content": f"{prompt}\n\n{BATCH_INSTRUCTIONS}"},
+        {"role": "user", "content": f"Sentences:\n{lines}"},
+    ]
+
+
+def parse_batch_items(text: str, count: int) -> list:
+    """
+    Extracts the JSON array returned for a batch. Items that are not objects
+    with a score become None. Returns None if the reply is not a JSON array
+    with count items.
+    """
+    start = text.find("[")
+    end = text.rfind("]")
+    if start == -1 or end < start:
+        return None
+    try:
+        items = json.loads(text[start:end + 1])
+    except ValueError:
+        return None
+    if not isinstance(items, list) or len(items) != count:
+        return None
+    return [item if isinstance(item, dict) and "score" in item else None for item in items]
+
+
+def parse_batch_reply(text: str, count: int) -> list:
+    """
+    Turns the JSON array returned for a batch into one analysis text per sentence,
+    in the same form as the reply to a single sentence. Items without an analysis
+    become None. Returns None if the reply is not a JSON array with count items.
+    """
+    items = parse_batch_items(text, count)
+    if items is None:
+        return None
+    results = []
+    for item in items:
+        analysis = item.get("analysis") if item is not None else None
+        results.append(analysis.strip() if isinstance(analysis, str) and analysis.strip() else None)
+    return results
+
+
+class SentimentBatcher:
+    """
+    Collects sentiment requests that arrive within max_wait seconds (or until
+    max_items are waiting) and hands them to send_batch as one list.
+
+    send_batch is a coroutine taking a list of sentences and returning a list
+    of results in the same order. A None result tells the caller to fall back
+    to analysing that sentence on its own.
+    """
+
+    def __init__(self, send_batch, max_items: int = 16, max_wait: float = 0.05):
+        self.send_batch = send_batch
+        self.max_items = max_items
+        self.max_wait = max_wait
+        self._pending = []
+        self._timer = None
+        # The loop only keeps weak references to tasks, this keeps running batches alive
+        self._tasks = set()
+        self.batches = 0
+        self.items = 0
+
+    async def submit(self, sentence: str):
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((sentence, future))
+        if len(self._pending) >= self.max_items:
+            self._flush()
+        elif self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(self.max_wait, self._flush)
+        return await future
+
+    def _flush(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        if batch:
+            task = asyncio.create_task(self._run(batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, batch: list) -> None:
+        self.batches += 1
+        self.items += len(batch)
+        try:
+            results = await self.send_batch([sentence for sentence, _ in batch])
+        except Exception as e:
+            logger.error("Error during sentiment batch: %s", e)
+            results = None
+        if not results or len(results) != len(batch):
+            results = [None] * len(batch)
+        for (_, future), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
+
+    def stats(self) -> dict:
+        return {
+            "batches": self.batches,
+            "items": self.items,
+            "average_batch": self.items / self.batches if self.batches else 0.0,
+        }
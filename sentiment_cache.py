@@ -0,0 +1,211 @@
+import re
+import time
+import asyncio
+import sqlite3
+import threading
+import hashlib
+import logging
+import unicodedata
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+_SPACE_RE = re.compile(r"\s+")
+# "Great!!!" and "great!" read the same; other punctuation is kept, emoticons like :) and :( carry the sentiment
+_TRAILING_PUNCTUATION_RE = re.compile(r"([.!?])[.!?]+$")
+
+
+def normalize_text(text: str) -> str:
+    """
+    Normalizes a message so trivially different inputs share a cache entry:
+    case and whitespace are ignored and a run of trailing .!? counts as its
+    first character, so "Hi!!!", "hi!" and " HI! " all become "hi!".
+    """
+    text = unicodedata.normalize("NFKC", text).casefold()
+    text = _SPACE_RE.sub(" ", text).strip()
+    return _TRAILING_PUNCTUATION_RE.sub(r"\1", text)
+
+
+def cache_key(text: str, namespace: str = "") -> str:
+    """
+    Hash of the normalized text. namespace (e.g. the model name) keeps results
+    from different prompts or models apart. Text that normalizes to nothing
+    is hashed as it is, so such messages don't all share one entry.
+    """
+    data = f"{namespace}\x00{normalize_text(text) or text}".encode("utf-8")
+    return hashlib.sha1(data).hexdigest()
+
+
+class SentimentCache:
+    """
+    Size-bounded LRU cache of sentiment analysis results with a TTL.
+
+    If path is given the entries are also written to an SQLite file, so the
+    cache survives restarts. Writes are collected and committed in batches
+    (every write_delay seconds or write_batch entries) on a worker thread, so
+    the event loop never waits for a commit. The file keeps at most max_rows
+    entries: expired and the oldest surplus rows are pruned every
+    prune_interval seconds. hits, misses and disk_hits count lookups.
+    """
+
+    def __init__(self, max_size: int = 10000, ttl: float = 24 * 60 * 60, path: str = None,
+                 max_rows: int = 100000, write_batch: int = 64, write_delay: float = 1.0,
+                 prune_interval: float = 5 * 60):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.max_rows = max_rows
+        self.write_batch = write_batch
+        self.write_delay = write_delay
+        self.prune_interval = prune_interval
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.pruned = 0
+        self._db = None
+        self._writer = None
+        self._write_lock = threading.Lock()
+        # Entries put but not written yet, key -> (value, expires)
+        self._unwritten = {}
+        self._write_timer = None
+        self._tasks = set()
+        self._next_prune = 0.0
+        if path:
+            self._open(path)
+
+    def _open(self, path: str) -> None:
+        # Lookups use their own connection so they never wait for a commit (WAL readers don't block)
+        self._writer = sqlite3.connect(path, check_same_thread=False)
+        self._writer.execute("PRAGMA journal_mode=WAL")
+        self._writer.execute("PRAGMA synchronous=NORMAL")
+        self._writer.execute(
+            "CREATE TABLE IF NOT EXISTS sentiment_cache ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, expires REAL NOT NULL)"
+        )
+        self._writer.commit()
+        self._prune()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+
+    def get(self, key: str):
+        """
+        Returns the cached result for key, or None on a miss.
+        """
+        now = time.time()
+        entry = self._entries.get(key)
+        if entry is not None:
+            expires, value = entry
+            if expires > now:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return value
+            del self._entries[key]
+
+        if self._db is not None:
+            row = self._unwritten.get(key)
+            if row is None:
+                row = self._db.execute(
+                    "SELECT value, expires FROM sentiment_cache WHERE key = ?", (key,)
+                ).fetchone()
+            if row is not None and row[1] > now:
+                self._remember(key, row[0], row[1])
+                self.hits += 1
+                self.disk_hits += 1
+                return row[0]
+
+        self.misses += 1
+        return None
+
+    def put(self, key: str, value: str) -> None:
+        expires = time.time() + self.ttl
+        self._remember(key, value, expires)
+        if self._db is None:
+            return
+        self._unwritten[key] = (value, expires)
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            # No event loop to hand the write to (scripts, tests), write it now
+            self._write(self._take_unwritten())
+            return
+        if len(self._unwritten) >= self.write_batch:
+            self._start_write()
+        elif self._write_timer is None:
+            self._write_timer = loop.call_later(self.write_delay, self._start_write)
+
+    def _remember(self, key: str, value: str, expires: float) -> None:
+        self._entries[key] = (expires, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def _take_unwritten(self) -> dict:
+        if self._write_timer is not None:
+            self._write_timer.cancel()
+            self._write_timer = None
+        batch, self._unwritten = self._unwritten, {}
+        return batch
+
+    def _start_write(self) -> None:
+        batch = self._take_unwritten()
+        if batch:
+            task = asyncio.ensure_future(asyncio.to_thread(self._write, batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    def _write(self, batch: dict) -> None:
+        """
+        Commits a batch of entries, and prunes the file when it is due. Runs on a worker thread.
+        """
+        with self._write_lock:
+            if self._writer is None or not batch:
+                return
+            try:
+                with self._writer:
+                    self._writer.executemany(
+                        "INSERT OR REPLACE INTO sentiment_cache (key, value, expires) VALUES (?, ?, ?)",
+                        [(key, value, expires) for key, (value, expires) in batch.items()],
+                    )
+                if time.time() >= self._next_prune:
+                    self._prune()
+            except sqlite3.Error as e:
+                logger.error("Error while writing to the sentiment cache: %s", e)
+
+    def _prune(self) -> None:
+        """
+        Deletes expired rows, then the rows expiring first until at most max_rows are left.
+        """
+        self._next_prune = time.time() + self.prune_interval
+        with self._writer:
+            deleted = self._writer.execute("DELETE FROM sentiment_cache WHERE expires < ?", (time.time(),)).rowcount
+            surplus = self._writer.execute("SELECT COUNT(*) FROM sentiment_cache").fetchone()[0] - self.max_rows
+            if surplus > 0:
+                deleted += self._writer.execute(
+                    "DELETE FROM sentiment_cache WHERE key IN "
+                    "(SELECT key FROM sentiment_cache ORDER BY expires LIMIT ?)",
+                    (surplus,),
+                ).rowcount
+        self.pruned += deleted
+
+    def close(self) -> None:
+        """
+        Writes the entries still waiting for a batch and closes the file.
+        """
+        if self._db is None:
+            return
+        self._write(self._take_unwritten())
+        with self._write_lock:
+            self._writer.close()
+            self._writer = None
+        self._db.close()
+        self._db = None
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "pruned": self.pruned,
+        }
@@ -0,0 +1,59 @@
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class SingleFlight:
+    """
+    Shares one in-flight call between concurrent requests for the same key.
+
+    The first request for a key starts the call; requests arriving while it
+    runs join it and get the same result (or exception). The call runs as its
+    own task, so a caller being cancelled does not cancel it for the others.
+    Nothing is kept once the call finishes, put results in a cache for that.
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self._joined = {}
+        self.calls = 0
+        self.joins = 0
+        self.max_joined = 0
+
+    async def run(self, key, make_call):
+        """
+        Returns the result of make_call(), or of the call already running for key.
+        """
+        task = self._calls.get(key)
+        if task is None:
+            task = self._calls[key] = asyncio.ensure_future(make_call())
+            self._joined[key] = 0
+            task.add_done_callback(lambda _: self._done(key))
+            self.calls += 1
+        else:
+            self.joins += 1
+            self._joined[key] += 1
+            self.max_joined = max(self.max_joined, self._joined[key])
+        return await asyncio.shield(task)
+
+    def joined(self, key) -> int:
+        """
+        Number of requests that joined the call currently running for key.
+        """
+        return self._joined.get(key, 0)
+
+    def _done(self, key) -> None:
+        task = self._calls.pop(key)
+        self._joined.pop(key, None)
+        if not task.cancelled() and task.exception() is not None:
+            # Retrieved here so a call nobody waits for anymore doesn't log "never retrieved"
+            logger.debug("Shared call for %s failed: %s", key, task.exception())
+
+    def stats(self) -> dict:
+        return {
+            "calls": self.calls,
+            "joins": self.joins,
+            "in_flight": len(self._calls),
+            "max_joined": self.max_joined,
+        }
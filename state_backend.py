@@ -0,0 +1,307 @@
+import time
+import asyncio
+import sqlite3
+import logging
+import threading
+from contextlib import asynccontextmanager
+from urllib.parse import urlparse
+
+logger = logging.getLogger(__name__)
+
+
+class StateBackend:
+    """
+    Versioned key/value storage for chat state shared between bot workers.
+
+    Every value carries a version number that grows by one on each write, and
+    0 means the key does not exist. put() is a compare-and-set: it only writes
+    if the stored version still equals the version the caller read, so two
+    workers can't silently overwrite each other's changes.
+
+    Backends created with a ttl drop values that were not written for that
+    long, unless they were stored with expire=False.
+    """
+
+    async def get(self, key: str) -> tuple:
+        """
+        Returns (value, version), or (None, 0) if the key does not exist.
+        """
+        raise NotImplementedError
+
+    async def put(self, key: str, value: str, version: int = None, expire: bool = True) -> int:
+        """
+        Stores value if the current version equals version (None writes
+        unconditionally). Returns the new version, or None on a conflict.
+        With expire=False the value is kept regardless of the backend's ttl.
+        """
+        raise NotImplementedError
+
+    async def delete(self, key: str) -> None:
+        raise NotImplementedError
+
+    async def close(self) -> None:
+        pass
+
+
+class MemoryBackend(StateBackend):
+    """
+    Keeps the state in this process only. Useful for tests and single workers.
+    """
+
+    def __init__(self):
+        self._data = {}
+
+    async def get(self, key: str) -> tuple:
+        return self._data.get(key, (None, 0))
+
+    async def put(self, key: str, value: str, version: int = None, expire: bool = True) -> int:
+        current = self._data.get(key, (None, 0))[1]
+        if version is not None and version != current:
+            return None
+        self._data[key] = (value, current + 1)
+        return current + 1
+
+    async def delete(self, key: str) -> None:
+        self._data.pop(key, None)
+
+
+class SQLiteBackend(StateBackend):
+    """
+    Stores the state in an SQLite file, so several bot processes on one host
+    can share it and it survives restarts. Entries not written for ttl
+    seconds count as missing, except those stored with expire=False; they
+    are deleted when the backend is opened and every prune_interval seconds
+    while it is written to.
+    """
+
+    def __init__(self, path: str, ttl: float = None, prune_interval: float = 300.0):
+        self.ttl = ttl
+        self.prune_interval = prune_interval
+        self.pruned = 0
+        self._pruned_at = time.time()
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS chat_state ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, version INTEGER NOT NULL, updated REAL NOT NULL)"
+        )
+        columns = [row[1] for row in self._db.execute("PRAGMA table_info(chat_state)")]
+        if "expires" not in columns:
+            # Files written before expire=False existed, all of their entries expire
+            self._db.execute("ALTER TABLE chat_state ADD COLUMN expires INTEGER NOT NULL DEFAULT 1")
+        self._prune(self._pruned_at)
+        self._db.commit()
+
+    async def get(self, key: str) -> tuple:
+        return await asyncio.to_thread(self._get, key)
+
+    async def put(self, key: str, value: str, version: int = None, expire: bool = True) -> int:
+        return await asyncio.to_thread(self._put, key, value, version, expire)
+
+    async def delete(self, key: str) -> None:
+        await asyncio.to_thread(self._delete, key)
+
+    async def close(self) -> None:
+        with self._lock:
+            self._db.close()
+
+    def _get(self, key: str) -> tuple:
+        with self._lock:
+            row = self._db.execute(
+                "SELECT value, version FROM chat_state WHERE key = ? AND NOT (expires AND updated < ?)",
+                (key, self._expired_before(time.time())),
+            ).fetchone()
+        return (row[0], row[1]) if row is not None else (None, 0)
+
+    def _put(self, key: str, value: str, version: int, expire: bool) -> int:
+        now = time.time()
+        with self._lock, self._db:
+            if self.ttl and now - self._pruned_at >= self.prune_interval:
+                self._pruned_at = now
+                self._prune(now)
+            if version is None:
+                self._db.execute(
+                    "INSERT INTO chat_state (key, value, version, updated, expires) VALUES (?, ?, 1, ?, ?) "
+                    "ON CONFLICT(key) DO UPDATE SET value = excluded.value, "
+                    "version = chat_state.version + 1, updated = excluded.updated, expires = excluded.expires",
+                    (key, value, now, expire),
+                )
+                return self._db.execute("SELECT version FROM chat_state WHERE key = ?", (key,)).fetchone()[0]
+            if version == 0:
+                # An expired row reads as missing, so it must not block creating the key again
+                self._db.execute(
+                    "DELETE FROM chat_state WHERE key = ? AND expires AND updated < ?",
+                    (key, self._expired_before(now)),
+                )
+                cursor = self._db.execute(
+                    "INSERT OR IGNORE INTO chat_state (key, value, version, updated, expires) VALUES (?, ?, 1, ?, ?)",
+                    (key, value, now, expire),
+                )
+            else:
+                cursor = self._db.execute(
+                    "UPDATE chat_state SET value = ?, version = version + 1, updated = ?, expires = ? "
+                    "WHERE key = ? AND version = ?",
+                    (value, now, expire, key, version),
+                )
+            return version + 1 if cursor.rowcount == 1 else None
+
+    def _expired_before(self, now: float) -> float:
+        return now - self.ttl if self.ttl else float("-inf")
+
+    def _prune(self, now: float) -> None:
+        if self.ttl:
+            cursor = self._db.execute(
+                "DELETE FROM chat_state WHERE expires AND updated < ?", (self._expired_before(now),)
+            )
+            self.pruned += cursor.rowcount
+
+    def _delete(self, key: str) -> None:
+        with self._lock, self._db:
+            self._db.execute("DELETE FROM chat_state WHERE key = ?", (key,))
+
+
+class RedisError(Exception):
+    pass
+
+
+class RedisConnection:
+    """
+    Minimal client for the Redis protocol (RESP2), enough for the commands
+    RedisBackend sends. Works with Redis and protocol compatible servers.
+    """
+
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+
+    @classmethod
+    async def open(cls, host: str, port: int, password: str = None, db: int = 0) -> "RedisConnection":
+        reader, writer = await asyncio.open_connection(host, port)
+        connection = cls(reader, writer)
+        if password:
+            await connection.execute("AUTH", password)
+        if db:
+            await connection.execute("SELECT", db)
+        return connection
+
+    async def execute(self, *args):
+        parts = [b"*%d\r\n" % len(args)]
+        for arg in args:
+            data = arg if isinstance(arg, bytes) else str(arg).encode("utf-8")
+            parts.append(b"$%d\r\n%s\r\n" % (len(data), data))
+        self.writer.write(b"".join(parts))
+        await self.writer.drain()
+        return await self._read_reply()
+
+    async def _read_reply(self):
+        line = await self.reader.readline()
+        if not line:
+            raise ConnectionError("Redis connection closed")
+        kind, rest = line[:1], line[1:-2]
+        if kind == b"+":
+            return rest.decode("utf-8")
+        if kind == b"-":
+            raise RedisError(rest.decode("utf-8"))
+        if kind == b":":
+            return int(rest)
+        if kind == b"$":
+            length = int(rest)
+            if length == -1:
+                return None
+            data = await self.reader.readexactly(length + 2)
+            return data[:-2].decode("utf-8")
+        if kind == b"*":
+            length = int(rest)
+            if length == -1:
+                return None
+            return [await self._read_reply() for _ in range(length)]
+        raise RedisError(f"Unexpected reply: {line!r}")
+
+    def close(self) -> None:
+        self.writer.close()
+
+
+class RedisBackend(StateBackend):
+    """
+    Stores the state in Redis (or any server speaking its protocol) so bot
+    workers on different hosts can share it. Each key is a hash holding the
+    value and its version; writes use WATCH/MULTI/EXEC for compare-and-set.
+    """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 6379, password: str = None, db: int = 0,
+                 prefix: str = "sentimentbot:", ttl: float = None, pool_size: int = 32):
+        self.host = host
+        self.port = port
+        self.password = password
+        self.db = db
+        self.prefix = prefix
+        self.ttl = ttl
+        self._idle = []
+        self._slots = asyncio.Semaphore(pool_size)
+
+    @asynccontextmanager
+    async def _connection(self):
+        async with self._slots:
+            connection = self._idle.pop() if self._idle else await RedisConnection.open(
+                self.host, self.port, self.password, self.db
+            )
+            try:
+                yield connection
+            except BaseException:
+                # The connection may be half way through a reply or transaction
+                connection.close()
+                raise
+            self._idle.append(connection)
+
+    async def get(self, key: str) -> tuple:
+        async with self._connection() as connection:
+            version, value = await connection.execute("HMGET", self.prefix + key, "v", "d")
+        return (value, int(version)) if version is not None else (None, 0)
+
+    async def put(self, key: str, value: str, version: int = None, expire: bool = True) -> int:
+        key = self.prefix + key
+        async with self._connection() as connection:
+            await connection.execute("WATCH", key)
+            current = int(await connection.execute("HGET", key, "v") or 0)
+            if version is not None and version != current:
+                await connection.execute("UNWATCH")
+                return None
+            await connection.execute("MULTI")
+            await connection.execute("HSET", key, "v", current + 1, "d", value)
+            if self.ttl:
+                if expire:
+                    await connection.execute("EXPIRE", key, int(self.ttl))
+                else:
+                    await connection.execute("PERSIST", key)
+            result = await connection.execute("EXEC")
+        return current + 1 if result is not None else None
+
+    async def delete(self, key: str) -> None:
+        async with self._connection() as connection:
+            await connection.execute("DEL", self.prefix + key)
+
+    async def close(self) -> None:
+        for connection in self._idle:
+            connection.close()
+        self._idle = []
+
+
+def create_backend(url: str, ttl: float = None) -> StateBackend:
+    """
+    Creates a backend from a URL: "memory://", "sqlite:///state.db"
+    or "redis://[:password@]host[:port][/db]". None or "" gives None, which
+    keeps state in the process without any backend.
+    """
+    if not url:
+        return None
+    if url.startswith("memory://"):
+        return MemoryBackend()
+    if url.startswith("sqlite:///"):
+        # sqlite:///state.db is relative, sqlite:////var/lib/bot/state.db absolute
+        return SQLiteBackend(url[len("sqlite:///"):], ttl)
+    if url.startswith("redis://"):
+        parsed = urlparse(url)
+        db = int(parsed.path.lstrip("/") or 0)
+        return RedisBackend(parsed.hostname or "127.0.0.1", parsed.port or 6379, parsed.password, db, ttl=ttl)
+    raise ValueError(f"Unknown state backend: {url}")
@@ -0,0 +1,101 @@
+import time
+import asyncio
+import logging
+import datetime
+
+from telegram import Update
+from telegram.error import BadRequest, RetryAfter, TelegramError
+
+from telegram_format import split_html, split_text, html_to_text
+
+logger = logging.getLogger(__name__)
+
+
+class TelegramStreamer:
+    """
+    Shows a reply while it is being generated by editing one Telegram message.
+
+    update() can be called for every streamed token; edits are coalesced so the
+    message is changed at most once per interval seconds, which keeps us under
+    Telegram's edit rate limits. Partial text is sent without a parse mode so
+    half-finished markup can't make Telegram reject the edit, and a failed
+    preview edit is only logged. finish() sends the complete text, formatted
+    with parse_mode ("HTML", resent as plain text if Telegram rejects it).
+    Text too long for one message is previewed up to the limit and finally
+    sent as several messages.
+    """
+
+    def __init__(self, update: Update, message=None, interval: float = 1.0):
+        self.update_ = update
+        self.message = message
+        self.interval = interval
+        self.text = ""
+        self.shown = None
+        self.last_edit = 0.0
+        self._flusher = None
+
+    async def update(self, text: str) -> None:
+        """
+        Records the latest text. The first text is shown straight away, later
+        ones are picked up by the background flusher.
+        """
+        self.text = text
+        if not text.strip():
+            return
+        if self.shown is None and self._flusher is None:
+            await self._show_preview(split_text(text)[0])
+            self._flusher = asyncio.create_task(self._flush_loop())
+
+    async def finish(self, text: str, parse_mode: str = None) -> None:
+        if self._flusher is not None:
+            self._flusher.cancel()
+            self._flusher = None
+        self.text = text
+        first, *rest = (split_html(text) if parse_mode == "HTML" else split_text(text)) or [text]
+        await self._show(first, parse_mode)
+        for chunk in rest:
+            # Every further part goes out as a new reply
+            self.message = None
+            await self._show(chunk, parse_mode)
+
+    async def _flush_loop(self) -> None:
+        while True:
+            delay = self.last_edit + self.interval - time.monotonic()
+            await asyncio.sleep(max(delay, 0.05))
+            preview = split_text(self.text)[0]
+            if preview != self.shown and preview.strip():
+                await self._show_preview(preview)
+
+    async def _show_preview(self, text: str) -> None:
+        try:
+            await self._show(text)
+        except TelegramError as e:
+            # A lost preview is not worth failing the reply for, the next flush or finish() tries again
+            logger.error("Error while updating streamed message: %s", e)
+            self.last_edit = time.monotonic()
+
+    async def _show(self, text: str, parse_mode: str = None) -> None:
+        try:
+            if self.message is None:
+                self.message = await self.update_.message.reply_text(text, parse_mode=parse_mode)
+            elif text != self.shown or parse_mode is not None:
+                await self.message.edit_text(text, parse_mode=parse_mode)
+        except RetryAfter as e:
+            # Telegram asked us to slow down, the next flush carries the latest text
+            retry_after = e.retry_after
+            if isinstance(retry_after, datetime.timedelta):
+                retry_after = retry_after.total_seconds()
+            self.last_edit = time.monotonic() + retry_after
+            if parse_mode is not None:
+                await asyncio.sleep(retry_after)
+                await self._show(text, parse_mode)
+            return
+        except BadRequest as e:
+            if "not modified" not in str(e):
+                logger.error("Error while editing streamed message: %s", e)
+                if parse_mode is not None:
+                    # Formatting was rejected, fall back to the same text without the markup
+                    await self._show(html_to_text(text))
+                return
+        self.shown = text
+        self.last_edit = time.monotonic()
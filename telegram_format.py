@@ -0,0 +1,234 @@
+import re
+from html import escape, unescape
+
+# Telegram's limit on the text of one message, counted in UTF-16 code units after entity parsing
+MESSAGE_LIMIT = 4096
+
+# The Markdown subset LLM replies use, matched in one scan. Earlier alternatives win,
+# so code spans are never formatted inside. Every alternative starts with a literal
+# character so the scan can skip ahead to candidates; line-start rules match the
+# preceding newline instead of ^ for that reason.
+_MARKDOWN = re.compile(
+    r"```(?P<lang>[\w+#-]*)[^\S\n]*\n?(?P<pre>(?s:.*?))```"
+    r"|`(?P<code>[^`\n]+)`"
+    r"|\[(?P<label>[^\]\n]+)\]\((?P<url>[^)\s]+)\)"
+    r"|\*\*(?P<bold>[^\n]+?)\*\*"
+    r"|__(?P<bold2>[^\n]+?)__"
+    r"|~~(?P<strike>[^\n]+?)~~"
+    r"|\n[ \t]*\#{1,6}[ \t]+(?P<title>[^\n]+)"
+    r"|\n(?P<bullet>[ \t]*)[-*+][ \t]+"
+    r"|\*(?<![\w*]\*)(?![\s*])(?P<italic>[^\n*]+?)(?<![\s*])\*(?![\w*])"
+    r"|_(?<![\w_]_)(?![\s_])(?P<italic2>[^\n_]+?)(?<![\s_])_(?![\w_])"
+)
+# What the splitter works on: tags, entities, newlines and the runs of text between them
+_HTML_TOKEN = re.compile(r"<[^>]*>|&#?\w+;|\n|[^<&\n]+|[<&]")
+_TEXT_TOKEN = re.compile(r"\n|[^\n]+")
+_TAGS = re.compile(r"<[^>]*>")
+_ENTITIES = re.compile(r"&#?\w+;")
+_TAG_NAME = re.compile(r"</?(\w+)")
+_LINK_SCHEMES = ("http://", "https://", "tg://", "mailto:")
+
+
+def _inline(text: str) -> str:
+    """
+    Converts the formatting inside a bold, italic, link or heading span.
+    Headings and list items can't start inside one.
+    """
+    return _MARKDOWN.sub(_replace, text)
+
+
+def _replace(match: re.Match) -> str:
+    # The text was escaped before the scan, so groups are already safe to embed
+    kind = match.lastgroup
+    if kind == "pre":
+        lang = match.group("lang")
+        code = match.group("pre").rstrip("\n")
+        if lang:
+            return f'<pre><code class="language-{lang}">{code}</code></pre>'
+        return f"<pre>{code}</pre>"
+    if kind == "code":
+        return f"<code>{match.group('code')}</code>"
+    if kind == "url":
+        url = match.group("url")
+        label = _inline(match.group("label"))
+        if not url.startswith(_LINK_SCHEMES):
+            # Telegram rejects the whole message over a bad href, keep the URL as text
+            return f"{label} ({url})"
+        href = url.replace('"', "&quot;")
+        return f'<a href="{href}">{label}</a>'
+    if kind in ("bold", "bold2"):
+        return f"<b>{_inline(match.group(kind))}</b>"
+    if kind == "strike":
+        return f"<s>{_inline(match.group('strike'))}</s>"
+    if kind == "title":
+        return f"\n<b>{_inline(match.group('title'))}</b>"
+    if kind == "bullet":
+        return f"\n{match.group('bullet')}• "
+    return f"<i>{_inline(match.group(kind))}</i>"
+
+
+def markdown_to_html(text: str) -> str:
+    """
+    Converts the Markdown in an LLM reply to Telegram HTML: **bold**/__bold__,
+    *italic*/_italic_, ~~strike~~, `code`, ``` fenced blocks ```, [links](url),
+    # headings (bold) and -/*/+ list items (bullets). Everything else is
+    escaped, so stray <, > and & can't make Telegram reject the message.
+    """
+    # Escaping first keeps the scan single-pass; none of the markers contain <, > or &.
+    # The leading newline lets the first line start a heading or list item.
+    return _MARKDOWN.sub(_replace, "\n" + escape(text, quote=False))[1:]
+
+
+def _units(text: str) -> int:
+    """
+    Length as Telegram counts it (UTF-16 code units, emoji outside the BMP count twice).
+    """
+    return len(text) if text.isascii() else len(text.encode("utf-16-le")) // 2
+
+
+def _prefix(text: str, units: int) -> str:
+    """
+    The longest start of text that is at most units long.
+    """
+    if text.isascii():
+        return text[:units]
+    # A cut through a surrogate pair leaves half of it, which decoding drops
+    return text.encode("utf-16-le")[:units * 2].decode("utf-16-le", errors="ignore")
+
+
+def visible_length(html: str) -> int:
+    """
+    Length of Telegram HTML as it counts against MESSAGE_LIMIT (tags removed, entities as one character).
+    """
+    return _units(_ENTITIES.sub("&", _TAGS.sub("", html)))
+
+
+def html_to_text(html: str) -> str:
+    """
+    The text of Telegram HTML as the user would see it, without the formatting.
+    Used to resend a reply as plain text when Telegram rejects its HTML.
+    """
+    return unescape(_TAGS.sub("", html))
+
+
+class _Chunker:
+    """
+    Packs tokens into chunks of at most limit visible units. A chunk is cut
+    at the last newline if that keeps it at least half full, else at the
+    last space. Tags still open at a cut are closed at the end of the chunk
+    and reopened at the start of the next one, so every chunk is valid HTML
+    on its own.
+    """
+
+    def __init__(self, limit: int, html: bool):
+        self.limit = limit
+        self.html = html
+        self.chunks = []
+        self._reset(())
+
+    def _reset(self, stack: tuple) -> None:
+        self.tokens = [tag for _, tag in stack]
+        self.stack = list(stack)
+        self.size = 0
+        # Last newline and last space as (token index, offset in the token, open tags)
+        self.newline = None
+        self.newline_size = 0
+        self.space = None
+
+    def add(self, token: str) -> None:
+        if self.html and len(token) > 1 and token[0] in "<&":
+            if token[0] == "<":
+                self._add_tag(token)
+                return
+            units = 1
+        else:
+            units = _units(token)
+        while self.size + units > self.limit:
+            room = self.limit - self.size
+            # A space right after the part that fits is a break too, it gets dropped
+            offset = _prefix(token, room + 1).rfind(" ")
+            if self.newline is not None and self.newline_size >= self.limit // 2:
+                self.cut(self.newline)
+            elif offset > 0:
+                self.tokens.append(token[:offset])
+                self.cut(None)
+                token = token[offset + 1:]
+                units = _units(token)
+            elif self.space is not None or self.newline is not None:
+                self.cut(self.space or self.newline)
+            elif self.size:
+                self.cut(None)
+            else:
+                # One word longer than a whole message, cut through it
+                head = _prefix(token, room)
+                self.tokens.append(head)
+                self.cut(None)
+                token = token[len(head):]
+                units = _units(token)
+        self.tokens.append(token)
+        if token == "\n":
+            self.newline = (len(self.tokens) - 1, 0, tuple(self.stack))
+            self.newline_size = self.size
+        elif " " in token:
+            self.space = (len(self.tokens) - 1, token.rfind(" "), tuple(self.stack))
+        self.size += units
+
+    def _add_tag(self, tag: str) -> None:
+        name = _TAG_NAME.match(tag)
+        if name is not None:
+            if tag[1] == "/":
+                if self.stack and self.stack[-1][0] == name.group(1):
+                    self.stack.pop()
+            else:
+                self.stack.append((name.group(1), tag))
+        self.tokens.append(tag)
+
+    def cut(self, at) -> None:
+        """
+        Ends the current chunk at the break at (dropping the break character),
+        or after the last token if at is None.
+        """
+        if at is None:
+            head, tail, stack = self.tokens, [], tuple(self.stack)
+        else:
+            index, offset, stack = at
+            token = self.tokens[index]
+            head = self.tokens[:index] + [token[:offset]]
+            tail = [token[offset + 1:]] + self.tokens[index + 1:]
+        text = "".join(head) + "".join(f"</{name}>" for name, _ in reversed(stack))
+        if _TAGS.sub("", text).strip():
+            self.chunks.append(text)
+        self._reset(stack)
+        for token in tail:
+            if token:
+                self.add(token)
+
+    def finish(self) -> list:
+        text = "".join(self.tokens)
+        if _TAGS.sub("", text).strip():
+            self.chunks.append(text)
+        return self.chunks
+
+
+def _split(pattern: re.Pattern, text: str, limit: int, html: bool) -> list:
+    if _units(text) <= limit or (html and visible_length(text) <= limit):
+        return [text]
+    chunker = _Chunker(limit, html)
+    for token in pattern.findall(text):
+        chunker.add(token)
+    return chunker.finish()
+
+
+def split_html(html: str, limit: int = MESSAGE_LIMIT) -> list:
+    """
+    Splits Telegram HTML into messages of at most limit characters, preferring
+    line breaks, with the formatting carried over into the next message.
+    """
+    return _split(_HTML_TOKEN, html, limit, True)
+
+
+def split_text(text: str, limit: int = MESSAGE_LIMIT) -> list:
+    """
+    Splits plain text into messages of at most limit characters, preferring line breaks.
+    """
+    return _split(_TEXT_TOKEN, text, limit, False)
@@ -0,0 +1,69 @@
+import json
+import asyncio
+
+from bulk_score import score_file, read_messages, read_checkpoint
+
+
+def read_lines(path):
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line)["line"] for line in f]
+
+
+def test_resume_cuts_rows_written_after_the_checkpoint(tmp_path):
+    source = tmp_path / "messages.txt"
+    source.write_text("\n".join(f"I love message {i}" for i in range(10)) + "\n", encoding="utf-8")
+    output = str(tmp_path / "scores.jsonl")
+
+    class Crash(Exception):
+        pass
+
+    calls = 0
+
+    async def crashing_scorer(texts):
+        nonlocal calls
+        calls += 1
+        if calls == 3:
+            raise Crash()
+        return [{"sentiment": "positive", "score": 5} for _ in texts]
+
+    try:
+        asyncio.run(score_file(str(source), output, crashing_scorer, chunk_size=3))
+    except Crash:
+        pass
+    # A crash between writing rows and saving the checkpoint leaves extra and partial rows
+    with open(output, "a", encoding="utf-8") as f:
+        f.write('{"line": 7, "text": "I love message 6"}\n{"line": 8, "te')
+
+    assert read_checkpoint(output + ".ckpt")[0] == 6
+    written = asyncio.run(score_file(str(source), output, chunk_size=3, resume=True))
+    assert written == 4
+    assert read_lines(output) == list(range(1, 11))
+
+
+def test_resume_from_a_count_only_checkpoint_appends(tmp_path):
+    source = tmp_path / "messages.txt"
+    source.write_text("a\nb\nc\n", encoding="utf-8")
+    output = tmp_path / "scores.jsonl"
+    output.write_text('{"line": 1, "text": "a"}\n', encoding="utf-8")
+    (tmp_path / "scores.jsonl.ckpt").write_text("1")
+
+    asyncio.run(score_file(str(source), str(output), resume=True))
+    assert read_lines(output) == [1, 2, 3]
+
+
+def test_jsonl_lines_that_are_not_objects_are_skipped_and_counted(tmp_path):
+    source = tmp_path / "messages.jsonl"
+    source.write_text('{"text": "hi"}\n[1, 2]\n"just a string"\nnot json\n\n{"text": "bye"}\n', encoding="utf-8")
+    skipped = []
+    assert list(read_messages(str(source), skipped=skipped)) == ["hi", "bye"]
+    assert skipped == [2, 3, 4]
+
+
+def test_csv_output_has_one_header(tmp_path):
+    source = tmp_path / "messages.txt"
+    source.write_text("a\nb\nc\nd\n", encoding="utf-8")
+    output = tmp_path / "scores.csv"
+    asyncio.run(score_file(str(source), str(output), chunk_size=2))
+    rows = output.read_text(encoding="utf-8").splitlines()
+    assert rows[0].startswith("line,text")
+    assert len(rows) == 5
@@ -0,0 +1,72 @@
+import asyncio
+
+from telegram import Update
+
+from chat_scheduler import ChatScheduler
+
+
+def make_update(update_id: int, chat_id: int) -> Update:
+    return Update.de_json({
+        "update_id": update_id,
+        "message": {"message_id": update_id, "date": 0, "chat": {"id": chat_id, "type": "private"}, "text": "hi"},
+    }, None)
+
+
+def test_updates_of_one_chat_run_in_order():
+    order = []
+
+    async def handle(update_id, delay):
+        await asyncio.sleep(delay)
+        order.append(update_id)
+
+    async def scenario():
+        scheduler = ChatScheduler()
+        # The first update is the slowest, the others must still wait for it
+        await asyncio.gather(*(
+            scheduler.process_update(make_update(i, 1), handle(i, delay))
+            for i, delay in enumerate([0.05, 0.0, 0.02, 0.0])
+        ))
+        return scheduler
+
+    scheduler = asyncio.run(scenario())
+    assert order == [0, 1, 2, 3]
+    assert scheduler.stats()["chats"] == 0
+
+
+def test_different_chats_run_in_parallel():
+    running = []
+    peak = 0
+
+    async def handle():
+        nonlocal peak
+        running.append(1)
+        peak = max(peak, len(running))
+        await asyncio.sleep(0.02)
+        running.pop()
+
+    async def scenario():
+        scheduler = ChatScheduler(max_concurrency=3)
+        await asyncio.gather(*(scheduler.process_update(make_update(i, i), handle()) for i in range(5)))
+
+    asyncio.run(scenario())
+    assert peak == 3
+
+
+def test_updates_past_the_chat_queue_are_dropped():
+    handled = []
+
+    async def handle(update_id):
+        await asyncio.sleep(0.01)
+        handled.append(update_id)
+
+    async def scenario():
+        scheduler = ChatScheduler(max_queue=2)
+        await asyncio.gather(
+            *(scheduler.process_update(make_update(i, 1), handle(i)) for i in range(4)),
+            scheduler.process_update(make_update(9, 2), handle(9)),
+        )
+        return scheduler
+
+    scheduler = asyncio.run(scenario())
+    assert sorted(handled) == [0, 1, 9]
+    assert scheduler.dropped == 2
@@ -0,0 +1,57 @@
+from circuit_breaker import CLOSED, HALF_OPEN, OPEN, CircuitBreaker, CircuitBreakers
+
+
+def opened_breaker(reset_timeout=30.0):
+    breaker = CircuitBreaker(failure_threshold=3, reset_timeout=reset_timeout)
+    for _ in range(3):
+        breaker.acquire()
+        breaker.record_failure()
+    return breaker
+
+
+def test_opens_after_threshold_failures_in_a_row():
+    breaker = CircuitBreaker(failure_threshold=3)
+    breaker.record_failure()
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+    assert breaker.state == CLOSED
+    breaker = opened_breaker()
+    assert breaker.state == OPEN
+    assert not breaker.available()
+    assert breaker.times_opened == 1
+
+
+def test_half_open_lets_a_single_trial_through():
+    breaker = opened_breaker(reset_timeout=0.0)
+    assert breaker.available()
+    breaker.acquire()
+    assert breaker.state == HALF_OPEN
+    assert not breaker.available()
+
+
+def test_successful_trial_closes_the_circuit():
+    breaker = opened_breaker(reset_timeout=0.0)
+    breaker.acquire()
+    breaker.record_success()
+    assert breaker.state == CLOSED
+    assert breaker.failures == 0
+    assert breaker.available()
+
+
+def test_failed_trial_opens_it_again():
+    breaker = opened_breaker(reset_timeout=0.0)
+    breaker.acquire()
+    breaker.record_failure()
+    assert breaker.state == OPEN
+    assert breaker.times_opened == 2
+    breaker.reset_timeout = 30.0
+    assert not breaker.available()
+
+
+def test_breakers_are_created_per_key():
+    breakers = CircuitBreakers(failure_threshold=1)
+    breakers.get(("key", "model")).record_failure()
+    assert breakers.get(("key", "model")).state == OPEN
+    assert breakers.get(("key", "other model")).state == CLOSED
+    assert breakers.stats()["key|model"]["state"] == OPEN
@@ -0,0 +1,70 @@
+import asyncio
+
+from context_window import ContextWindow
+from conversation_store import ConversationStore
+from prompts import PromptRegistry
+from state_backend import SQLiteBackend
+
+PROMPTS = PromptRegistry({"advice": "You are a dating coach."})
+PROMPT = PROMPTS["advice"]
+
+
+async def chat(store, window, rounds: int, start: int = 0) -> list:
+    """
+    Runs rounds of user message and reply like perform_advice, returning the messages of every request.
+    """
+    requests = []
+    await store.start(1, PROMPT)
+    for i in range(start, start + rounds):
+        await store.append(1, "user", f"question {i} about what to text after a first date")
+        conversation = await store.get(1)
+        window_start = window.window_start(conversation)
+        requests.append(window.build(conversation, window_start))
+        await store.append(1, "assistant", f"answer {i} keep it light and ask about their day", window_start=window_start)
+    return requests
+
+
+def test_consecutive_requests_keep_the_same_prefix_until_trimmed():
+    window = ContextWindow(token_budget=150, trim_ratio=0.5)
+    requests = asyncio.run(chat(ConversationStore(), window, 20))
+    moves = 0
+    for previous, current in zip(requests, requests[1:]):
+        if current[:len(previous)] != previous:
+            moves += 1
+            # The window jumps forward to leave room, it doesn't slide one turn at a time
+            assert current[1] != previous[1]
+    assert 0 < moves <= 20 // 4
+    assert all(sum(len(m["content"]) for m in request) < 150 * 4 for request in requests)
+
+
+def test_build_does_not_change_the_conversation():
+    async def scenario():
+        store = ConversationStore()
+        await chat(store, ContextWindow(token_budget=150, trim_ratio=0.5), 10)
+        conversation = await store.get(1)
+        saved = conversation.window_start
+        window = ContextWindow(token_budget=60)
+        window.build(conversation)
+        return saved, conversation.window_start, window.window_start(conversation)
+
+    saved, after, smaller = asyncio.run(scenario())
+    assert after == saved
+    assert smaller > saved
+
+
+def test_window_start_is_shared_through_the_state_backend(tmp_path):
+    window = ContextWindow(token_budget=150, trim_ratio=0.5)
+
+    async def scenario():
+        backend = SQLiteBackend(str(tmp_path / "state.db"))
+        await chat(ConversationStore(backend=backend, prompts=PROMPTS), window, 8)
+        # Another worker picks up the chat where the first one left off
+        handed_over = await chat(ConversationStore(backend=backend, prompts=PROMPTS), window, 4, start=8)
+        window_start = (await ConversationStore(backend=backend, prompts=PROMPTS).get(1)).window_start
+        await backend.close()
+        return handed_over, window_start
+
+    handed_over, window_start = asyncio.run(scenario())
+    one_worker = asyncio.run(chat(ConversationStore(), window, 12))
+    assert window_start > 0
+    assert handed_over == one_worker[8:]
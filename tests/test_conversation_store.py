@@ -0,0 +1,116 @@
+import asyncio
+
+from conversation_store import ConversationStore, Conversation, Message
+from prompts import Prompt, PromptRegistry
+
+PROMPT = Prompt("advice", "You are a dating coach.")
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+
+def test_append_keeps_turns_in_order():
+    async def scenario():
+        store = ConversationStore()
+        await store.start(1, PROMPT)
+        await store.append(1, "user", "hi")
+        await store.append(1, "assistant", "hello")
+        return await store.messages(1)
+
+    assert run(scenario()) == [
+        PROMPT.message,
+        {"role": "user", "content": "hi"},
+        {"role": "assistant", "content": "hello"},
+    ]
+
+
+def test_trim_drops_oldest_turns_over_max_turns():
+    async def scenario():
+        store = ConversationStore(max_turns=3)
+        await store.start(1, PROMPT)
+        for i in range(10):
+            await store.append(1, "user", f"message {i}")
+        return store, await store.get(1)
+
+    store, conversation = run(scenario())
+    assert [turn.content for turn in conversation.turns] == ["message 7", "message 8", "message 9"]
+    assert conversation.dropped == 7
+    assert store.trimmed_turns == 7
+    assert conversation.tokens == PROMPT.tokens + sum(turn.tokens for turn in conversation.turns)
+    assert store.total_bytes == conversation.size
+
+
+def test_trim_by_tokens_keeps_the_newest_turn():
+    async def scenario():
+        store = ConversationStore(max_tokens=PROMPT.tokens + 1)
+        await store.start(1, PROMPT)
+        await store.append(1, "user", "short")
+        await store.append(1, "user", "a much longer message " * 20)
+        return await store.get(1)
+
+    conversation = run(scenario())
+    assert len(conversation.turns) == 1
+    assert conversation.turns[0].content.startswith("a much longer message")
+
+
+def test_memory_budget_evicts_least_recently_used_chat():
+    async def scenario():
+        store = ConversationStore(max_bytes=2500)
+        for chat_id in range(3):
+            await store.start(chat_id, PROMPT)
+            await store.append(chat_id, "user", "x" * 500)
+        await store.get(0)
+        await store.start(3, PROMPT)
+        await store.append(3, "user", "x" * 500)
+        return store
+
+    store = run(scenario())
+    assert 1 not in store
+    assert 0 in store and 3 in store
+    assert store.memory_evictions >= 1
+    assert store.total_bytes <= store.max_bytes
+
+
+def test_append_to_evicted_conversation_is_counted_as_lost():
+    async def scenario():
+        store = ConversationStore()
+        await store.start(1, PROMPT)
+        await store.discard(1)
+        await store.append(1, "assistant", "reply nobody will see in the history")
+        return store
+
+    store = run(scenario())
+    assert 1 not in store
+    assert store.lost_turns == 1
+    assert store.stats()["lost_turns"] == 1
+
+
+def test_namespaces_share_one_store():
+    async def scenario():
+        store = ConversationStore()
+        advice, rizz = store.namespace("advice"), store.namespace("rizz")
+        await advice.start(1, PROMPT)
+        await advice.append(1, "user", "advice question")
+        await rizz.start(1, Prompt("rizz", "Flirt."))
+        return store, await advice.messages(1), await rizz.messages(1)
+
+    store, advice_messages, rizz_messages = run(scenario())
+    assert len(store) == 2
+    assert advice_messages[-1]["content"] == "advice question"
+    assert rizz_messages == [{"role": "system", "content": "Flirt."}]
+
+
+def test_json_round_trip_keeps_prompt_and_counters():
+    prompts = PromptRegistry({"advice": "You are a dating coach."})
+    conversation = Conversation(prompts["advice"])
+    for i in range(3):
+        conversation.add(Message("user", f"turn {i}"))
+    conversation.dropped = 4
+    conversation.window_start = 5
+
+    loaded = Conversation.from_json(conversation.to_json(), prompts)
+    assert loaded.prompt is prompts["advice"]
+    assert [turn.content for turn in loaded.turns] == ["turn 0", "turn 1", "turn 2"]
+    assert loaded.dropped == 4
+    assert loaded.window_start == 5
@@ -0,0 +1,121 @@
+import time
+import asyncio
+
+import httpx
+import openai
+import pytest
+
+from circuit_breaker import CLOSED, HALF_OPEN, CircuitBreakers, CircuitOpenError
+from key_pool import KeyPool
+
+
+def status_error(status: int, retry_after: str = None) -> openai.APIStatusError:
+    headers = {"retry-after": retry_after} if retry_after is not None else {}
+    request = httpx.Request("POST", "https://openrouter.ai/api/v1/chat/completions")
+    response = httpx.Response(status, headers=headers, request=request)
+    return openai.APIStatusError(f"Error code: {status}", response=response, body=None)
+
+
+class StubClient:
+    """
+    Stands in for LLMClient: each create() raises or returns the next outcome.
+    """
+
+    def __init__(self, *outcomes):
+        self.outcomes = list(outcomes)
+        self.in_flight = 0
+
+    async def create(self, **kwargs):
+        outcome = self.outcomes.pop(0)
+        if outcome == "hang":
+            await asyncio.sleep(10)
+        if isinstance(outcome, BaseException):
+            raise outcome
+        return outcome
+
+
+def stub_pool(*clients, **kwargs) -> KeyPool:
+    pool = KeyPool([f"sk-test-{i:04d}" for i in range(len(clients))], **kwargs)
+    for key, client in zip(pool.keys, clients):
+        key.client = client
+    return pool
+
+
+def fail(pool: KeyPool, error) -> None:
+    async def scenario():
+        with pytest.raises(type(error)):
+            await pool.create(model="m")
+
+    asyncio.run(scenario())
+
+
+def test_retry_after_sets_the_cooldown_else_it_doubles():
+    errors = [status_error(429, "12"), status_error(503), status_error(503)]
+    pool = stub_pool(StubClient(*errors), cooldown=1.0, max_cooldown=300.0)
+    key = pool.keys[0]
+    cooldowns = []
+    for error in errors:
+        fail(pool, error)
+        cooldowns.append(key.cooldown_until - time.monotonic())
+    assert 11.5 < cooldowns[0] <= 12.0
+    assert 1.5 < cooldowns[1] <= 2.0
+    assert 3.5 < cooldowns[2] <= 4.0
+    assert key.requests == key.errors == 3
+
+
+def test_key_that_recovers_first_is_used_when_all_are_cooling_down():
+    pool = stub_pool(StubClient(), StubClient(), StubClient())
+    now = time.monotonic()
+    for key, wait in zip(pool.keys, (30, 5, 60)):
+        key.cooldown_until = now + wait
+    assert pool.pick("m") is pool.keys[1]
+    pool.keys[2].cooldown_until = 0.0
+    assert pool.pick("m") is pool.keys[2]
+
+
+@pytest.mark.parametrize("status", [400, 422])
+def test_malformed_request_ends_the_trial_without_a_failure(status):
+    pool = stub_pool(StubClient(status_error(status)), breakers=CircuitBreakers(failure_threshold=1, reset_timeout=0.0))
+    breaker = pool.breakers.get((pool.keys[0].name, "m"))
+    breaker.record_failure()
+    fail(pool, status_error(status))
+    assert breaker.state == HALF_OPEN
+    assert not breaker.trial_in_flight
+    assert breaker.failures == 1 and breaker.times_opened == 1
+    # The key is not cooled down either
+    assert pool.keys[0].cooldown_until == 0.0
+    assert pool.available("m")
+
+
+def test_cancelled_request_is_not_a_failure():
+    pool = stub_pool(StubClient("hang"), breakers=CircuitBreakers(failure_threshold=1, reset_timeout=0.0))
+    breaker = pool.breakers.get((pool.keys[0].name, "m"))
+    breaker.record_failure()
+
+    async def scenario():
+        request = asyncio.create_task(pool.create(model="m"))
+        await asyncio.sleep(0.01)
+        trial_started = breaker.trial_in_flight
+        request.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await request
+        return trial_started
+
+    assert asyncio.run(scenario())
+    assert not breaker.trial_in_flight
+    assert breaker.times_opened == 1
+    assert pool.keys[0].errors == 0
+
+
+def test_no_available_key_raises_circuit_open():
+    pool = stub_pool(StubClient(), StubClient(), StubClient("reply"), breakers=CircuitBreakers(failure_threshold=1))
+    for key in pool.keys[:2]:
+        pool.breakers.get((key.name, "m")).record_failure()
+    assert asyncio.run(pool.create(model="m")) == "reply"
+    pool.breakers.get((pool.keys[2].name, "m")).record_failure()
+    with pytest.raises(CircuitOpenError):
+        pool.pick("m")
+    assert [pool.breakers.get((key.name, "m")).rejected for key in pool.keys] == [1, 1, 1]
+    # Other models have circuits of their own
+    assert pool.breakers.get((pool.keys[0].name, "other")).state == CLOSED
+    assert pool.available("other")
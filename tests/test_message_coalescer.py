@@ -0,0 +1,114 @@
+import asyncio
+
+from message_coalescer import MessageCoalescer
+
+
+def collect(flushed):
+    async def flush(text):
+        flushed.append(text)
+
+    return flush
+
+
+def test_burst_is_flushed_once_as_one_turn():
+    flushed = []
+
+    async def scenario():
+        coalescer = MessageCoalescer(quiet_period=0.05, max_wait=1.0)
+        for text in ("hey", "so about tonight", "what should I wear"):
+            coalescer.add(1, text, collect(flushed))
+            await asyncio.sleep(0.01)
+        await asyncio.sleep(0.1)
+        return coalescer
+
+    coalescer = asyncio.run(scenario())
+    assert flushed == ["hey\nso about tonight\nwhat should I wear"]
+    assert coalescer.stats()["merged"] == 2
+
+
+def test_held_messages_wait_and_are_flushed_without_a_new_message():
+    flushed = []
+
+    async def scenario():
+        coalescer = MessageCoalescer(quiet_period=0.0)
+        coalescer.add(1, "shed", collect(flushed), hold=0.1)
+        await asyncio.sleep(0.05)
+        early = list(flushed)
+        await asyncio.sleep(0.1)
+        return early
+
+    assert asyncio.run(scenario()) == []
+    assert flushed == ["shed"]
+
+
+def test_messages_held_past_max_hold_are_dropped():
+    flushed = []
+
+    async def scenario():
+        coalescer = MessageCoalescer(quiet_period=0.0, max_hold=0.5)
+        coalescer.add(1, "too far away", collect(flushed), hold=1.0)
+        coalescer.add(1, "soon", collect(flushed), hold=0.05)
+        await asyncio.sleep(0.1)
+        return coalescer
+
+    coalescer = asyncio.run(scenario())
+    assert flushed == ["soon"]
+    assert coalescer.expired == 1
+
+
+def test_discarded_messages_are_never_flushed():
+    flushed = []
+
+    async def scenario():
+        coalescer = MessageCoalescer(quiet_period=0.05)
+        coalescer.add(("advice", 1), "old mode", collect(flushed), hold=0.05)
+        coalescer.discard(("advice", 1))
+        await asyncio.sleep(0.1)
+        return coalescer
+
+    coalescer = asyncio.run(scenario())
+    assert flushed == []
+    assert coalescer.stats()["pending"] == 0
+    assert coalescer.stats()["discarded"] == 1
+
+
+def test_flush_asking_for_a_retry_is_buffered_again_in_front_of_newer_messages():
+    flushed = []
+    retries = [0.1]
+
+    async def flush(text):
+        flushed.append(text)
+        # Shed the first time, like coalesced_message does when rate limited
+        return retries.pop() if retries else None
+
+    async def scenario():
+        coalescer = MessageCoalescer(quiet_period=0.02)
+        coalescer.add(1, "first", flush)
+        await asyncio.sleep(0.05)
+        coalescer.add(1, "second", flush)
+        await asyncio.sleep(0.05)
+        # Still waiting out the retry delay even though the chat is quiet
+        waiting = len(flushed)
+        await asyncio.sleep(0.1)
+        return coalescer, waiting
+
+    coalescer, waiting = asyncio.run(scenario())
+    assert waiting == 1
+    assert flushed == ["first", "first\nsecond"]
+    assert coalescer.turns == 1 and coalescer.deferred == 1
+    assert not coalescer._tasks
+
+
+def test_retry_past_max_hold_drops_the_turn():
+    async def flush(text):
+        return 10.0
+
+    async def scenario():
+        coalescer = MessageCoalescer(quiet_period=0.01, max_hold=1.0)
+        coalescer.add(1, "a", flush)
+        coalescer.add(1, "b", flush)
+        await asyncio.sleep(0.05)
+        return coalescer.stats()
+
+    stats = asyncio.run(scenario())
+    assert stats["expired"] == 2 and stats["pending"] == 0
@@ -0,0 +1,35 @@
+import asyncio
+
+import pytest
+
+from circuit_breaker import CircuitOpenError
+from model_router import ModelRouter
+
+
+def test_mode_without_candidates_is_rejected():
+    with pytest.raises(ValueError, match="rizz"):
+        ModelRouter({"analysis": ["a"], "rizz": []})
+
+
+def test_falls_through_to_the_next_model():
+    router = ModelRouter({"analysis": ["a", "b"]}, explore_rate=0.0)
+
+    async def call(model):
+        if model == "a":
+            raise RuntimeError("upstream error")
+        return model
+
+    assert asyncio.run(router.run("analysis", call)) == "b"
+    assert router.stats()["a"]["failures"] == 1
+    # The failed model is now tried last
+    assert router.order("analysis") == ["b", "a"]
+
+
+def test_every_circuit_open_raises_circuit_open_error():
+    router = ModelRouter({"analysis": ["a", "b"]})
+
+    async def call(model):
+        raise CircuitOpenError(model)
+
+    with pytest.raises(CircuitOpenError):
+        asyncio.run(router.run("analysis", call))
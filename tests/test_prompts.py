@@ -0,0 +1,55 @@
+import sys
+from types import SimpleNamespace
+
+from benchmarks.micro_benchmarks import make_config
+from prompts import CACHE_CONTROL, PromptCaching, PromptRegistry
+
+REGISTRY = PromptRegistry({"advice": "You are a dating coach."})
+
+
+def conversation() -> list:
+    return [
+        REGISTRY.get("advice").message,
+        {"role": "user", "content": "hi"},
+        {"role": "assistant", "content": "hello"},
+        {"role": "user", "content": "what should I text her?"},
+    ]
+
+
+def test_matching_models_get_cache_breakpoints():
+    caching = PromptCaching(REGISTRY, models=("anthropic/",))
+    messages = conversation()
+    hinted = caching.apply("anthropic/claude-sonnet", messages)
+    # The registry's ready-made breakpoint is reused instead of copied per request
+    assert hinted[0] is REGISTRY.get("advice").cached_message
+    assert hinted[1:3] == messages[1:3]
+    assert hinted[-1] == {
+        "role": "user",
+        "content": [{"type": "text", "text": "what should I text her?", "cache_control": CACHE_CONTROL}],
+    }
+    # The stored conversation is left as it was
+    assert messages == conversation()
+    assert caching.stats() == {"hinted_requests": 1}
+
+
+def test_other_models_get_the_same_list():
+    caching = PromptCaching(REGISTRY, models=("anthropic/",))
+    messages = conversation()
+    assert caching.apply("openai/gpt-4o", messages) is messages
+    assert caching.apply(None, messages) is messages
+    assert PromptCaching(REGISTRY, models=()).apply("anthropic/claude-sonnet", messages) is messages
+    assert caching.stats() == {"hinted_requests": 0}
+
+
+def test_cached_prompt_tokens_are_counted():
+    sys.modules.setdefault("config", make_config())
+    import main
+
+    usage = SimpleNamespace(prompt_tokens=1200, completion_tokens=80,
+                            prompt_tokens_details=SimpleNamespace(cached_tokens=1024))
+    cached = main.tokens_total.labels("advice", "cached")
+    before = cached.value
+    main.record_tokens("advice", usage)
+    main.record_tokens("advice", SimpleNamespace(prompt_tokens=10, completion_tokens=5, prompt_tokens_details=None))
+    assert cached.value - before == 1024
+    assert 'sentimentbot_tokens_total{mode="advice",kind="cached"}' in main.metrics.render()
@@ -0,0 +1,53 @@
+import time
+
+from rate_limiter import RateLimiter
+
+
+def test_burst_is_admitted_then_shed():
+    limiter = RateLimiter(user_rate=0.001, user_burst=3, chat_rate=None)
+    assert [limiter.admit(1, 1) for _ in range(4)] == [True, True, True, False]
+    assert limiter.accepted == 3
+    assert limiter.rejected["user"] == 1
+
+
+def test_rejected_message_costs_no_tokens():
+    limiter = RateLimiter(user_rate=0.001, user_burst=5, chat_rate=0.001, chat_burst=1)
+    assert limiter.admit(1, 1)
+    assert not limiter.admit(1, 1)
+    # The user bucket still has its tokens for another chat
+    assert limiter.admit(1, 2)
+    assert limiter.rejected == {"user": 0, "chat": 1, "global": 0}
+
+
+def test_global_bucket_is_shared():
+    limiter = RateLimiter(user_rate=None, chat_rate=None, global_rate=0.001, global_burst=2)
+    assert limiter.admit(1, 1) and limiter.admit(2, 2)
+    assert not limiter.admit(3, 3)
+
+
+def test_retry_after_waits_for_the_slowest_bucket():
+    limiter = RateLimiter(user_rate=0.5, user_burst=1, chat_rate=2.0, chat_burst=1)
+    assert limiter.retry_after(1, 1) == 0.0
+    limiter.admit(1, 1)
+    assert 1.9 < limiter.retry_after(1, 1) <= 2.0
+    assert limiter.retry_after(2, 2) == 0.0
+
+
+def test_chat_is_notified_once_until_admitted_again():
+    limiter = RateLimiter(user_rate=20.0, user_burst=1, chat_rate=None)
+    limiter.admit(1, 1)
+    assert not limiter.admit(1, 1)
+    assert limiter.should_notify(1)
+    assert not limiter.should_notify(1)
+    time.sleep(limiter.retry_after(1, 1))
+    assert limiter.admit(1, 1)
+    assert limiter.should_notify(1)
+
+
+def test_least_recently_used_buckets_are_dropped():
+    limiter = RateLimiter(user_rate=0.001, user_burst=1, chat_rate=None, max_buckets=2)
+    for user_id in (1, 2, 3):
+        limiter.admit(user_id, 1)
+    assert list(limiter._users) == [2, 3]
+    # Forgotten users start over with a full bucket
+    assert limiter.admit(1, 1)
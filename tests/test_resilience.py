@@ -0,0 +1,78 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from resilience import Hedger, RetryPolicy
+
+
+def warmed_up_hedger(latency=0.01):
+    hedger = Hedger(min_samples=3)
+    for _ in range(3):
+        hedger.record("advice", latency)
+    return hedger
+
+
+def test_backup_request_wins_when_the_first_is_slow():
+    delays = [1.0, 0.0]
+
+    async def call():
+        await asyncio.sleep(delays.pop(0))
+        return "reply"
+
+    async def scenario():
+        hedger = warmed_up_hedger()
+        return hedger, await hedger.run("advice", call)
+
+    hedger, result = asyncio.run(scenario())
+    assert result == "reply"
+    assert hedger.hedged == 1 and hedger.hedge_wins == 1
+
+
+def run_and_cancel(hedger, wait):
+    started = []
+
+    async def call():
+        started.append(asyncio.current_task())
+        await asyncio.sleep(10)
+
+    async def scenario():
+        caller = asyncio.create_task(hedger.run("advice", call))
+        await asyncio.sleep(wait)
+        caller.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await caller
+        await asyncio.sleep(0)
+        # Checked before asyncio.run() cancels whatever is left over
+        return [task.cancelled() for task in started]
+
+    return asyncio.run(scenario())
+
+
+def test_cancelled_caller_cancels_the_primary_before_hedging():
+    assert run_and_cancel(warmed_up_hedger(latency=1.0), 0.05) == [True]
+
+
+def test_cancelled_caller_cancels_both_requests():
+    # Past the hedging threshold, so the primary and the backup are both running
+    assert run_and_cancel(warmed_up_hedger(), 0.05) == [True, True]
+
+
+def test_both_requests_failing_raises_the_error():
+    async def call():
+        await asyncio.sleep(0.02)
+        raise ValueError("upstream error")
+
+    async def scenario():
+        await warmed_up_hedger().run("advice", call)
+
+    with pytest.raises(ValueError):
+        asyncio.run(scenario())
+
+
+def test_retry_after_header_takes_precedence():
+    policy = RetryPolicy(base_delay=0.5, max_delay=20.0)
+    error = SimpleNamespace(response=SimpleNamespace(headers={"retry-after": "3"}))
+    assert policy.delay(0, error) == 0.0
+    assert 3.0 <= policy.delay(1, error) <= 3.5
+    assert 0.0 <= policy.delay(4) <= 4.0
@@ -0,0 +1,45 @@
+import asyncio
+
+from sentiment_batcher import SentimentBatcher, build_batch_messages, parse_batch_reply
+
+
+def test_batch_prompt_extends_the_single_sentence_prompt():
+    messages = build_batch_messages(["hi", "bye"], "Analyse the sentiment.")
+    assert messages[0]["content"].startswith("Analyse the sentiment.")
+    assert messages[1]["content"] == 'Sentences:\n1. "hi"\n2. "bye"'
+
+
+def test_reply_gives_each_sentence_its_own_analysis():
+    reply = 'Sure: [{"score": 5, "analysis": "Positive, 5/10. Warm."}, {"score": 1}, "oops"]'
+    assert parse_batch_reply(reply, 3) == ["Positive, 5/10. Warm.", None, None]
+    assert parse_batch_reply(reply, 2) is None
+    assert parse_batch_reply("no json here", 1) is None
+
+
+def test_requests_are_grouped_and_answered_in_order():
+    batches = []
+
+    async def send_batch(sentences):
+        batches.append(sentences)
+        return [sentence.upper() for sentence in sentences]
+
+    async def scenario():
+        batcher = SentimentBatcher(send_batch, max_items=3, max_wait=0.01)
+        results = await asyncio.gather(*(batcher.submit(text) for text in "abcd"))
+        return batcher, results
+
+    batcher, results = asyncio.run(scenario())
+    assert results == ["A", "B", "C", "D"]
+    assert batches == [["a", "b", "c"], ["d"]]
+    assert not batcher._tasks
+
+
+def test_failed_batch_falls_back_for_every_sentence():
+    async def send_batch(sentences):
+        raise RuntimeError("upstream down")
+
+    async def scenario():
+        batcher = SentimentBatcher(send_batch, max_items=2, max_wait=0.01)
+        return await asyncio.gather(batcher.submit("a"), batcher.submit("b"))
+
+    assert asyncio.run(scenario()) == [None, None]
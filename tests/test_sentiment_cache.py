@@ -0,0 +1,75 @@
+import asyncio
+
+from sentiment_cache import SentimentCache, cache_key, normalize_text
+
+
+def test_normalized_inputs_share_a_key():
+    assert normalize_text("  HI!!! ") == "hi!"
+    assert normalize_text("So   tired...") == "so tired."
+    assert cache_key("Hi!!", "model") == cache_key(" hi! ", "model")
+    assert cache_key("hi", "model") != cache_key("hi", "other model")
+
+
+def test_emoticons_keep_their_own_key():
+    assert normalize_text("I am fine :)") != normalize_text("I am fine :(")
+    assert cache_key(":)") != cache_key(":(")
+    assert cache_key(";)") != cache_key(":)")
+    # Nothing left after normalizing, the raw text is used instead
+    assert cache_key(" ") != cache_key("\t")
+
+
+def test_lru_evicts_oldest_entry():
+    cache = SentimentCache(max_size=2)
+    cache.put("a", "1")
+    cache.put("b", "2")
+    cache.get("a")
+    cache.put("c", "3")
+    assert cache.get("b") is None
+    assert cache.get("a") == "1" and cache.get("c") == "3"
+
+
+def test_writes_are_batched_off_the_event_loop(tmp_path):
+    path = str(tmp_path / "cache.db")
+
+    async def scenario():
+        cache = SentimentCache(path=path, write_batch=3, write_delay=60)
+        cache.put("a", "1")
+        cache.put("b", "2")
+        # Below write_batch and long before write_delay nothing is committed yet
+        unwritten = len(cache._unwritten)
+        cache.put("c", "3")
+        await asyncio.gather(*cache._tasks)
+        return cache, unwritten
+
+    cache, unwritten = asyncio.run(scenario())
+    assert unwritten == 2
+    assert cache._db.execute("SELECT COUNT(*) FROM sentiment_cache").fetchone()[0] == 3
+    cache.close()
+
+
+def test_close_writes_pending_entries_and_they_survive_a_restart(tmp_path):
+    path = str(tmp_path / "cache.db")
+
+    async def scenario():
+        cache = SentimentCache(path=path, write_delay=60)
+        cache.put("a", "1")
+        cache.close()
+
+    asyncio.run(scenario())
+    reopened = SentimentCache(path=path)
+    assert reopened.get("a") == "1"
+    assert reopened.disk_hits == 1
+    reopened.close()
+
+
+def test_file_is_capped_to_max_rows(tmp_path):
+    path = str(tmp_path / "cache.db")
+    cache = SentimentCache(path=path, max_rows=5, prune_interval=0)
+    for i in range(20):
+        cache.put(f"key{i}", str(i))
+    rows = cache._db.execute("SELECT key FROM sentiment_cache").fetchall()
+    assert len(rows) == 5
+    # The rows expiring first go first, so the newest entries are kept
+    assert {key for key, in rows} == {f"key{i}" for i in range(15, 20)}
+    assert cache.pruned == 15
+    cache.close()
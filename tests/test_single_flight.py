@@ -0,0 +1,61 @@
+import asyncio
+
+import pytest
+
+from single_flight import SingleFlight
+
+
+def test_concurrent_callers_share_one_call():
+    calls = []
+
+    async def call():
+        calls.append(1)
+        await asyncio.sleep(0.02)
+        return "positive"
+
+    async def scenario():
+        flights = SingleFlight()
+        results = await asyncio.gather(*(flights.run("hello", call) for _ in range(3)), flights.run("bye", call))
+        return flights, results
+
+    flights, results = asyncio.run(scenario())
+    assert results == ["positive"] * 4
+    assert len(calls) == 2
+    assert flights.stats() == {"calls": 2, "joins": 2, "in_flight": 0, "max_joined": 2}
+
+
+def test_exception_reaches_every_joiner():
+    async def call():
+        await asyncio.sleep(0.02)
+        raise ValueError("upstream error")
+
+    async def scenario():
+        flights = SingleFlight()
+        results = await asyncio.gather(*(flights.run("hello", call) for _ in range(3)), return_exceptions=True)
+        return flights, results
+
+    flights, results = asyncio.run(scenario())
+    assert [type(result) for result in results] == [ValueError] * 3
+    assert flights.calls == 1 and flights.joins == 2
+    assert flights.stats()["in_flight"] == 0
+
+
+def test_cancelling_the_first_caller_keeps_the_call_for_the_others():
+    async def call():
+        await asyncio.sleep(0.05)
+        return "positive"
+
+    async def scenario():
+        flights = SingleFlight()
+        first = asyncio.create_task(flights.run("hello", call))
+        await asyncio.sleep(0)
+        second = asyncio.create_task(flights.run("hello", call))
+        await asyncio.sleep(0.01)
+        first.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await first
+        return flights, await second
+
+    flights, result = asyncio.run(scenario())
+    assert result == "positive"
+    assert flights.calls == 1 and flights.joins == 1
@@ -0,0 +1,296 @@
+import sqlite3
+import asyncio
+
+import pytest
+
+from conversation_store import ChatModes, ConversationStore
+from prompts import Prompt
+from state_backend import MemoryBackend, RedisBackend, SQLiteBackend
+
+PROMPT = Prompt("advice", "You are a dating coach.")
+
+
+class FakeRedis:
+    """
+    In-process stand-in for a Redis server, speaking enough of the protocol
+    for RedisBackend: hashes, DEL, EXPIRE/PERSIST and WATCH/MULTI/EXEC.
+    If interfere_on_multi is set to a key, the next MULTI on any connection
+    first changes that key, as another worker would.
+    """
+
+    def __init__(self):
+        self.hashes = {}
+        self.expiring = set()
+        self.changes = {}
+        self.interfere_on_multi = None
+        self.port = None
+        self._server = None
+
+    async def start(self) -> None:
+        self._server = await asyncio.start_server(self._handle_connection, "127.0.0.1", 0)
+        self.port = self._server.sockets[0].getsockname()[1]
+
+    async def stop(self) -> None:
+        self._server.close()
+        await self._server.wait_closed()
+
+    def _change(self, key) -> None:
+        self.changes[key] = self.changes.get(key, 0) + 1
+
+    async def _handle_connection(self, reader, writer) -> None:
+        watched = {}
+        queued = None
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                args = []
+                for _ in range(int(line[1:])):
+                    length = int((await reader.readline())[1:])
+                    args.append((await reader.readexactly(length + 2))[:-2].decode("utf-8"))
+                command = args[0].upper()
+                if command == "WATCH":
+                    watched = {key: self.changes.get(key, 0) for key in args[1:]}
+                    reply = "OK"
+                elif command == "UNWATCH":
+                    watched = {}
+                    reply = "OK"
+                elif command == "MULTI":
+                    if self.interfere_on_multi is not None:
+                        key, self.interfere_on_multi = self.interfere_on_multi, None
+                        self.hashes.setdefault(key, {})["d"] = "changed by another worker"
+                        self._change(key)
+                    queued = []
+                    reply = "OK"
+                elif command == "EXEC":
+                    if any(self.changes.get(key, 0) != seen for key, seen in watched.items()):
+                        reply = None
+                    else:
+                        reply = [self._run(*queued_args) for queued_args in queued]
+                    watched = {}
+                    queued = None
+                elif queued is not None:
+                    queued.append(args)
+                    reply = "QUEUED"
+                else:
+                    reply = self._run(*args)
+                writer.write(self._encode(reply))
+                await writer.drain()
+        finally:
+            writer.close()
+
+    def _run(self, command, *args):
+        command = command.upper()
+        key = args[0]
+        if command == "HGET":
+            return self.hashes.get(key, {}).get(args[1])
+        if command == "HMGET":
+            return [self.hashes.get(key, {}).get(field) for field in args[1:]]
+        if command == "HSET":
+            fields = self.hashes.setdefault(key, {})
+            fields.update(zip(args[1::2], args[2::2]))
+        elif command == "DEL":
+            self.hashes.pop(key, None)
+        elif command == "EXPIRE":
+            self.expiring.add(key)
+        elif command == "PERSIST":
+            self.expiring.discard(key)
+        else:
+            raise AssertionError(f"Unexpected command {command}")
+        self._change(key)
+        return 1
+
+    def _encode(self, reply) -> bytes:
+        if reply is None:
+            return b"$-1\r\n"
+        if reply == "OK" or reply == "QUEUED":
+            return f"+{reply}\r\n".encode()
+        if isinstance(reply, int):
+            return b":%d\r\n" % reply
+        if isinstance(reply, list):
+            return b"*%d\r\n" % len(reply) + b"".join(self._encode(item) for item in reply)
+        data = str(reply).encode("utf-8")
+        return b"$%d\r\n%s\r\n" % (len(data), data)
+
+
+class Racing:
+    """
+    Wraps a backend and runs race() right before the first put, so another
+    worker's write lands between this worker's read and its compare-and-set.
+    """
+
+    def __init__(self, backend, race):
+        self.backend = backend
+        self.race = race
+
+    async def get(self, key):
+        return await self.backend.get(key)
+
+    async def put(self, key, value, version=None, expire=True):
+        if self.race is not None:
+            race, self.race = self.race, None
+            await race()
+        return await self.backend.put(key, value, version, expire)
+
+    async def delete(self, key):
+        await self.backend.delete(key)
+
+
+@pytest.fixture(params=["memory", "sqlite", "redis"])
+def with_backend(request, tmp_path):
+    """
+    Runs scenario(backend) against each backend, Redis being the FakeRedis server.
+    """
+
+    def run(scenario):
+        async def wrapper():
+            if request.param == "memory":
+                return await scenario(MemoryBackend())
+            if request.param == "sqlite":
+                backend = SQLiteBackend(str(tmp_path / "state.db"), ttl=60)
+                try:
+                    return await scenario(backend)
+                finally:
+                    await backend.close()
+            server = FakeRedis()
+            await server.start()
+            backend = RedisBackend(port=server.port, ttl=60)
+            try:
+                return await scenario(backend)
+            finally:
+                await backend.close()
+                await server.stop()
+
+        return asyncio.run(wrapper())
+
+    return run
+
+
+def test_put_is_compare_and_set(with_backend):
+    async def scenario(backend):
+        return [
+            await backend.put("k", "a", 0),
+            await backend.put("k", "b", 0),
+            await backend.put("k", "b", 1),
+            await backend.put("k", "c", 1),
+            await backend.get("k"),
+            await backend.put("k", "d"),
+            await backend.get("missing"),
+        ]
+
+    assert with_backend(scenario) == [1, None, 2, None, ("b", 2), 3, (None, 0)]
+
+
+def test_conflicting_appends_from_two_workers_keep_both_turns(with_backend):
+    async def scenario(backend):
+        other = ConversationStore(backend=backend)
+        store = ConversationStore(backend=Racing(backend, lambda: other.append(1, "user", "from the other worker")))
+        await other.start(1, PROMPT)
+        await store.append(1, "user", "from this worker")
+        conversation = await ConversationStore(backend=backend).get(1)
+        return store.conflicts, [turn.content for turn in conversation.turns]
+
+    conflicts, turns = with_backend(scenario)
+    assert conflicts == 1
+    assert turns == ["from the other worker", "from this worker"]
+
+
+def test_redis_transaction_aborted_by_a_concurrent_write_is_a_conflict():
+    async def scenario():
+        server = FakeRedis()
+        await server.start()
+        backend = RedisBackend(port=server.port)
+        version = await backend.put("k", "a", 0)
+        server.interfere_on_multi = "sentimentbot:k"
+        conflict = await backend.put("k", "b", version)
+        await backend.close()
+        await server.stop()
+        return conflict, server.hashes["sentimentbot:k"]["d"]
+
+    assert asyncio.run(scenario()) == (None, "changed by another worker")
+
+
+def test_modes_do_not_expire_with_conversations(tmp_path):
+    path = str(tmp_path / "state.db")
+
+    async def write():
+        backend = SQLiteBackend(path, ttl=60)
+        await ChatModes(backend).set(1, "rizz")
+        await ConversationStore(backend=backend).start(1, PROMPT)
+        await backend.close()
+
+    async def read():
+        backend = SQLiteBackend(path, ttl=60)
+        result = await ChatModes(backend).get(1), await ConversationStore(backend=backend).get(1)
+        await backend.close()
+        return result
+
+    asyncio.run(write())
+    with sqlite3.connect(path) as db:
+        db.execute("UPDATE chat_state SET updated = 0")
+    assert asyncio.run(read()) == ("rizz", None)
+
+
+def test_redis_modes_are_stored_without_expiry():
+    async def scenario():
+        server = FakeRedis()
+        await server.start()
+        backend = RedisBackend(port=server.port, ttl=60)
+        await ChatModes(backend).set(1, "advice")
+        await ConversationStore(backend=backend).start(1, PROMPT)
+        await backend.close()
+        await server.stop()
+        return server.expiring
+
+    assert asyncio.run(scenario()) == {"sentimentbot:conversation:1"}
+
+
+def test_sqlite_files_from_before_expiry_flags_are_migrated(tmp_path):
+    path = str(tmp_path / "state.db")
+    with sqlite3.connect(path) as db:
+        db.execute(
+            "CREATE TABLE chat_state ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, version INTEGER NOT NULL, updated REAL NOT NULL)"
+        )
+        db.execute("INSERT INTO chat_state VALUES ('mode:1', 'advice', 1, 0)")
+
+    async def scenario():
+        backend = SQLiteBackend(path, ttl=60)
+        modes = ChatModes(backend)
+        # Old rows expire as before, new modes are kept
+        expired = await modes.get(1)
+        await modes.set(1, "analysis")
+        await backend.close()
+        with sqlite3.connect(path) as db:
+            db.execute("UPDATE chat_state SET updated = 0")
+        backend = SQLiteBackend(path, ttl=60)
+        kept = await ChatModes(backend).get(1)
+        await backend.close()
+        return expired, kept
+
+    assert asyncio.run(scenario()) == (None, "analysis")
+
+
+def test_sqlite_entries_expire_while_the_bot_runs(tmp_path):
+    path = str(tmp_path / "state.db")
+
+    async def scenario():
+        backend = SQLiteBackend(path, ttl=0.1, prune_interval=0.1)
+        await backend.put("conversation:1", "old", 0)
+        await backend.put("mode:1", "advice", expire=False)
+        await asyncio.sleep(0.3)
+        expired = await backend.get("conversation:1")
+        kept = await backend.get("mode:1")
+        # Starting the conversation again is not blocked by the expired row
+        recreated = await backend.put("conversation:1", "new", 0)
+        await backend.close()
+        return expired, kept, recreated, backend.pruned
+
+    expired, kept, recreated, pruned = asyncio.run(scenario())
+    assert expired == (None, 0)
+    assert kept == ("advice", 1)
+    assert recreated == 1
+    assert pruned == 1
+    with sqlite3.connect(path) as db:
+        assert db.execute("SELECT COUNT(*) FROM chat_state").fetchone()[0] == 2
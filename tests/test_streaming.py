@@ -0,0 +1,71 @@
+import asyncio
+from types import SimpleNamespace
+
+from telegram.error import BadRequest, NetworkError
+
+from streaming import TelegramStreamer
+
+
+class FakeMessage:
+    """
+    Stands in for the sent Telegram message. Edits with parse_mode="HTML" are
+    rejected when reject_html is set, and the first fail_edits edits raise NetworkError.
+    """
+
+    def __init__(self, chat, reject_html=False, fail_edits=0):
+        self.chat = chat
+        self.reject_html = reject_html
+        self.fail_edits = fail_edits
+
+    async def edit_text(self, text, parse_mode=None):
+        if self.fail_edits:
+            self.fail_edits -= 1
+            raise NetworkError("connection reset")
+        if parse_mode == "HTML" and self.reject_html:
+            raise BadRequest("Can't parse entities")
+        self.chat.shown.append(text)
+
+
+class FakeChat:
+    def __init__(self, **message_options):
+        self.shown = []
+        self.message_options = message_options
+
+    async def reply_text(self, text, parse_mode=None):
+        self.shown.append(text)
+        return FakeMessage(self, **self.message_options)
+
+
+def make_streamer(chat, interval=0.01):
+    return TelegramStreamer(SimpleNamespace(message=chat), interval=interval)
+
+
+def test_rejected_html_falls_back_to_text_without_markup():
+    async def scenario():
+        chat = FakeChat(reject_html=True)
+        streamer = make_streamer(chat)
+        await streamer.update("Tom & Jerry")
+        await streamer.finish("<b>Tom</b> &amp; Jerry", "HTML")
+        return chat.shown
+
+    shown = asyncio.run(scenario())
+    assert shown[-1] == "Tom & Jerry"
+    assert not any("<b>" in text or "&amp;" in text for text in shown)
+
+
+def test_network_error_while_previewing_does_not_kill_the_stream():
+    async def scenario():
+        chat = FakeChat(fail_edits=1)
+        streamer = make_streamer(chat)
+        await streamer.update("Hello")
+        await streamer.update("Hello there")
+        # Long enough for the flusher to hit the error and then retry
+        await asyncio.sleep(0.3)
+        flusher_alive = not streamer._flusher.done()
+        await streamer.finish("Hello there, friend")
+        return chat.shown, flusher_alive
+
+    shown, flusher_alive = asyncio.run(scenario())
+    assert flusher_alive
+    assert "Hello there" in shown
+    assert shown[-1] == "Hello there, friend"
@@ -0,0 +1,57 @@
+from telegram_format import html_to_text, markdown_to_html, split_html, split_text, visible_length
+
+
+def test_stray_markup_characters_are_escaped():
+    assert markdown_to_html("a < b && c > d") == "a &lt; b &amp;&amp; c &gt; d"
+    assert markdown_to_html("<b>not a tag</b>") == "&lt;b&gt;not a tag&lt;/b&gt;"
+
+
+def test_inline_formatting():
+    assert markdown_to_html("**bold** and __bold__") == "<b>bold</b> and <b>bold</b>"
+    assert markdown_to_html("*italic* and _italic_") == "<i>italic</i> and <i>italic</i>"
+    assert markdown_to_html("~~gone~~ `x < 1`") == "<s>gone</s> <code>x &lt; 1</code>"
+    # Underscores and asterisks inside words are not formatting
+    assert markdown_to_html("snake_case_name 2*3*4") == "snake_case_name 2*3*4"
+
+
+def test_code_blocks_are_not_formatted_inside():
+    assert markdown_to_html("```python\n**x** = 1\n```") == '<pre><code class="language-python">**x** = 1</code></pre>'
+
+
+def test_links_only_keep_safe_schemes():
+    assert markdown_to_html("[site](https://example.com)") == '<a href="https://example.com">site</a>'
+    assert markdown_to_html("[run](javascript:alert)") == "run (javascript:alert)"
+
+
+def test_headings_and_bullets():
+    assert markdown_to_html("# Title\n- one\n* two") == "<b>Title</b>\n• one\n• two"
+
+
+def test_split_keeps_every_chunk_within_the_limit():
+    text = "\n".join(f"line {i} " + "word " * 15 for i in range(100))
+    chunks = split_text(text, limit=200)
+    assert all(len(chunk) <= 200 for chunk in chunks)
+    assert " ".join(" ".join(chunks).split()) == " ".join(text.split())
+
+
+def test_split_counts_emoji_as_two_units():
+    chunks = split_text("😊" * 150, limit=100)
+    assert [len(chunk) for chunk in chunks] == [50, 50, 50]
+
+
+def test_split_html_reopens_tags_in_the_next_chunk():
+    html = "<b>" + "bold words " * 30 + "</b>"
+    chunks = split_html(html, limit=100)
+    assert len(chunks) > 1
+    for chunk in chunks:
+        assert chunk.startswith("<b>") and chunk.endswith("</b>")
+        assert visible_length(chunk) <= 100
+
+
+def test_entities_count_as_one_character():
+    assert visible_length("<b>Tom &amp; Jerry</b>") == len("Tom & Jerry")
+    assert split_html("&amp;" * 100, limit=100) == ["&amp;" * 100]
+
+
+def test_html_to_text_gives_what_the_user_sees():
+    assert html_to_text(markdown_to_html("**Tom** & <Jerry>")) == "Tom & <Jerry>"
@@ -0,0 +1,126 @@
+import json
+import random
+import asyncio
+from types import SimpleNamespace
+
+import httpx
+from telegram.ext import ApplicationBuilder, MessageHandler, filters
+
+from benchmarks.load_test import FakeTelegram
+from chat_scheduler import ChatScheduler
+from webhook import WebhookServer
+
+SECRET = "s3cret"
+
+
+def make_update(update_id: int, chat_id: int, text: str) -> dict:
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": 0,
+            "chat": {"id": chat_id, "type": "private"},
+            "from": {"id": chat_id, "is_bot": False, "first_name": "user"},
+            "text": text,
+        },
+    }
+
+
+async def echo(update, context):
+    # Later updates may finish first unless they are kept in order
+    await asyncio.sleep(random.uniform(0, 0.02))
+    await update.message.reply_text(update.message.text.upper())
+
+
+def test_updates_posted_by_telegram_are_answered():
+    replies = []
+
+    async def scenario():
+        telegram = FakeTelegram(0.0, lambda chat_id, text: replies.append((chat_id, text)))
+        await telegram.server.start()
+        app = (
+            ApplicationBuilder()
+            .token("1:test")
+            .base_url(f"http://127.0.0.1:{telegram.server.port}/bot")
+            .concurrent_updates(ChatScheduler())
+            .build()
+        )
+        app.add_handler(MessageHandler(filters.TEXT, echo))
+        await app.initialize()
+        server = WebhookServer(app, host="127.0.0.1", port=0, secret_token=SECRET, workers=4)
+        await server.start()
+        url = f"http://127.0.0.1:{server.port}/telegram"
+        headers = {"X-Telegram-Bot-Api-Secret-Token": SECRET}
+        async with httpx.AsyncClient() as sender:
+            statuses = [
+                (await sender.post(url, json=make_update(i, 100 + i % 2, f"hi {i}"), headers=headers)).status_code
+                for i in range(1, 7)
+            ]
+            statuses += [
+                (await sender.post(url, json=make_update(9, 100, "x"), headers={})).status_code,
+                (await sender.post(url + "x", json=make_update(9, 100, "x"), headers=headers)).status_code,
+                (await sender.get(url, headers=headers)).status_code,
+                (await sender.post(url, content=b"{not json", headers=headers)).status_code,
+            ]
+        await server.stop()
+        await app.shutdown()
+        await telegram.server.stop()
+        return statuses, server.stats()
+
+    statuses, stats = asyncio.run(scenario())
+    assert statuses == [200] * 6 + [403, 404, 405, 400]
+    # Each chat is answered in the order it wrote
+    assert [text for chat_id, text in replies if chat_id == 100] == ["HI 2", "HI 4", "HI 6"]
+    assert [text for chat_id, text in replies if chat_id == 101] == ["HI 1", "HI 3", "HI 5"]
+    assert stats["received"] == stats["processed"] == 6
+
+
+def test_full_queue_answers_503():
+    release = asyncio.Event()
+
+    async def process(update):
+        await release.wait()
+
+    async def scenario():
+        server = WebhookServer(SimpleNamespace(bot=None), host="127.0.0.1", port=0, workers=1, queue_size=1,
+                               process=process)
+        await server.start()
+        url = f"http://127.0.0.1:{server.port}/telegram"
+        async with httpx.AsyncClient() as sender:
+            statuses = []
+            for i in range(3):
+                statuses.append((await sender.post(url, json=make_update(i, 100, "hi"))).status_code)
+                # Let the worker pick up the first update
+                await asyncio.sleep(0.01)
+        release.set()
+        await server.stop()
+        return statuses, server.stats()
+
+    statuses, stats = asyncio.run(scenario())
+    assert statuses == [200, 200, 503]
+    assert stats["rejected"] == 1 and stats["processed"] == 2
+
+
+def test_silent_clients_are_disconnected():
+    async def scenario():
+        server = WebhookServer(SimpleNamespace(bot=None), host="127.0.0.1", port=0, read_timeout=0.1,
+                               process=lambda update: asyncio.sleep(0))
+        await server.start()
+        # Stops in the middle of the headers
+        reader, writer = await asyncio.open_connection("127.0.0.1", server.port)
+        writer.write(b"POST /telegram HTTP/1.1\r\nContent-Length: 2\r\n")
+        partial = await asyncio.wait_for(reader.read(), 2)
+        writer.close()
+        # Finishes a request, then idles on the keep-alive connection
+        reader, writer = await asyncio.open_connection("127.0.0.1", server.port)
+        body = json.dumps(make_update(1, 100, "hi")).encode()
+        writer.write(b"POST /telegram HTTP/1.1\r\nContent-Length: %d\r\n\r\n" % len(body) + body)
+        idle = await asyncio.wait_for(reader.read(), 2)
+        writer.close()
+        await server.stop()
+        return partial, idle, server.stats()
+
+    partial, idle, stats = asyncio.run(scenario())
+    assert partial == b""
+    assert idle.startswith(b"HTTP/1.1 200 OK")
+    assert stats["timed_out"] == 2
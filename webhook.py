@@ -0,0 +1,200 @@
+import json
+import signal
+import asyncio
+import logging
+import secrets
+
+from telegram import Update
+
+logger = logging.getLogger(__name__)
+
+MAX_BODY_SIZE = 1024 * 1024
+REASONS = {200: "OK", 400: "Bad Request", 403: "Forbidden", 404: "Not Found",
+           405: "Method Not Allowed", 413: "Payload Too Large", 503: "Service Unavailable"}
+
+
+class WebhookServer:
+    """
+    Small HTTP server receiving Telegram updates for webhook mode.
+
+    Every update is acknowledged as soon as it is queued, then processed by
+    one of workers background tasks. A worker takes the next update only
+    once the previous one has been handled, so the queue holds at most
+    queue_size waiting updates; when it is full the server answers 503 so
+    Telegram delivers the update again later. If secret_token
+    is set, requests without a matching X-Telegram-Bot-Api-Secret-Token
+    header are refused. A client that sends nothing for read_timeout seconds,
+    whether in the middle of a request or idle on a keep-alive connection, is
+    disconnected so slow or stalled clients can't hold connections open.
+
+    process defaults to handling the update through the application's update
+    processor, so updates keep the per-chat ordering of polling mode; any
+    coroutine taking an Update can be given instead.
+    """
+
+    def __init__(self, app, host: str = "0.0.0.0", port: int = 8443, path: str = "/telegram",
+                 secret_token: str = None, workers: int = 64, queue_size: int = 10000, process=None,
+                 read_timeout: float = 10.0):
+        self.app = app
+        self.host = host
+        self.port = port
+        self.path = path
+        self.secret_token = secret_token
+        self.workers = workers
+        self.read_timeout = read_timeout
+        self.queue = asyncio.Queue(queue_size)
+        self.process = process if process is not None else self._process
+        self._server = None
+        self._tasks = []
+        self.received = 0
+        self.rejected = 0
+        self.processed = 0
+        self.failed = 0
+        self.timed_out = 0
+
+    async def start(self) -> None:
+        self._server = await asyncio.start_server(self._handle_connection, self.host, self.port)
+        # Port 0 picks a free port, report the real one
+        self.port = self._server.sockets[0].getsockname()[1]
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        logger.info("Webhook server listening on %s:%d%s", self.host, self.port, self.path)
+
+    async def stop(self) -> None:
+        """
+        Stops accepting updates and waits for the queued ones to be processed.
+        """
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+        await self.queue.join()
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def _worker(self) -> None:
+        while True:
+            data = await self.queue.get()
+            try:
+                await self.process(Update.de_json(data, self.app.bot))
+                self.processed += 1
+            except Exception as e:
+                self.failed += 1
+                logger.error("Error while processing webhook update: %s", e)
+            finally:
+                self.queue.task_done()
+
+    async def _process(self, update) -> None:
+        await self.app.update_processor.process_update(update, self.app.process_update(update))
+
+    async def _handle_connection(self, reader, writer) -> None:
+        try:
+            keep_alive = True
+            while keep_alive:
+                request_line = await self._read(reader.readline())
+                if not request_line:
+                    break
+                method, target, version = (request_line.decode("latin-1").split() + ["", "", ""])[:3]
+                headers = {}
+                while True:
+                    line = await self._read(reader.readline())
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                keep_alive = version == "HTTP/1.1" and headers.get("connection", "").lower() != "close"
+
+                length = int(headers.get("content-length") or 0)
+                if length > MAX_BODY_SIZE:
+                    await self._respond(writer, 413, False)
+                    break
+                body = await self._read(reader.readexactly(length)) if length else b""
+                await self._respond(writer, self._accept(method, target, headers, body), keep_alive)
+        except asyncio.TimeoutError:
+            self.timed_out += 1
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def _read(self, read):
+        """
+        Awaits one read from the client, raising asyncio.TimeoutError after read_timeout seconds.
+        """
+        return await asyncio.wait_for(read, self.read_timeout)
+
+    def _accept(self, method: str, target: str, headers: dict, body: bytes) -> int:
+        """
+        Queues the update in a request and returns the HTTP status to answer with.
+        """
+        if target.split("?")[0] != self.path:
+            return 404
+        if method != "POST":
+            return 405
+        if self.secret_token is not None and not secrets.compare_digest(
+                headers.get("x-telegram-bot-api-secret-token", ""), self.secret_token):
+            return 403
+        try:
+            data = json.loads(body)
+        except ValueError:
+            return 400
+        try:
+            self.queue.put_nowait(data)
+        except asyncio.QueueFull:
+            self.rejected += 1
+            return 503
+        self.received += 1
+        return 200
+
+    async def _respond(self, writer, status: int, keep_alive: bool) -> None:
+        writer.write(
+            f"HTTP/1.1 {status} {REASONS.get(status, '')}\r\n"
+            f"Content-Length: 0\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode("latin-1")
+        )
+        await writer.drain()
+
+    def stats(self) -> dict:
+        return {
+            "received": self.received,
+            "rejected": self.rejected,
+            "processed": self.processed,
+            "failed": self.failed,
+            "timed_out": self.timed_out,
+            "queue_depth": self.queue.qsize(),
+        }
+
+
+async def run_webhook(app, url: str, **kwargs) -> None:
+    """
+    Runs the bot in webhook mode until it is interrupted: registers url with
+    Telegram, serves updates with a WebhookServer and shuts down cleanly.
+    kwargs are passed on to WebhookServer.
+    """
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except NotImplementedError:
+            pass
+
+    server = WebhookServer(app, **kwargs)
+    await app.initialize()
+    if app.post_init is not None:
+        await app.post_init(app)
+    await app.start()
+    await server.start()
+    await app.bot.set_webhook(url, secret_token=server.secret_token, allowed_updates=Update.ALL_TYPES)
+    try:
+        await stop.wait()
+    finally:
+        await server.stop()
+        logger.info("Webhook stats: %s", server.stats())
+        await app.stop()
+        if app.post_stop is not None:
+            await app.post_stop(app)
+        await app.shutdown()
+        if app.post_shutdown is not None:
+            await app.post_shutdown(app)